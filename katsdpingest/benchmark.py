@@ -0,0 +1,377 @@
+"""Whole-pipeline throughput benchmark for ingest.
+
+This drives :class:`~katsdpingest.ingest_session.CBFIngest` with synthetic
+frames, supplied as fast as the pipeline will accept them, and sends the
+L0 and signal display output to in-process sinks that drain and count it.
+Networking is thus excluded, but everything from frame handling through
+signal processing to heap encoding is measured.
+
+Each configuration is normally run in a fresh process (see
+:func:`run_matrix`) so that the peak resident set size can be attributed
+to it.
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import itertools
+import logging
+import multiprocessing
+import resource
+import time
+from collections import defaultdict
+from typing import Dict, List, Sequence, Mapping, Optional, Any   # noqa: F401
+from unittest import mock
+
+import numpy as np
+import spead2
+import spead2.recv.asyncio
+import spead2.send.asyncio
+import katpoint
+import katsdptelstate.aio
+from katsdptelstate.endpoint import Endpoint
+
+from . import cbf_generator, sigproc_host
+from .ingest_server import IngestDeviceServer
+from .ingest_session import ChannelRanges, SystemAttrs
+from .receiver import Frame
+from .utils import Range, cbf_telstate_view
+
+
+_logger = logging.getLogger(__name__)
+#: Stages whose latency is measured (names of :class:`.CBFIngest` job methods)
+STAGES = ['_frame_job', '_flush_output_job', '_flush_sd_job']
+_CBF_NAME = 'i0_baseline_correlation_products'
+_ANTENNA_TEMPLATE = ('{}, -30:42:39.8, 21:26:38.0, 1035.0, 13.5, {} {} 1.0, '
+                     '0:00:00.0 0 0:00:00.0 0:00:00.0 0:00:00.0 0:00:00.0 0:00:00.0, 1.14')
+
+
+class BenchmarkConfig:
+    """Parameters for a single benchmark run.
+
+    Parameters
+    ----------
+    antennas
+        Number of antennas (dual-polarised)
+    channels
+        Number of CBF channels, all of which are processed
+    continuum_factor
+        Number of channels averaged together for the L0 continuum product
+    sd_int_time
+        Signal display integration time, in units of input dumps
+    output_int_time
+        L0 integration time, in units of input dumps
+    dumps
+        Number of input dumps to process
+    n_xengs
+        Number of X engines (items per frame)
+    cpu
+        Use the NumPy implementation of the signal processing instead of a GPU
+    cpu_processes
+        Number of processes for the NumPy implementation
+    """
+    def __init__(self, antennas: int, channels: int, continuum_factor: int = 16,
+                 sd_int_time: int = 1, output_int_time: int = 1, dumps: int = 20,
+                 n_xengs: int = 16, cpu: bool = False, cpu_processes: int = 1) -> None:
+        self.antennas = antennas
+        self.channels = channels
+        self.continuum_factor = continuum_factor
+        self.sd_int_time = sd_int_time
+        self.output_int_time = output_int_time
+        self.dumps = dumps
+        self.n_xengs = n_xengs
+        self.cpu = cpu
+        self.cpu_processes = cpu_processes
+
+    def __repr__(self) -> str:
+        return ('BenchmarkConfig(antennas={0.antennas}, channels={0.channels}, '
+                'continuum_factor={0.continuum_factor}, sd_int_time={0.sd_int_time}, '
+                'output_int_time={0.output_int_time}, dumps={0.dumps}, '
+                'n_xengs={0.n_xengs}, cpu={0.cpu}, cpu_processes={0.cpu_processes})'
+                .format(self))
+
+
+class SyntheticReceiver:
+    """Replacement for :class:`katsdpingest.ingest_session.TelstateReceiver`.
+
+    It yields `n_dumps` frames with no delay, all referencing the same data.
+    The remaining constructor arguments are those of the receiver.
+
+    Parameters
+    ----------
+    n_dumps
+        Number of frames to yield
+    data
+        Visibilities for all CBF channels, indexed by channel, baseline and
+        real/imag
+    """
+    def __init__(self, n_dumps: int, data: np.ndarray, *args, **kwargs) -> None:
+        self.cbf_attr = kwargs['cbf_attr']
+        self.interval = self.cbf_attr['ticks_between_spectra'] * self.cbf_attr['n_accs']
+        self.timestamp_base = 1000 * self.interval
+        self.recorder = None
+        self._n_dumps = n_dumps
+        self._next_frame = 0
+        self._stopped = False
+        channel_range = kwargs['channel_range']
+        heap_channels = self.cbf_attr['n_chans_per_substream']
+        self._items = [data[start : start + heap_channels]
+                       for start in range(channel_range.start, channel_range.stop, heap_channels)]
+
+    def stop(self) -> None:
+        self._stopped = True
+
+    async def join(self) -> None:
+        pass
+
+    async def get(self) -> Frame:
+        await asyncio.sleep(0)
+        if self._stopped or self._next_frame >= self._n_dumps:
+            raise spead2.Stopped('end of synthetic frames')
+        idx = self._next_frame
+        frame = Frame(idx, self.timestamp_base + idx * self.interval, len(self._items))
+        for i, item in enumerate(self._items):
+            frame.add_item(i, item)
+        self._next_frame += 1
+        return frame
+
+
+class Sink:
+    """Drains in-process streams standing in for the output UDP streams.
+
+    Call it with the arguments of :class:`spead2.send.asyncio.UdpStream` to
+    get a replacement stream.
+    """
+    def __init__(self) -> None:
+        self.heaps = 0
+        self.bytes = 0
+        self._tasks = []     # type: List[asyncio.Task]
+
+    def __call__(self, thread_pool: spead2.ThreadPool, endpoints: Sequence[Any],
+                 config: spead2.send.StreamConfig,
+                 *args, **kwargs) -> spead2.send.asyncio.InprocStream:
+        queue = spead2.InprocQueue()
+        rx = spead2.recv.asyncio.Stream(
+            spead2.ThreadPool(), spead2.recv.StreamConfig(stop_on_stop_item=False))
+        rx.add_inproc_reader(queue)
+        self._tasks.append(asyncio.get_event_loop().create_task(self._drain(rx)))
+        # Remove rate limiting, as we want to measure throughput
+        config = spead2.send.StreamConfig(max_packet_size=config.max_packet_size,
+                                          max_heaps=config.max_heaps)
+        return spead2.send.asyncio.InprocStream(thread_pool, [queue], config)
+
+    async def _drain(self, rx: spead2.recv.asyncio.Stream) -> None:
+        async for heap in rx:
+            self.heaps += 1
+            self.bytes += sum(len(memoryview(item)) for item in heap.get_items())
+
+    def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+
+
+class _StageTimer:
+    """Records the time from creation to completion of job coroutines."""
+    def __init__(self) -> None:
+        self.latencies = defaultdict(list)    # type: Dict[str, List[float]]
+
+    def wrap(self, name: str, func):
+        async def wrapper(*args, **kwargs):
+            start = time.monotonic()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                self.latencies[name].append(time.monotonic() - start)
+        return wrapper
+
+
+def _make_args(config: BenchmarkConfig) -> argparse.Namespace:
+    cbf_spead = [Endpoint('239.102.250.{}'.format(i), 7148) for i in range(config.n_xengs)]
+    return argparse.Namespace(
+        sdisp_spead=[Endpoint('127.0.0.2', 7149)],
+        sdisp_interface=None,
+        cbf_spead=cbf_spead,
+        cbf_interface=None,
+        cbf_ibv=False,
+        cbf_name=_CBF_NAME,
+        l0_spectral_spead=[Endpoint('239.102.251.0', 7148)],
+        l0_spectral_interface=None,
+        l0_spectral_name='sdp_l0',
+        l0_continuum_spead=[Endpoint('239.102.252.0', 7148)],
+        l0_continuum_interface=None,
+        l0_continuum_name='sdp_l0_continuum',
+        output_int_time=0.0,       # Filled in later
+        output_batch=False,
+        sd_int_time=0.0,           # Filled in later
+        antenna_mask=None,
+        output_channels=Range(0, config.channels),
+        sd_output_channels=Range(0, config.channels),
+        continuum_factor=config.continuum_factor,
+        sd_continuum_factor=config.continuum_factor,
+        guard_channels=0,
+        input_streams=1,
+        input_max_packet_size=9200,
+        input_buffer=32 * 1024**2,
+        input_zero_copy=False,
+        input_threads=False,
+        input_max_active_frames=None,
+        input_queue_frames=1,
+        input_overflow='block',
+        input_affinity=None,
+        output_affinity=None,
+        sd_affinity=None,
+        numa_local=False,
+        cbf_replay=[],
+        cbf_replay_speedup=0.0,
+        sd_spead_rate=0.0,
+        sd_descriptor_interval=1,
+        excise=False,
+        use_data_suspect=False,
+        servers=1,
+        server_id=1,
+        clock_ratio=0.0,
+        host='127.0.0.1',
+        port=0,
+        name=None
+    )
+
+
+async def run_benchmark(config: BenchmarkConfig, context=None) -> Dict[str, Any]:
+    """Run a single benchmark in the current process.
+
+    Parameters
+    ----------
+    config
+        Benchmark parameters
+    context
+        Context for signal processing. If not specified, one is created
+        according to `config`.
+
+    Returns
+    -------
+    results
+        Dictionary of measurements, suitable for JSON serialisation
+    """
+    if context is None:
+        if config.cpu:
+            context = sigproc_host.HostContext(config.cpu_processes)
+        else:
+            from katsdpsigproc import accel
+            context = accel.create_some_context(interactive=False)
+    cbf_attr = cbf_generator.make_cbf_attr(config.antennas, config.channels, config.n_xengs)
+    args = _make_args(config)
+    args.output_int_time = config.output_int_time * cbf_attr['int_time']
+    args.sd_int_time = config.sd_int_time * cbf_attr['int_time']
+
+    telstate = katsdptelstate.aio.TelescopeState()
+    await telstate.set(_CBF_NAME + '_src_streams', ['i0_antenna_channelised_voltage'])
+    await telstate.set('i0_antenna_channelised_voltage_instrument_dev_name', 'i0')
+    telstate_cbf = await cbf_telstate_view(telstate, _CBF_NAME)
+    antennas = [katpoint.Antenna(_ANTENNA_TEMPLATE.format('m{:03}'.format(i), 10 * i, 0))
+                for i in range(config.antennas)]
+    system_attrs = SystemAttrs(cbf_attr, None, None, antennas)
+    channel_ranges = ChannelRanges(
+        args.servers, args.server_id - 1, config.channels, config.continuum_factor,
+        args.sd_continuum_factor, len(args.cbf_spead), args.guard_channels,
+        args.output_channels, args.sd_output_channels)
+
+    rs = np.random.RandomState(seed=1)
+    shape = (config.channels, len(cbf_attr['bls_ordering']), 2)
+    data = rs.randint(-1000, 1000, size=shape, dtype=np.int32)
+    sink = Sink()
+    timer = _StageTimer()
+    with mock.patch('spead2.send.asyncio.UdpStream', side_effect=sink), \
+            mock.patch('katsdpingest.ingest_session.TelstateReceiver',
+                       side_effect=lambda *args, **kwargs:
+                       SyntheticReceiver(config.dumps, data, *args, **kwargs)):
+        server = IngestDeviceServer(args, telstate_cbf, channel_ranges, system_attrs, context,
+                                    host=args.host, port=args.port)
+        ingest = server.cbf_ingest
+        for stage in STAGES:
+            setattr(ingest, stage, timer.wrap(stage, getattr(ingest, stage)))
+        start = time.monotonic()
+        ingest.start('cb')
+        await ingest._run_task
+        elapsed = time.monotonic() - start
+        await ingest.stop()
+        ingest.close()
+    # Give the sinks a chance to drain
+    await asyncio.sleep(0.1)
+    sink.close()
+
+    sensors = server.sensors
+    input_bytes = config.dumps * data.nbytes
+    results = {
+        'config': vars(config),
+        'elapsed': elapsed,
+        'dumps': config.dumps,
+        'dumps_per_second': config.dumps / elapsed,
+        'input_bytes_per_second': input_bytes / elapsed,
+        'output_bytes': sensors['output-bytes-total'].value,
+        'output_bytes_per_second': sensors['output-bytes-total'].value / elapsed,
+        'sink_heaps': sink.heaps,
+        'sink_bytes': sink.bytes,
+        'latency': {},
+        # ru_maxrss is in KiB on Linux
+        'peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    }    # type: Dict[str, Any]
+    for stage, values in timer.latencies.items():
+        values = np.array(values)
+        results['latency'][stage.strip('_')] = {
+            'count': len(values),
+            'mean': float(np.mean(values)),
+            'p50': float(np.percentile(values, 50)),
+            'p99': float(np.percentile(values, 99)),
+            'max': float(np.max(values))
+        }
+    return results
+
+
+def _run_benchmark_sync(config: BenchmarkConfig) -> Dict[str, Any]:
+    return asyncio.new_event_loop().run_until_complete(run_benchmark(config))
+
+
+def run_matrix(antennas: Sequence[int], channels: Sequence[int],
+               continuum_factors: Sequence[int], sd_int_times: Sequence[int],
+               **kwargs) -> List[Dict[str, Any]]:
+    """Run a benchmark for each combination of the parameters.
+
+    Each run is done in a new process, so that its peak memory usage is
+    isolated from the others.
+
+    Parameters
+    ----------
+    antennas, channels, continuum_factors, sd_int_times
+        Values for the corresponding :class:`BenchmarkConfig` parameters
+    kwargs
+        Other parameters for :class:`BenchmarkConfig`, common to all runs
+    """
+    results = []
+    mp_context = multiprocessing.get_context('spawn')
+    for a, c, cf, sd in itertools.product(antennas, channels, continuum_factors, sd_int_times):
+        config = BenchmarkConfig(a, c, continuum_factor=cf, sd_int_time=sd, **kwargs)
+        _logger.info('Running %r', config)
+        with concurrent.futures.ProcessPoolExecutor(1, mp_context=mp_context) as pool:
+            results.append(pool.submit(_run_benchmark_sync, config).result())
+    return results
+
+
+def format_results(results: Sequence[Mapping[str, Any]]) -> str:
+    """Format the results of :func:`run_matrix` as a text table."""
+    header = ('{:>5} {:>7} {:>5} {:>5} {:>9} {:>11} {:>11} {:>11} {:>11} {:>9}'
+              .format('ants', 'chans', 'cont', 'sd', 'dumps/s', 'in MB/s', 'out MB/s',
+                      'frame p99', 'output p99', 'RSS MiB'))
+    lines = [header]
+    for result in results:
+        config = result['config']
+        latency = result['latency']
+        lines.append(
+            '{:5d} {:7d} {:5d} {:5d} {:9.3f} {:11.1f} {:11.1f} {:11.4f} {:11.4f} {:9.0f}'
+            .format(config['antennas'], config['channels'], config['continuum_factor'],
+                    config['sd_int_time'], result['dumps_per_second'],
+                    result['input_bytes_per_second'] / 1e6,
+                    result['output_bytes_per_second'] / 1e6,
+                    latency.get('frame_job', {}).get('p99', float('nan')),
+                    latency.get('flush_output_job', {}).get('p99', float('nan')),
+                    result['peak_rss_bytes'] / 1024**2))
+    return '\n'.join(lines)
@@ -0,0 +1,295 @@
+"""Generate synthetic CBF baseline-correlation-products SPEAD traffic.
+
+This is intended for load-testing the receive path without a correlator.
+The heaps have the same items as those emitted by the MeerKAT CBF (and
+expected by :class:`katsdpingest.receiver.Receiver`): ``timestamp``,
+``frequency`` and ``xeng_raw``, using the SPEAD-64-48 flavour so that the
+timestamp and frequency are immediate items.
+
+All the endpoints are handled by a single spead2 send stream, with one
+substream per endpoint, so that it can be either a UDP stream or an
+in-process stream. Each substream carries an equal share of the X-engines,
+in order of frequency.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+import typing   # noqa: F401
+from typing import Dict, List, Mapping, Sequence, Tuple, Any, Optional   # noqa: F401
+
+import numpy as np
+import spead2
+import spead2.send
+import spead2.send.asyncio
+from katsdptelstate.endpoint import Endpoint
+
+
+_logger = logging.getLogger(__name__)
+
+#: SPEAD flavour used by the CBF
+FLAVOUR = spead2.Flavour(4, 64, 48, 0)
+#: Default maximum packet size (including headers), matching the CBF
+DEFAULT_MAX_PACKET_SIZE = 4608
+
+
+def make_cbf_attr(n_antennas: int, n_channels: int, n_xengs: int,
+                  int_time: float = 0.5, *,
+                  adc_sample_rate: float = 1712e6,
+                  center_freq: float = 1284e6,
+                  sync_time: float = 1400000000.0) -> Dict[str, Any]:
+    """Create CBF stream attributes for a synthetic wideband correlator.
+
+    The keys are those in
+    :const:`katsdpingest.ingest_session.CBF_CRITICAL_ATTRS`. The
+    integration time is rounded to a whole number of spectra.
+
+    Raises
+    ------
+    ValueError
+        if `n_channels` is not a multiple of `n_xengs`
+    """
+    if n_channels % n_xengs != 0:
+        raise ValueError('n_channels must be a multiple of n_xengs')
+    cbf_attr = dict(
+        scale_factor_timestamp=adc_sample_rate,
+        n_chans=n_channels,
+        n_chans_per_substream=n_channels // n_xengs,
+        bandwidth=adc_sample_rate / 2,
+        center_freq=center_freq,
+        sync_time=sync_time,
+        ticks_between_spectra=2 * n_channels
+    )     # type: Dict[str, Any]
+    cbf_attr['n_accs'] = max(1, int(round(
+        int_time * adc_sample_rate / cbf_attr['ticks_between_spectra'])))
+    cbf_attr['int_time'] = (cbf_attr['n_accs'] * cbf_attr['ticks_between_spectra']
+                            / adc_sample_rate)
+    bls_ordering = []
+    input_labels = []
+    antennas = ['m{:03}'.format(i) for i in range(n_antennas)]
+    for ib, b in enumerate(antennas):
+        for a in antennas[:ib + 1]:
+            bls_ordering.append((a + 'h', b + 'h'))
+            bls_ordering.append((a + 'v', b + 'v'))
+            bls_ordering.append((a + 'h', b + 'v'))
+            bls_ordering.append((a + 'v', b + 'h'))
+        input_labels.append(b + 'h')
+        input_labels.append(b + 'v')
+    cbf_attr['bls_ordering'] = np.array(bls_ordering)
+    cbf_attr['input_labels'] = input_labels
+    return cbf_attr
+
+
+def heap_shape(cbf_attr: Mapping[str, Any]) -> Tuple[int, int, int]:
+    """Shape of the ``xeng_raw`` item in each heap."""
+    return (cbf_attr['n_chans_per_substream'], len(cbf_attr['bls_ordering']), 2)
+
+
+def dump_size(cbf_attr: Mapping[str, Any]) -> int:
+    """Number of bytes of ``xeng_raw`` payload in each dump, across all X-engines."""
+    return cbf_attr['n_chans'] * len(cbf_attr['bls_ordering']) * 2 * np.dtype('>i4').itemsize
+
+
+def make_stream_config(cbf_attr: Mapping[str, Any], speedup: float = 1.0,
+                       max_packet_size: int = DEFAULT_MAX_PACKET_SIZE) -> spead2.send.StreamConfig:
+    """Create a stream configuration suitable for :class:`CBFGenerator`.
+
+    Parameters
+    ----------
+    cbf_attr
+        Stream attributes, as returned by :func:`make_cbf_attr`
+    speedup
+        Ratio of data rate to the real-time rate. If zero, the stream is not
+        rate-limited at all.
+    max_packet_size
+        Maximum packet size, including SPEAD headers
+    """
+    n_xengs = cbf_attr['n_chans'] // cbf_attr['n_chans_per_substream']
+    if speedup:
+        # Allow for packet headers (up to 8 items of 8 bytes each)
+        overhead = max_packet_size / (max_packet_size - 64)
+        rate = dump_size(cbf_attr) * overhead / cbf_attr['int_time'] * speedup
+    else:
+        rate = 0.0
+    # Allow for two dumps in flight, plus descriptors
+    return spead2.send.StreamConfig(max_packet_size=max_packet_size, rate=rate,
+                                    max_heaps=2 * n_xengs + 64)
+
+
+def make_udp_stream(thread_pool: spead2.ThreadPool,
+                    endpoints: Sequence[Endpoint],
+                    config: spead2.send.StreamConfig,
+                    interface_address: Optional[str] = None,
+                    ttl: int = 1) -> spead2.send.asyncio.UdpStream:
+    """Create a UDP stream with one substream per endpoint."""
+    kwargs = {}      # type: Dict[str, Any]
+    if interface_address is not None:
+        kwargs['interface_address'] = interface_address
+        kwargs['ttl'] = ttl
+    return spead2.send.asyncio.UdpStream(
+        thread_pool, [(endpoint.host, endpoint.port) for endpoint in endpoints],
+        config, **kwargs)
+
+
+def make_inproc_stream(thread_pool: spead2.ThreadPool,
+                       queues: Sequence[spead2.InprocQueue],
+                       config: spead2.send.StreamConfig) -> spead2.send.asyncio.InprocStream:
+    """Create an in-process stream with one substream per queue."""
+    return spead2.send.asyncio.InprocStream(thread_pool, list(queues), config)
+
+
+class CBFGenerator:
+    """Emit synthetic CBF visibility heaps on a stream.
+
+    Parameters
+    ----------
+    stream
+        Send stream, with one substream per CBF endpoint. See
+        :func:`make_udp_stream` and :func:`make_inproc_stream`.
+    cbf_attr
+        Stream attributes, as returned by :func:`make_cbf_attr`
+    data
+        Visibilities to send. It may either have the shape of a single heap
+        (see :func:`heap_shape`), in which case it is sent by every X
+        engine, or have an extra leading axis with one heap per X engine.
+        The same data is sent for every dump. If not specified, a single
+        heap of random values is generated.
+    first_timestamp
+        ADC timestamp of the first dump. If not specified, it is
+        computed from the current time.
+    descriptor_interval
+        Number of dumps between (and before the first) transmission of
+        descriptors. If zero, descriptors are only sent by
+        :meth:`send_descriptors`.
+
+    Attributes
+    ----------
+    n_xengs : int
+        Number of X engines (heaps per dump)
+    late_dumps : int
+        Number of dumps in :meth:`run` that started later than their
+        scheduled time, because the stream could not keep up.
+
+    Raises
+    ------
+    ValueError
+        if the number of X engines is not a multiple of the number of
+        substreams, or `data` has the wrong shape
+    """
+    def __init__(self, stream: 'spead2.send.asyncio.AsyncStream',
+                 cbf_attr: Mapping[str, Any],
+                 data: Optional[np.ndarray] = None,
+                 first_timestamp: Optional[int] = None,
+                 descriptor_interval: int = 1) -> None:
+        self.cbf_attr = cbf_attr
+        self.n_xengs = cbf_attr['n_chans'] // cbf_attr['n_chans_per_substream']
+        self.n_substreams = stream.num_substreams
+        if self.n_xengs % self.n_substreams != 0:
+            raise ValueError('Number of X engines must be a multiple of the number of endpoints')
+        shape = heap_shape(cbf_attr)
+        if data is None:
+            rs = np.random.RandomState(seed=1)
+            data = rs.randint(-1000, 1000, size=shape).astype('>i4')
+        elif data.shape != shape and data.shape != (self.n_xengs,) + shape:
+            raise ValueError('data has shape {}, expected {}'.format(data.shape, shape))
+        self.data = data
+        self.interval = cbf_attr['ticks_between_spectra'] * cbf_attr['n_accs']
+        if first_timestamp is None:
+            first_timestamp = int((time.time() - cbf_attr['sync_time'])
+                                  * cbf_attr['scale_factor_timestamp'])
+            first_timestamp -= first_timestamp % self.interval
+        self.first_timestamp = first_timestamp
+        self.descriptor_interval = descriptor_interval
+        self.late_dumps = 0
+        self._stream = stream
+        self._ig = spead2.send.ItemGroup(flavour=FLAVOUR)
+        self._ig.add_item(0x1600, 'timestamp',
+                          'Timestamp of start of this integration. '
+                          'uint counting multiples of ADC samples since last sync '
+                          '(sync_time, id=0x1027). Divide this number by timestamp_scale '
+                          '(id=0x1046) to get back to seconds since last sync when this '
+                          'integration was actually started.',
+                          (), None, format=[('u', 48)])
+        self._ig.add_item(0x4103, 'frequency',
+                          'Identifies the first channel in the band of frequencies '
+                          'in the SPEAD heap. Can be used to reconstruct the full spectrum.',
+                          (), None, format=[('u', 48)])
+        self._ig.add_item(0x1800, 'xeng_raw',
+                          'Raw data stream from all the X-engines in the system. '
+                          'Each frequency channel contains the data for all baselines. '
+                          'Each value is a complex number - '
+                          'two (real and imaginary) signed integers.',
+                          shape, np.dtype('>i4'))
+
+    def timestamp(self, idx: int) -> int:
+        """ADC timestamp of dump `idx`."""
+        return self.first_timestamp + idx * self.interval
+
+    def _heap_data(self, xeng: int) -> np.ndarray:
+        return self.data if self.data.ndim == 3 else self.data[xeng]
+
+    async def send_descriptors(self) -> None:
+        """Send a descriptor heap on every substream."""
+        heap = self._ig.get_heap(descriptors='all', data='none')
+        heaps = [spead2.send.HeapReference(heap, substream_index=i)
+                 for i in range(self.n_substreams)]
+        await self._stream.async_send_heaps(heaps, spead2.send.GroupMode.ROUND_ROBIN)
+
+    async def send_dump(self, idx: int) -> None:
+        """Send all the heaps for dump `idx`.
+
+        The heaps are interleaved at packet level, as they would be from a
+        set of X engines transmitting concurrently.
+        """
+        heap_channels = self.cbf_attr['n_chans_per_substream']
+        xengs_per_substream = self.n_xengs // self.n_substreams
+        self._ig['timestamp'].value = self.timestamp(idx)
+        heaps = []
+        for i in range(self.n_xengs):
+            self._ig['frequency'].value = i * heap_channels
+            self._ig['xeng_raw'].value = self._heap_data(i)
+            heap = self._ig.get_heap(descriptors='none', data='all')
+            heaps.append(spead2.send.HeapReference(
+                heap, substream_index=i // xengs_per_substream))
+        await self._stream.async_send_heaps(heaps, spead2.send.GroupMode.ROUND_ROBIN)
+
+    async def run(self, n_dumps: Optional[int] = None, speedup: float = 1.0) -> None:
+        """Send dumps until `n_dumps` have been sent (forever if ``None``).
+
+        If `speedup` is non-zero, the start of each dump is scheduled
+        according to the integration time divided by `speedup` (and the
+        stream should be rate-limited to match). Up to two dumps may be in
+        flight at once.
+        """
+        period = self.cbf_attr['int_time'] / speedup if speedup else 0.0
+        pending = deque()     # type: typing.Deque[asyncio.Future]
+        start = time.monotonic()
+        idx = 0
+        try:
+            while n_dumps is None or idx < n_dumps:
+                if period:
+                    delay = start + idx * period - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    elif delay < -0.5 * period:
+                        self.late_dumps += 1
+                        _logger.debug('Dump %d started %.3f s late', idx, -delay)
+                if len(pending) >= 2:
+                    await pending.popleft()
+                if self.descriptor_interval and idx % self.descriptor_interval == 0:
+                    await self.send_descriptors()
+                pending.append(asyncio.ensure_future(self.send_dump(idx)))
+                idx += 1
+            while pending:
+                await pending.popleft()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    async def stop(self) -> None:
+        """Send a stop heap on every substream."""
+        heap = self._ig.get_end()
+        heaps = [spead2.send.HeapReference(heap, substream_index=i)
+                 for i in range(self.n_substreams)]
+        await self._stream.async_send_heaps(heaps, spead2.send.GroupMode.ROUND_ROBIN)
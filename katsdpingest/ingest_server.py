@@ -11,8 +11,9 @@ import katsdptelstate.aio
 from katsdptelstate.endpoint import endpoint_parser
 
 import katsdpingest
-from .ingest_session import CBFIngest, Status, DeviceStatus, ChannelRanges, SystemAttrs
-from . import receiver
+from .ingest_session import (
+    CBFIngest, Status, DeviceStatus, ChannelRanges, SystemAttrs, LATENCY_STAGES)
+from . import receiver, sender
 from .utils import Sensor
 
 
@@ -116,6 +117,14 @@ class IngestDeviceServer(aiokatcp.DeviceServer):
             counter("input-dumps-total",
                     "Number of CBF dumps received in this session",
                     event_rate=True),
+            Sensor(int, "input-active-frames",
+                   "Number of input dumps in the window used to reorder heaps "
+                   "(prometheus: gauge)",
+                   default=1, initial_status=Sensor.Status.NOMINAL),
+            Sensor(int, "input-frames-queued",
+                   "Number of complete input dumps waiting to be processed "
+                   "(prometheus: gauge)",
+                   initial_status=Sensor.Status.NOMINAL),
             counter("input-metadata-heaps-total",
                     "Number of heaps that do not contain payload in this session",
                     event_rate=True),
@@ -139,6 +148,51 @@ class IngestDeviceServer(aiokatcp.DeviceServer):
                 "input-" + key + "-heaps-total",
                 "Number of heaps rejected because {}".format(value),
                 event_rate=True, warn_if_positive=True))
+        for key, value in receiver.OVERFLOW_POLICIES.items():
+            sensors.append(counter(
+                "input-frames-overflow-" + key + "-total",
+                "Number of times a complete input dump found the queue full and the "
+                "receiver had to {}".format(value),
+                warn_if_positive=(key != 'block')))
+        # There is at most one input stream per endpoint
+        max_input_streams = user_args.input_streams or len(user_args.cbf_spead)
+        for i in range(max_input_streams):
+            sensors.extend([
+                Sensor(float, "input-stream{}-pool-occupancy".format(i),
+                       "Fraction of the heap memory pool of input stream {} that is in use "
+                       "(chunks in zero-copy mode) (prometheus: gauge)".format(i),
+                       initial_status=Sensor.Status.NOMINAL),
+                Sensor(float, "input-stream{}-ring-occupancy".format(i),
+                       "Fraction of the ring buffer of input stream {} holding heaps "
+                       "waiting to be processed (prometheus: gauge)".format(i),
+                       initial_status=Sensor.Status.NOMINAL),
+                counter("input-stream{}-evicted-heaps-total".format(i),
+                        "Number of incomplete heaps evicted by input stream {} because "
+                        "too many heaps were in flight".format(i),
+                        warn_if_positive=True),
+                counter("input-stream{}-worker-blocked-total".format(i),
+                        "Number of times the receive worker of input stream {} blocked "
+                        "on a full ring buffer".format(i))
+            ])
+        for output in ['spectral', 'continuum']:
+            sensors.extend([
+                Sensor(float, "output-{}-rate".format(output),
+                       "Rate at which the current L0 {} dump is being sent "
+                       "(prometheus: gauge)".format(output),
+                       "B/s", initial_status=Sensor.Status.NOMINAL),
+                Sensor(int, "output-{}-queue-depth".format(output),
+                       "Number of L0 {} dumps being sent (prometheus: gauge)".format(output),
+                       initial_status=Sensor.Status.NOMINAL)
+            ])
+        for stage, description in LATENCY_STAGES.items():
+            for stat, stat_description in [('p50', 'Median'),
+                                           ('p99', '99th percentile of'),
+                                           ('max', 'Maximum')]:
+                sensors.append(Sensor(
+                    float, "latency-{}-{}".format(stage, stat),
+                    "{} recent time spent {} (prometheus: gauge)".format(
+                        stat_description, description),
+                    "s", initial_status=Sensor.Status.NOMINAL))
         for sensor in sensors:
             self.sensors.add(sensor)
 
@@ -224,18 +278,63 @@ class IngestDeviceServer(aiokatcp.DeviceServer):
         else:
             return "The IP address has been dropped as a signal display recipient"
 
-    async def request_add_sdisp_ip(self, ctx, ip: str) -> str:
+    async def request_add_sdisp_ip(self, ctx, ip: str, mode: str = 'float32',
+                                   rate: float = 0.0, subsample: int = 1) -> str:
         """Add the supplied ip and port (ip[:port]) to the list of signal
         display data recipients.If not port is supplied default of 7149 is
-        used."""
+        used.
+
+        The optional `mode` reduces the size of the data sent to this
+        recipient: it is a comma-separated list of at most one of
+        ``float32`` (the default), ``float16`` or ``int16``, and ``delta``
+        to send only the parts of the spectra that have changed.
+
+        A positive `rate` (in bits per second) replaces ``--sd-spead-rate``
+        for this recipient, and a `subsample` of N sends it only every Nth
+        signal display dump. Data for recipients with a non-default mode,
+        rate or subsampling are sent from a copy, and dropped rather than
+        queued if the recipient falls behind.
+        """
         endpoint = endpoint_parser(7149)(ip)
         try:
-            self.cbf_ingest.add_sdisp_ip(endpoint)
+            encoding, delta = sender.parse_sd_mode(mode)
+        except ValueError as error:
+            raise FailReply(str(error))
+        if rate < 0:
+            raise FailReply("rate cannot be negative")
+        if subsample < 1:
+            raise FailReply("subsample must be positive")
+        try:
+            self.cbf_ingest.add_sdisp_ip(endpoint, encoding, delta,
+                                         rate if rate > 0 else None, subsample)
         except ValueError:
             return "The supplied IP is already in the active list of recipients."
         else:
             return "Added {} to list of signal display data recipients.".format(endpoint)
 
+    async def request_record_start(self, ctx, filename: str, max_bytes: int = 2**30) -> str:
+        """Record the CBF heaps received by the current capture session to a
+        file, for later replay.
+
+        Recording continues until record-stop is called, the capture session
+        ends or the file reaches `max_bytes`. An index of the heaps is written
+        to a file with the same name plus ``.idx``.
+        """
+        try:
+            self.cbf_ingest.start_recording(filename, max_bytes)
+        except (RuntimeError, ValueError, OSError) as error:
+            raise FailReply(str(error))
+        return "Recording to {}".format(filename)
+
+    async def request_record_stop(self, ctx) -> str:
+        """Stop recording CBF heaps."""
+        try:
+            recorder = await self.cbf_ingest.stop_recording()
+        except RuntimeError as error:
+            raise FailReply(str(error))
+        return "Recorded {} heaps to {} ({} dropped)".format(
+            recorder.heaps, recorder.filename, recorder.dropped)
+
     async def handle_interrupt(self) -> None:
         """Used to attempt a graceful resolution to external
         interrupts. Basically calls capture done."""
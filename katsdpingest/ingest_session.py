@@ -8,11 +8,11 @@ import enum
 import argparse
 import textwrap
 import functools
-from collections import deque
+import heapq
 import gc
 from typing import (
-    Mapping, Dict, List, Tuple, Deque, Set, Iterable, Callable, Awaitable,
-    Optional, TypeVar, Any
+    Mapping, Sequence, Dict, List, Tuple, Set, Iterable, Callable, Awaitable,
+    Optional, TypeVar, Type, Any, Union
 )    # noqa: F401
 
 import numpy as np
@@ -41,7 +41,7 @@ import katpoint
 import katsdptelstate.aio
 from katsdptelstate.endpoint import endpoints_to_str, Endpoint
 
-from . import utils, receiver, sender, sigproc
+from . import utils, receiver, replay, sender, sigproc, sigproc_host
 from .utils import Sensor
 
 
@@ -51,7 +51,19 @@ CBF_CRITICAL_ATTRS = frozenset([
     'n_chans', 'n_chans_per_substream', 'n_accs', 'bls_ordering',
     'bandwidth', 'center_freq', 'input_labels',
     'sync_time', 'int_time', 'scale_factor_timestamp', 'ticks_between_spectra'])
+#: Pipeline stages whose latencies are published as sensors
+LATENCY_STAGES = {
+    'rx-wait': 'waiting for the next input dump from the receiver',
+    'frame-copy': 'copying an input dump to the staging buffer',
+    'external-flags': 'computing flags from telescope state sensors',
+    'input-transfer': 'transferring an input dump to the device',
+    'proc': 'processing an input dump on the device',
+    'output-transfer': 'finalising an output dump and transferring it from the device',
+    'output-send': 'transmitting an output dump',
+    'sd-flush': 'computing and transmitting a signal display dump'
+}
 _M = TypeVar('_M', bound='katsdpmodels.models.Model')
+_SD_FLAVOUR = spead2.Flavour(4, 64, 48)
 
 
 class Status(enum.Enum):
@@ -142,6 +154,13 @@ def _mid_timestamp_rel(time_average: _TimeAverage, recv: receiver.Receiver, idx:
     return ts_raw / recv.cbf_attr['scale_factor_timestamp']
 
 
+class _ArrayInterface:
+    """Wraps an ``__array_interface__``, keeping the owner of the memory alive."""
+    def __init__(self, interface: Dict[str, Any], base: np.ndarray) -> None:
+        self.__array_interface__ = interface
+        self.base = base
+
+
 def _split_array(x: np.ndarray, dtype) -> np.ndarray:
     """Return a view of x which has one extra dimension. Each element is x is
     treated as some number of elements of type `dtype`, whose size must divide
@@ -161,7 +180,38 @@ def _split_array(x: np.ndarray, dtype) -> np.ndarray:
         interface['strides'] = x.strides + (out_dtype.itemsize,)
     interface['typestr'] = out_dtype.str
     interface['descr'] = out_dtype.descr
-    return np.asarray(np.lib.stride_tricks.DummyArray(interface, base=x))
+    # np.lib.stride_tricks.DummyArray would do this, but it is not public
+    # and was removed in numpy 2.
+    return np.asarray(_ArrayInterface(interface, base=x))
+
+
+def _pool_cores(affinity: Optional[List[int]], interface: Optional[str],
+                numa_local: bool) -> Optional[List[int]]:
+    """Choose the CPU cores for the threads serving a network interface.
+
+    An explicit `affinity` takes precedence. Otherwise, if `numa_local` is
+    true, the cores on the NUMA node of `interface` are used (if known).
+    Pinning the threads there also places the buffers they write into on
+    that node, since memory is allocated on the node that first touches it.
+    """
+    if affinity is not None:
+        return affinity
+    elif numa_local:
+        return utils.interface_cpus(interface)
+    else:
+        return None
+
+
+def _make_thread_pool(cores: Optional[List[int]], index: int = 0) -> spead2.ThreadPool:
+    """Create a single-threaded :class:`spead2.ThreadPool`.
+
+    If `cores` is given, the thread is pinned to one of them, selected by
+    `index` so that successive pools are spread across the cores.
+    """
+    if cores:
+        return spead2.ThreadPool(1, [cores[index % len(cores)]])
+    else:
+        return spead2.ThreadPool()
 
 
 def _fix_descriptions(desc: Any) -> Any:
@@ -325,6 +375,9 @@ class _ResourceSet:
       names to :class:`katsdpsigproc.accel.HostArray`s.
     This provides N-buffered staging of data into or out of the device buffers.
 
+    Each host dict may also contain extra host-only arrays, which are useful
+    for repacking the staged data without allocating memory each time.
+
     Parameters
     ----------
     proc : :class:`katsdpsigproc.accel.Operation`
@@ -333,16 +386,23 @@ class _ResourceSet:
         Names of buffers to find in `proc`
     N : int
         Number of host arrays to create for each buffer
+    extra : dict, optional
+        Maps names of host-only arrays to their shape and dtype
     """
     def __init__(self, proc: katsdpsigproc.accel.Operation,
-                 names: List[str], N: int) -> None:
+                 names: List[str], N: int,
+                 extra: Mapping[str, Tuple[Tuple[int, ...], Any]] = None) -> None:
         if N <= 0:
             raise ValueError('_ResourceSet needs at least one buffer')
+        if extra is None:
+            extra = {}
         buffers = {name: proc.buffer(name) for name in names}
         self._device = resource.Resource(buffers)
         self._host: List[resource.Resource] = []
         for i in range(N):
             host = {name: buffer.empty_like() for name, buffer in buffers.items()}
+            for name, (shape, dtype) in extra.items():
+                host[name] = np.empty(shape, dtype)
             self._host.append(resource.Resource(host))
         self._next = 0     # Next host buffer to return from acquire
 
@@ -570,6 +630,15 @@ class TelstateReceiver(receiver.Receiver):
             return await self._telstates[0].get('first_timestamp_adc')
 
 
+class TelstateReplayReceiver(TelstateReceiver, replay.ReplayReceiver):
+    """Receiver that replays capture files and uses telescope state to
+    coordinate a shared first dump timestamp.
+
+    See :class:`TelstateReceiver` and
+    :class:`katsdpingest.replay.ReplayReceiver` for the parameters.
+    """
+
+
 class SensorHistory:
     """Track sensor values until they're needed by the corresponding frame job.
 
@@ -579,25 +648,56 @@ class SensorHistory:
 
     A single querier can request the latest sample that is no later than a
     given time. Such queries must be made with non-decreasing times.
+
+    The timestamps are stored in a NumPy array (with the values in a parallel
+    list), so that queries are a binary search rather than a scan. Samples
+    that can no longer be returned are pruned lazily, when space is needed.
     """
 
-    def __init__(self, name: str) -> None:
+    def __init__(self, name: str, capacity: int = 16) -> None:
         self.name = name
-        self._data: Deque[Tuple[float, Any]] = deque()
+        self._timestamps = np.empty(capacity, np.float64)
+        self._values: List[Any] = [None] * capacity
+        self._start = 0       # Index of oldest retained sample
+        self._end = 0         # One past the index of the newest sample
         self._last_get = -1.0
 
+    def __len__(self) -> int:
+        """Number of retained samples"""
+        return self._end - self._start
+
+    def _make_space(self) -> None:
+        """Ensure that there is space to append a sample."""
+        n = len(self)
+        capacity = len(self._timestamps)
+        if self._end < capacity:
+            return
+        if 2 * n > capacity:
+            # Less than half of the storage could be freed, so grow it
+            capacity *= 2
+        timestamps = np.empty(capacity, np.float64)
+        timestamps[:n] = self._timestamps[self._start:self._end]
+        values = self._values[self._start:self._end] + [None] * (capacity - n)
+        self._timestamps = timestamps
+        self._values = values
+        self._start = 0
+        self._end = n
+
     def add(self, timestamp: float, value: Any) -> None:
         """Add a new sample of the sensor."""
         if timestamp <= self._last_get:
             logger.warning('Sensor update for %s arrived late (%.3f < %.3f)',
                            self.name, timestamp, self._last_get)
-        if self._data and timestamp < self._data[-1][0]:
+        if self._end > self._start and timestamp < self._timestamps[self._end - 1]:
             logger.warning(
                 'Ignoring sensor update for %s that went backwards in time (%.3f < %.3f)',
-                self.name, timestamp, self._data[-1][0]
+                self.name, timestamp, self._timestamps[self._end - 1]
             )
             return
-        self._data.append((timestamp, value))
+        self._make_space()
+        self._timestamps[self._end] = timestamp
+        self._values[self._end] = value
+        self._end += 1
 
     def get(self, timestamp: float, default: Any = None) -> Any:
         """Obtain the last sample value that is no later than `timestamp`.
@@ -612,13 +712,94 @@ class SensorHistory:
         if timestamp < self._last_get:
             raise ValueError('Query timestamps must not go backwards (%.3f < %.3f)',
                              timestamp, self._last_get)
-        while len(self._data) > 1 and self._data[1][0] <= timestamp:
-            self._data.popleft()
         self._last_get = timestamp
-        if not self._data or self._data[0][0] > timestamp:
+        pos = self._start + int(np.searchsorted(
+            self._timestamps[self._start:self._end], timestamp, side='right')) - 1
+        if pos < self._start:
             return default
-        else:
-            return self._data[0][1]
+        # Earlier samples can never be returned again
+        for i in range(self._start, pos):
+            self._values[i] = None
+        self._start = pos
+        return self._values[pos]
+
+
+class SensorHistoryGroup:
+    """Track the values of a set of related sensors, and query them together.
+
+    This has the same semantics as a :class:`SensorHistory` per sensor, but
+    a query returns the values of all the sensors at once, together with the
+    indices of the sensors that have been updated since the previous query.
+    The cost of a query depends only on the number of updates that it
+    consumes, rather than on the number of sensors.
+
+    Parameters
+    ----------
+    names
+        Names of the sensors. The values returned by :meth:`get` are in this
+        order.
+    """
+
+    def __init__(self, names: Sequence[str]) -> None:
+        self.names = list(names)
+        self._index = {name: i for i, name in enumerate(self.names)}
+        self._values = np.full(len(self.names), None, object)
+        self._last_add = np.full(len(self.names), -np.inf)
+        # Heap of (timestamp, sequence number, sensor index, value). The
+        # sequence number ensures that updates with the same timestamp are
+        # applied in the order they were added.
+        self._pending: List[Tuple[float, int, int, Any]] = []
+        self._seq = 0
+        self._last_get = -1.0
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def add(self, name: str, timestamp: float, value: Any) -> None:
+        """Add a new sample of the sensor called `name`."""
+        idx = self._index[name]
+        if timestamp <= self._last_get:
+            logger.warning('Sensor update for %s arrived late (%.3f < %.3f)',
+                           name, timestamp, self._last_get)
+        if timestamp < self._last_add[idx]:
+            logger.warning(
+                'Ignoring sensor update for %s that went backwards in time (%.3f < %.3f)',
+                name, timestamp, self._last_add[idx]
+            )
+            return
+        self._last_add[idx] = timestamp
+        heapq.heappush(self._pending, (timestamp, self._seq, idx, value))
+        self._seq += 1
+
+    def get(self, timestamp: float) -> Tuple[np.ndarray, np.ndarray]:
+        """Obtain the last sample value of each sensor that is no later than `timestamp`.
+
+        Returns
+        -------
+        values
+            Object array with the value of each sensor, or ``None`` for
+            sensors with no such sample. This array is owned by the group and
+            is updated in place by subsequent calls, so it must not be
+            modified.
+        updated
+            Indices of the sensors that have been updated since the previous
+            call, in increasing order.
+
+        Raises
+        ------
+        ValueError
+            if `timestamp` is less than in the previous call.
+        """
+        if timestamp < self._last_get:
+            raise ValueError('Query timestamps must not go backwards (%.3f < %.3f)',
+                             timestamp, self._last_get)
+        self._last_get = timestamp
+        updated = set()
+        while self._pending and self._pending[0][0] <= timestamp:
+            _, _, idx, value = heapq.heappop(self._pending)
+            self._values[idx] = value
+            updated.add(idx)
+        return self._values, np.array(sorted(updated), np.intp)
 
 
 def task_wrapper(name: str, fail_status: DeviceStatus, restart: bool = False):
@@ -720,7 +901,8 @@ class CBFIngest:
     @classmethod
     def create_proc_template(
             cls, context, percentile_sizes: List[int],
-            max_channels: int, excise: bool, continuum: bool) -> sigproc.IngestTemplate:
+            max_channels: int, excise: bool,
+            continuum: bool) -> Union[sigproc.IngestTemplate, sigproc_host.IngestTemplateHost]:
         """Create a processing template. This is a potentially slow operation,
         since it invokes autotuning.
 
@@ -730,7 +912,9 @@ class CBFIngest:
         Parameters
         ----------
         context : :class:`katsdpsigproc.cuda.Context` or :class:`katsdpsigproc.opencl.Context`
-            Context in which to compile device code
+            Context in which to compile device code. It may also be a
+            :class:`.sigproc_host.HostContext`, in which case the processing
+            is done on the CPU with NumPy.
         percentile_sizes : list of int
             Sizes of baseline groupings, *after* any masking
         max_channels : int
@@ -740,6 +924,10 @@ class CBFIngest:
         continuum : bool
             Enable continuum averaging
         """
+        if isinstance(context, sigproc_host.HostContext):
+            return sigproc_host.IngestTemplateHost(
+                context, excise=excise, continuum=continuum,
+                background_width=13, background_use_flags=True, flag_value=INGEST_RFI)
         # Quantise to reduce number of options to autotune
         max_percentile_sizes = [cls._tune_next(s, cls.tune_percentile_sizes)
                                 for s in percentile_sizes]
@@ -771,6 +959,7 @@ class CBFIngest:
             system_attrs.cbf_attr['bls_ordering'],
             [antenna.name for antenna in system_attrs.antennas]
         )
+        self._init_baseline_suspect(system_attrs.cbf_attr['input_labels'])
 
         # Pre-compute channel masks from the RFI mask and band mask models
         cbf_spw = SpectralWindow(
@@ -814,6 +1003,38 @@ class CBFIngest:
                 band_spw, freqs, cbf_spw.channel_width * u.Hz)
             self.static_masks |= mask[np.newaxis, :] * np.uint8(STATIC)
 
+    def _init_baseline_suspect(self, input_labels: Sequence[str]) -> None:
+        """Pre-compute lookup tables used by :meth:`_set_external_flags`.
+
+        Each baseline is mapped to a pair of indices into
+        :attr:`_suspect_antennas` and a pair of indices into `input_labels`.
+        Inputs that are not in `input_labels` map to an extra trailing
+        index that is never suspect.
+        """
+        bls = self.bls_ordering.sdp_bls_ordering
+        # [:-1] indexing strips off h/v pol
+        self._suspect_antennas = sorted({input_[:-1] for baseline in bls for input_ in baseline})
+        antenna_index = {antenna: i for i, antenna in enumerate(self._suspect_antennas)}
+        input_index = {label: i for i, label in enumerate(input_labels)}
+        self._n_suspect_inputs = len(input_labels)
+        self._bls_antenna_idx = np.array(
+            [[antenna_index[input_[:-1]] for input_ in baseline] for baseline in bls],
+            np.int32).reshape(len(bls), 2)
+        self._bls_input_idx = np.array(
+            [[input_index.get(input_, len(input_labels)) for input_ in baseline]
+             for baseline in bls],
+            np.int32).reshape(len(bls), 2)
+        self._reset_baseline_suspect()
+
+    def _reset_baseline_suspect(self) -> None:
+        """Start tracking data suspect sensors afresh (for a new capture block)."""
+        self._antenna_suspect_history = SensorHistoryGroup(
+            [f'{antenna}_data_suspect' for antenna in self._suspect_antennas])
+        self._antenna_suspect = np.zeros(len(self._suspect_antennas), np.bool_)
+        # Input suspect state from which _baseline_suspect was last computed
+        self._last_input_suspect: Optional[np.ndarray] = None
+        self._baseline_suspect = np.zeros(len(self.bls_ordering.sdp_bls_ordering), np.bool_)
+
     def _init_time_averaging(self, output_int_time: float, sd_int_time: float) -> None:
         output_ratio = max(1, int(round(output_int_time / self.cbf_attr['int_time'])))
         self._output_avg = _TimeAverage(output_ratio, self._flush_output)
@@ -836,6 +1057,8 @@ class CBFIngest:
         my_sensors['output-n-chans'].value = len(self.channel_ranges.output)
         my_sensors['output-int-time'].value = self.cbf_attr['int_time'] * self._output_avg.ratio
         self.output_bytes_sensor = my_sensors['output-bytes-total']       # type: Sensor[int]
+        self._latency = {stage: utils.LatencyTracker(my_sensors, stage)
+                         for stage in LATENCY_STAGES}
         self.output_heaps_sensor = my_sensors['output-heaps-total']       # type: Sensor[int]
         self.output_dumps_sensor = my_sensors['output-dumps-total']       # type: Sensor[int]
         self.output_flagged_sensor = my_sensors['output-flagged-total']   # type: Sensor[int]
@@ -889,10 +1112,23 @@ class CBFIngest:
             base_name = 'percentile{}'.format(i)
             sd_output_names.append(base_name)
             sd_output_names.append(base_name + '_flags')
-        self.sd_output_resource = _ResourceSet(self.proc, sd_output_names, 2)
+        # Host-only arrays in which the signal display heap is assembled
+        n_spec_channels = len(self.channel_ranges.sd_output)
+        n_baselines = len(self.bls_ordering.sdp_bls_ordering)
+        n_perc_signals = sum(self.proc.buffer('percentile{}'.format(i)).shape[0]
+                             for i in range(len(self.proc.percentiles)))
+        sd_extra = {
+            # Flat, so that a contiguous prefix can hold any number of signals
+            'sd_data': ((n_spec_channels * n_baselines * 2,), np.float32),
+            'sd_flags': ((n_spec_channels * n_baselines,), np.uint8),
+            'sd_percspectrum': ((n_spec_channels, n_perc_signals), np.float32),
+            'sd_percspectrumflags': ((n_spec_channels, n_perc_signals), np.uint8),
+            'sd_flag_fraction': ((n_baselines, 8), np.float32)
+        }
+        self.sd_output_resource = _ResourceSet(self.proc, sd_output_names, 2, sd_extra)
 
     def _init_tx_one(self, args: argparse.Namespace, arg_name: str, name: str,
-                     cont_factor: int) -> None:
+                     cont_factor: int, index: int) -> None:
         """Initialise a single transmit stream.
 
         If the stream has no endpoint specified, does nothing. Otherwise stores
@@ -908,6 +1144,9 @@ class CBFIngest:
             Name used in internal data structures
         cont_factor : int
             Continuum factor (1 for spectral product)
+        index : int
+            Index of the stream, used to spread the send threads across the
+            cores given by ``--output-affinity``
         """
         endpoints: List[Endpoint] = getattr(args, 'l0_{}_spead'.format(arg_name))
         if not endpoints:
@@ -928,16 +1167,22 @@ class CBFIngest:
         endpoints = endpoints[endpoint_lo:endpoint_hi]
         logger.info('Sending %s output to %s', arg_name, endpoints_to_str(endpoints))
         int_time = self.cbf_attr['int_time'] * self._output_avg.ratio
+        pacer = sender.RatePacer(int_time * args.clock_ratio, sensors=self._my_sensors,
+                                 name=arg_name)
+        interface: Optional[str] = getattr(args, 'l0_{}_interface'.format(arg_name))
+        cores = _pool_cores(args.output_affinity, interface, args.numa_local)
         tx = sender.VisSenderSet(
-            spead2.ThreadPool(),
+            _make_thread_pool(cores, index),
             endpoints,
-            katsdpservices.get_interface_address(getattr(args, 'l0_{}_interface'.format(arg_name))),
+            katsdpservices.get_interface_address(interface),
             l0_flavour,
             int_time * args.clock_ratio,
             channels,
             (self.channel_ranges.output.start - all_output.start) // cont_factor,
             len(all_output) // cont_factor,
-            baselines)
+            baselines,
+            batched=args.output_batch,
+            pacer=pacer)
 
         # Put attributes into telstate. This will be done by all the ingest
         # nodes, with the same values.
@@ -968,12 +1213,12 @@ class CBFIngest:
     def _init_tx(self, args: argparse.Namespace) -> None:
         self.tx: Dict[str, sender.VisSenderSet] = {}
         self.l0_names: List[str] = []
-        self._init_tx_one(args, 'spectral', 'spec', 1)
-        self._init_tx_one(args, 'continuum', 'cont', self.channel_ranges.cont_factor)
+        self._init_tx_one(args, 'spectral', 'spec', 1, 0)
+        self._init_tx_one(args, 'continuum', 'cont', self.channel_ranges.cont_factor, 1)
 
     def _init_ig_sd(self) -> None:
         """Create a item group for signal displays."""
-        sd_flavour = spead2.Flavour(4, 64, 48)
+        sd_flavour = _SD_FLAVOUR
         inline_format = [('u', sd_flavour.heap_address_bits)]
         n_spec_channels = len(self.channel_ranges.sd_output)
         n_cont_channels = n_spec_channels // self.channel_ranges.sd_cont_factor
@@ -1072,6 +1317,16 @@ class CBFIngest:
                  my_sensors: Mapping[str, Sensor],
                  telstate_cbf: katsdptelstate.aio.TelescopeState) -> None:
         self._sdisp_ips: Dict[str, spead2.send.asyncio.UdpStream] = {}
+        # Signal display servers that have not yet been sent descriptors
+        self._sdisp_need_descriptors: Set[str] = set()
+        # Signal display heaps sent since the start of the session
+        self._sd_heaps = 0
+        # Encoders for signal display servers that requested a reduced mode
+        self._sdisp_encoders: Dict[str, sender.SdEncoder] = {}
+        # Send only every Nth signal display dump to each server
+        self._sdisp_subsample: Dict[str, int] = {}
+        # Sends to servers with an encoder, which are not waited for
+        self._sdisp_pending: Dict[str, asyncio.Future] = {}
         self._run_task: Optional[asyncio.Task] = None
         self._sidecar_tasks: List[asyncio.Task] = []
         # Local cache of values from telstate_sdisp
@@ -1088,10 +1343,23 @@ class CBFIngest:
         self.rx_spead_max_streams: int = args.input_streams
         self.rx_spead_max_packet_size: int = args.input_max_packet_size
         self.rx_spead_buffer_size: int = args.input_buffer
+        self.rx_spead_zero_copy: bool = args.input_zero_copy
+        self.rx_spead_threaded: bool = args.input_threads
+        self.rx_spead_max_active_frames: Optional[int] = args.input_max_active_frames
+        self.rx_spead_queue_frames: int = args.input_queue_frames
+        self.rx_spead_overflow: str = args.input_overflow
+        self.rx_spead_cores = _pool_cores(args.input_affinity, args.cbf_interface,
+                                          args.numa_local)
+        self.rx_replay: List[str] = args.cbf_replay
+        self.rx_replay_speedup: float = args.cbf_replay_speedup
+        self.clock_ratio: float = args.clock_ratio
         self.sd_spead_rate: float = (
             args.sd_spead_rate / args.clock_ratio if args.clock_ratio else 0.0
         )
         self.sd_spead_ifaddr = katsdpservices.get_interface_address(args.sdisp_interface)
+        self.sd_spead_cores = _pool_cores(args.sd_affinity, args.sdisp_interface,
+                                          args.numa_local)
+        self.sd_descriptor_interval: int = args.sd_descriptor_interval
         self.channel_ranges = channel_ranges
         self.telstate = telstate_cbf.root()
         self.telstate_cbf = telstate_cbf
@@ -1135,6 +1403,50 @@ class CBFIngest:
         else:
             logger.setLevel(logging.NOTSET)
 
+    def start_recording(self, filename: str, max_bytes: int) -> None:
+        """Start recording received heaps to a capture file.
+
+        Recording stops at the end of the capture session if
+        :meth:`stop_recording` has not been called.
+
+        Raises
+        ------
+        RuntimeError
+            if there is no capture session, or it is already being recorded
+        ValueError
+            if the receiver is in zero-copy mode
+        OSError
+            if the file could not be created
+        """
+        if self.rx is None:
+            raise RuntimeError('No capture session is active')
+        if self.rx.recorder is not None:
+            raise RuntimeError('Already recording to {}'.format(self.rx.recorder.filename))
+        self.rx.recorder = replay.HeapRecorder(self.rx, filename, max_bytes)
+        logger.info('Recording heaps to %s', filename)
+
+    async def stop_recording(self) -> replay.HeapRecorder:
+        """Stop recording received heaps and close the capture file.
+
+        Returns
+        -------
+        recorder
+            The recorder, which can be used to obtain statistics
+
+        Raises
+        ------
+        RuntimeError
+            if no recording is in progress
+        """
+        if self.rx is None or self.rx.recorder is None:
+            raise RuntimeError('Not recording')
+        recorder = self.rx.recorder
+        self.rx.recorder = None
+        await asyncio.get_event_loop().run_in_executor(None, recorder.close)
+        logger.info('Recorded %d heaps to %s (%d dropped)',
+                    recorder.heaps, recorder.filename, recorder.dropped)
+        return recorder
+
     def _send_sd_data(self, data: spead2.send.Heap) -> asyncio.Future:
         """Send a heap to all signal display servers, asynchronously.
 
@@ -1151,6 +1463,56 @@ class CBFIngest:
         return asyncio.gather(*(sender.async_send_heap(tx, data)
                                 for tx in self._sdisp_ips.values()))
 
+    def _send_sd_dump(self) -> asyncio.Future:
+        """Send the current values in :attr:`ig_sd` to all signal display
+        servers, asynchronously.
+
+        Descriptors are included for all servers every
+        :attr:`sd_descriptor_interval` heaps (only the first heap if it is
+        zero), and otherwise only for servers added since they were last
+        sent. A server that was added with a subsampling factor N only gets
+        the dumps whose index is a multiple of N.
+
+        Servers that requested a reduced mode, their own rate or subsampling
+        get a heap from their :class:`~katsdpingest.sender.SdEncoder`, which
+        holds a copy of the data. Those sends are not waited for, so that a
+        slow server does not delay the release of the host buffers; if the
+        previous send to such a server is still in progress, the dump is
+        skipped for it. The remaining servers share heaps.
+
+        Returns
+        -------
+        future : `asyncio.Future`
+            A future that is completed when the heaps have been sent to all
+            receivers that share heaps.
+        """
+        index = self._sd_heaps
+        interval = self.sd_descriptor_interval
+        if index == 0 or (interval > 0 and index % interval == 0):
+            self._sdisp_need_descriptors.update(self._sdisp_ips)
+        self._sd_heaps += 1
+        heaps: Dict[bool, spead2.send.Heap] = {}    # Shared heaps, by whether they have descriptors
+        futures = []
+        for ip, tx in self._sdisp_ips.items():
+            if index % self._sdisp_subsample[ip] != 0:
+                continue
+            encoder = self._sdisp_encoders.get(ip)
+            pending = self._sdisp_pending.get(ip)
+            if pending is not None and not pending.done():
+                logger.debug('Previous signal display heap to %s still in flight, skipping', ip)
+                continue
+            descriptors = ip in self._sdisp_need_descriptors
+            self._sdisp_need_descriptors.discard(ip)
+            if encoder is not None:
+                heap = encoder.get_heap(self.ig_sd, descriptors)
+                self._sdisp_pending[ip] = asyncio.ensure_future(sender.async_send_heap(tx, heap))
+            else:
+                if descriptors not in heaps:
+                    heaps[descriptors] = self.ig_sd.get_heap(
+                        descriptors='all' if descriptors else 'none', data='all')
+                futures.append(sender.async_send_heap(tx, heaps[descriptors]))
+        return asyncio.gather(*futures)
+
     async def _stop_stream(self, stream: spead2.send.asyncio.UdpStream,
                            ig: spead2.send.ItemGroup) -> None:
         """Send a stop packet to a stream. To ensure that it won't be lost
@@ -1170,16 +1532,33 @@ class CBFIngest:
         logger.info("Removing ip %s from the signal display list.", ip)
         stream = self._sdisp_ips[ip]
         del self._sdisp_ips[ip]
+        self._sdisp_need_descriptors.discard(ip)
+        self._sdisp_encoders.pop(ip, None)
+        del self._sdisp_subsample[ip]
+        self._sdisp_pending.pop(ip, None)
         if self.capturing:
             await self._stop_stream(stream, self.ig_sd)
 
-    def add_sdisp_ip(self, endpoint: Endpoint) -> None:
+    def add_sdisp_ip(self, endpoint: Endpoint, encoding: str = 'float32',
+                     delta: bool = False, rate: Optional[float] = None,
+                     subsample: int = 1) -> None:
         """Add a new server to the signal display list.
 
         Parameters
         ----------
         endpoint : :class:`katsdptelstate.endpoint.Endpoint`
             Destination host and port
+        encoding : str, optional
+            Encoding of the large payload items for this server (see
+            :class:`katsdpingest.sender.SdEncoder`)
+        delta : bool, optional
+            If true, send this server only the blocks of the large payload
+            items that have changed
+        rate : float, optional
+            Transmission rate for this server in bits per second (before
+            scaling by the clock ratio), instead of ``--sd-spead-rate``
+        subsample : int, optional
+            Send only every `subsample`-th signal display dump to this server
 
         Raises
         ------
@@ -1188,20 +1567,29 @@ class CBFIngest:
         """
         if endpoint.host in self._sdisp_ips:
             raise ValueError('{0} is already in the active list of recipients'.format(endpoint))
-        config = spead2.send.StreamConfig(max_packet_size=8872, rate=self.sd_spead_rate / 8)
+        if rate is None:
+            stream_rate = self.sd_spead_rate
+        else:
+            stream_rate = rate / self.clock_ratio if self.clock_ratio else 0.0
+        config = spead2.send.StreamConfig(max_packet_size=8872, rate=stream_rate / 8)
         logger.info("Adding %s to signal display list. Starting stream...", endpoint)
         if self.sd_spead_ifaddr is None:
             extra_args: Dict[str, Any] = {}
         else:
             extra_args = dict(ttl=1, interface_address=self.sd_spead_ifaddr)
         stream = spead2.send.asyncio.UdpStream(
-            spead2.ThreadPool(), [(endpoint.host, endpoint.port)], config, **extra_args)
+            _make_thread_pool(self.sd_spead_cores, len(self._sdisp_ips)),
+            [(endpoint.host, endpoint.port)], config, **extra_args)
         # Ensure that signal display streams that form the full band between
         # them always have unique heap cnts. The first output channel is used
         # as a unique key.
         stream.set_cnt_sequence(self.channel_ranges.sd_output.start,
                                 len(self.channel_ranges.cbf))
+        if encoding != 'float32' or delta or rate is not None or subsample > 1:
+            self._sdisp_encoders[endpoint.host] = sender.SdEncoder(_SD_FLAVOUR, encoding, delta)
+        self._sdisp_subsample[endpoint.host] = subsample
         self._sdisp_ips[endpoint.host] = stream
+        self._sdisp_need_descriptors.add(endpoint.host)
 
     async def _flush_output(self, output_idx: int) -> None:
         """Finalise averaging of a group of input dumps and emit an output dump"""
@@ -1222,6 +1610,7 @@ class CBFIngest:
             self.command_queue.enqueue_wait_for_events(events)
 
             # Compute
+            transfer_start = time.monotonic()
             proc.end_sum()
             self.command_queue.flush()
 
@@ -1249,6 +1638,7 @@ class CBFIngest:
             assert self.rx is not None     # keep mypy happy
             ts_rel = _mid_timestamp_rel(self._output_avg, self.rx, output_idx)
             await resource.async_wait_for_events([transfer_done])
+            self._latency['output-transfer'].add(time.monotonic() - transfer_start)
             futures = []
             # Compute deltas before updating the sensors, so that only a single
             # update is observed.
@@ -1261,7 +1651,8 @@ class CBFIngest:
                 inc_heaps += tx.size
                 inc_dumps += 1
                 futures.append(tx.send(part, output_idx, ts_rel))
-            await asyncio.gather(*futures)
+            with self._latency['output-send'].time():
+                await asyncio.gather(*futures)
             now = time.time()
             self.output_bytes_sensor.increment(inc_bytes, timestamp=now)
             self.output_heaps_sensor.increment(inc_heaps, timestamp=now)
@@ -1315,6 +1706,7 @@ class CBFIngest:
                 host_sd_input_a as host_sd_input, \
                 sd_output_a as sd_output_buffers, \
                 host_sd_output_a as host_sd_output:
+            start = time.monotonic()
             spec_channels = self.channel_ranges.sd_output.relative_to(
                 self.channel_ranges.computed).asslice()
             assert spec_channels.start is not None    # needed just for mypy
@@ -1346,7 +1738,7 @@ class CBFIngest:
             # Transfer back to host
             events = await host_sd_output_a.wait()
             self.command_queue.enqueue_wait_for_events(events)
-            for name in host_sd_output:
+            for name in sd_output_buffers:
                 sd_output_buffers[name].get_async(self.command_queue, host_sd_output[name])
             transfer_out_done = self.command_queue.enqueue_marker()
 
@@ -1370,37 +1762,54 @@ class CBFIngest:
             timeseriesabs = host_sd_output['timeseriesabs']
             flag_counts = host_sd_output['sd_flag_counts']
             flag_counts_scale = self._sd_avg.ratio * len(self.channel_ranges.sd_output)
-            flag_fraction = flag_counts.astype(np.float32) / np.float32(flag_counts_scale)
-            assert flag_fraction.dtype == np.float32
-            percentiles = []
-            percentiles_flags = []
+            flag_fraction = host_sd_output['sd_flag_fraction']
+            flag_fraction[:] = flag_counts
+            flag_fraction /= np.float32(flag_counts_scale)
+            # Assemble the percentiles in their final layout
+            percspectrum = host_sd_output['sd_percspectrum']
+            percspectrumflags = host_sd_output['sd_percspectrumflags']
+            pos = 0
             for i in range(len(proc.percentiles)):
                 name = 'percentile{0}'.format(i)
-                p = host_sd_output[name]
-                pflags = host_sd_output[name + '_flags']
-                p = p[..., spec_channels]
-                pflags = pflags[..., spec_channels]
-                percentiles.append(p)
+                p = host_sd_output[name][..., spec_channels]
+                pflags = host_sd_output[name + '_flags'][..., spec_channels]
+                percspectrum[:, pos : pos + p.shape[0]] = p.T
                 # Signal display server wants flags duplicated to broadcast with
                 # the percentiles
-                percentiles_flags.append(np.tile(pflags, (p.shape[0], 1)))
+                percspectrumflags[:, pos : pos + p.shape[0]] = pflags[:, np.newaxis]
+                pos += p.shape[0]
 
             # populate new datastructure to supersede sd_data etc
             self.ig_sd['sd_timestamp'].value = int(ts * 100)
             if np.all(custom_signals_indices < spec_vis.shape[1]):
-                self.ig_sd['sd_data'].value = \
-                    _split_array(spec_vis, np.float32)[spec_channels, custom_signals_indices, :]
+                n_spec_channels = len(self.channel_ranges.sd_output)
+                n_signals = len(custom_signals_indices)
+                sd_data = host_sd_output['sd_data'][:n_spec_channels * n_signals * 2]
+                sd_data = sd_data.reshape(n_spec_channels, n_signals, 2)
+                sd_flags = host_sd_output['sd_flags'][:n_spec_channels * n_signals]
+                sd_flags = sd_flags.reshape(n_spec_channels, n_signals)
+                # Indices have been checked, so 'clip' just avoids buffering in np.take
+                np.take(_split_array(spec_vis, np.float32)[spec_channels],
+                        custom_signals_indices, axis=1, out=sd_data, mode='clip')
+                np.take(spec_flags[spec_channels], custom_signals_indices,
+                        axis=1, out=sd_flags, mode='clip')
+                self.ig_sd['sd_data'].value = sd_data
                 self.ig_sd['sd_data_index'].value = custom_signals_indices
-                self.ig_sd['sd_flags'].value = spec_flags[spec_channels, custom_signals_indices]
+                self.ig_sd['sd_flags'].value = sd_flags
             else:
                 logger.warning('sdisp_custom_signals out of range, not updating (%s)',
                                custom_signals_indices)
+                # The previous values may live in another host buffer, which
+                # could be reused while this heap is being sent.
+                for name in ['sd_data', 'sd_flags']:
+                    if self.ig_sd[name].value is not None:
+                        self.ig_sd[name].value = np.copy(self.ig_sd[name].value)
             self.ig_sd['sd_blmxdata'].value = _split_array(cont_vis[cont_channels, ...], np.float32)
             self.ig_sd['sd_blmxflags'].value = cont_flags[cont_channels, ...]
             self.ig_sd['sd_timeseries'].value = _split_array(timeseries, np.float32)
             self.ig_sd['sd_timeseriesabs'].value = timeseriesabs
-            self.ig_sd['sd_percspectrum'].value = np.vstack(percentiles).transpose()
-            self.ig_sd['sd_percspectrumflags'].value = np.vstack(percentiles_flags).transpose()
+            self.ig_sd['sd_percspectrum'].value = percspectrum
+            self.ig_sd['sd_percspectrumflags'].value = percspectrumflags
             self.ig_sd['sd_flag_fraction'].value = flag_fraction
 
             # Update sensors
@@ -1410,8 +1819,9 @@ class CBFIngest:
             self.output_flagged_sensor.increment(flag_any_count, now)
             self.output_vis_sensor.increment(flag_counts_scale * n_baselines, now)
 
-            await self._send_sd_data(self.ig_sd.get_heap(descriptors='all', data='all'))
+            await self._send_sd_dump()
             host_sd_output_a.ready()
+            self._latency['sd-flush'].add(time.monotonic() - start)
             logger.debug("Finished SD group with index %d", output_idx)
 
     def _set_external_flags(self, baseline_flags: np.ndarray, channel_mask: np.ndarray,
@@ -1445,27 +1855,26 @@ class CBFIngest:
             if channel_data_suspect is not None:
                 channel_mask[:] |= channel_data_suspect[np.newaxis, channel_slice] * cam_flag
 
-        baselines = self.bls_ordering.sdp_bls_ordering
-        input_labels = self.cbf_attr['input_labels']
-        input_suspect: Dict[str, bool] = {}
+        antenna_values, antenna_updated = self._antenna_suspect_history.get(timestamp)
+        for i in antenna_updated:
+            self._antenna_suspect[i] = bool(antenna_values[i])
+        # Last element is for inputs not found in the input labels
+        input_suspect = np.zeros(self._n_suspect_inputs + 1, np.bool_)
         if self.use_data_suspect:
             input_suspect_sensor = self._telstate_values['input_data_suspect'].get(timestamp)
             if input_suspect_sensor is not None:
-                input_suspect = {label: input_suspect_sensor[i]
-                                 for i, label in enumerate(input_labels)}
-
-        for i, baseline in enumerate(baselines):
-            # [:-1] indexing strips off h/v pol
-            a = baseline[0][:-1]
-            b = baseline[1][:-1]
-            flagged = False
-            for antenna in (a, b):
-                if self._telstate_values['{}_data_suspect'.format(antenna)].get(timestamp):
-                    flagged = True
-            for input_ in baseline:
-                if input_suspect.get(input_):
-                    flagged = True
-            baseline_flags[i] = cam_flag if flagged else 0
+                input_suspect[:-1] = input_suspect_sensor
+
+        # The sensors change rarely, so only redo the per-baseline work when
+        # one of them has changed.
+        if (len(antenna_updated)
+                or self._last_input_suspect is None
+                or not np.array_equal(input_suspect, self._last_input_suspect)):
+            self._baseline_suspect = (
+                np.any(self._antenna_suspect[self._bls_antenna_idx], axis=1)
+                | np.any(input_suspect[self._bls_input_idx], axis=1))
+            self._last_input_suspect = input_suspect
+        baseline_flags[:] = self._baseline_suspect * cam_flag
 
     async def _frame_job(
             self,
@@ -1482,17 +1891,15 @@ class CBFIngest:
             channel_mask = host_input['channel_mask']
             # Load data
             await host_input_a.wait_events()
-            # First channel of the current item
-            item_channel = self.channel_ranges.subscribed.start
-            # We only receive frames with at least one populated item, so we
-            # can always find out the number of channels per item
-            channels_per_item = None
-            for item in frame.items:
-                if item is not None:
-                    channels_per_item = item.shape[0]
-                    break
-            assert channels_per_item is not None
-            if not frame.ready():
+            # The items evenly divide the subscribed channels
+            channels_per_item = len(self.channel_ranges.subscribed) // len(frame.items)
+            input_range = self.channel_ranges.input.relative_to(self.channel_ranges.subscribed)
+            # In zero-copy mode the frame already holds all the channels
+            # contiguously, with missing data zero-filled.
+            input_data = None      # type: Optional[np.ndarray]
+            if frame.data is not None:
+                input_data = frame.data[input_range.asslice()]
+            elif not frame.ready():
                 # We want missing data to be zero-filled. katsdpsigproc doesn't
                 # currently have a zero_region, and device bandwidth is so much
                 # higher than PCIe transfer bandwidth that it doesn't really
@@ -1500,29 +1907,49 @@ class CBFIngest:
                 vis_in_buffer.zero(self.command_queue)
 
             await sensor_a.wait()
-            self._set_external_flags(baseline_flags, channel_mask, timestamp)
+            with self._latency['external-flags'].time():
+                self._set_external_flags(baseline_flags, channel_mask, timestamp)
             sensor_a.ready()
 
-            for item in frame.items:
-                item_range = utils.Range(item_channel, item_channel + channels_per_item)
-                item_channel = item_range.stop
-                use_range = item_range.intersection(self.channel_ranges.input)
-                if not use_range:
-                    continue
-                dest_range = use_range.relative_to(self.channel_ranges.input)
-                src_range = use_range.relative_to(item_range)
-                if item is None:
-                    channel_mask[:, dest_range.asslice()] = DATA_LOST
-                    vis_in[dest_range.asslice()] = 0
-                else:
+            copy_start = time.monotonic()
+            if not frame.ready():
+                lost = np.repeat(~frame.present, channels_per_item)[input_range.asslice()]
+                channel_mask[:, lost] = DATA_LOST
+                if input_data is None:
+                    vis_in[lost] = 0
+            if input_data is None:
+                item_channel = self.channel_ranges.subscribed.start
+                for item in frame.items:
+                    item_range = utils.Range(item_channel, item_channel + channels_per_item)
+                    item_channel = item_range.stop
+                    if item is None:
+                        continue
+                    use_range = item_range.intersection(self.channel_ranges.input)
+                    if not use_range:
+                        continue
+                    dest_range = use_range.relative_to(self.channel_ranges.input)
+                    src_range = use_range.relative_to(item_range)
                     vis_in[dest_range.asslice()] = item[src_range.asslice()]
+            # The host implementation can consume the frame directly (the
+            # byte-swap happens as part of the transfer). The device needs
+            # native-endian pinned memory, so convert in one vectorised copy.
+            direct = isinstance(vis_in_buffer, sigproc_host.HostBuffer)
+            if input_data is not None and not direct:
+                np.copyto(vis_in, input_data)
+                input_data = None
+            self._latency['frame-copy'].add(time.monotonic() - copy_start)
             del frame      # Free the memory back to the frame pool as soon as possible
 
             # Transfer data to the device
             events = await input_a.wait()
             self.command_queue.enqueue_wait_for_events(events)
+            transfer_start = time.monotonic()
             for name in input_buffers:
-                input_buffers[name].set_async(self.command_queue, host_input[name])
+                if name == 'vis_in' and input_data is not None:
+                    input_buffers[name].set_async(self.command_queue, input_data)
+                else:
+                    input_buffers[name].set_async(self.command_queue, host_input[name])
+            del input_data
             transfer_done = self.command_queue.enqueue_marker()
             self.command_queue.flush()
             host_input_a.ready([transfer_done])
@@ -1535,6 +1962,14 @@ class CBFIngest:
             input_a.ready([done_event])
             proc_a.ready([done_event])
 
+        # Record device latencies. Nothing waits for this job to complete, so
+        # this does not hold up the pipeline.
+        await resource.async_wait_for_events([transfer_done])
+        transfer_end = time.monotonic()
+        self._latency['input-transfer'].add(transfer_end - transfer_start)
+        await resource.async_wait_for_events([done_event])
+        self._latency['proc'].add(time.monotonic() - transfer_end)
+
     @property
     def capturing(self) -> bool:
         return self._run_task is not None
@@ -1547,6 +1982,7 @@ class CBFIngest:
         self._stopped = False
         self._telstate_sdisp_values = {}
         self._telstate_values = {}
+        self._reset_baseline_suspect()
         self.capture_block_id = capture_block_id
         loop = asyncio.get_event_loop()
         self._run_task = loop.create_task(self.run())
@@ -1653,13 +2089,19 @@ class CBFIngest:
 
         await self._watch_sensor(self.telstate_sdisp, key, notify)
 
-    async def _update_sensor(self, telstate: katsdptelstate.aio.TelescopeState, key: str) -> None:
+    async def _update_sensor(self, telstate: katsdptelstate.aio.TelescopeState, key: str,
+                             group: Optional[SensorHistoryGroup] = None) -> None:
         logger.debug('Starting _update_sensor for %s', key)
         assert self.rx is not None
-        sh = self._telstate_values[key] = SensorHistory(key)
+        add: Callable[[float, Any], None]
+        if group is None:
+            sh = self._telstate_values[key] = SensorHistory(key)
+            add = sh.add
+        else:
+            add = functools.partial(group.add, key)
 
         def notify(value: Any, ts: float) -> None:
-            sh.add(ts, value)
+            add(ts, value)
             # Avoid logging array values, but show values of simple scalars
             # (note that bool is a subclass of int).
             if isinstance(value, (int, float)):
@@ -1683,7 +2125,8 @@ class CBFIngest:
         assert self.rx is not None     # keeps mypy happy
         while True:
             try:
-                frame = await self.rx.get()
+                with self._latency['rx-wait'].time():
+                    frame = await self.rx.get()
             except spead2.Stopped:
                 logger.info('Detected receiver stopped')
                 await self.rx.join()
@@ -1730,6 +2173,9 @@ class CBFIngest:
         await self._output_avg.finish(flush=False)
         await self._sd_avg.finish(flush=False)
         self._init_ig_sd()
+        self._sd_heaps = 0
+        for encoder in self._sdisp_encoders.values():
+            encoder.reset()
         # Send start-of-stream packets.
         await self._send_sd_data(self.ig_sd.get_start())
         for tx in self.tx.values():
@@ -1739,17 +2185,29 @@ class CBFIngest:
         prefixes = [self.telstate.join(self.capture_block_id, l0_name)
                     for l0_name in self.l0_names]
         telstates = [self.telstate.view(prefix) for prefix in prefixes]
-        self.rx = TelstateReceiver(
+        rx_kwargs: Dict[str, Any] = {}
+        rx_class: Type[TelstateReceiver] = TelstateReceiver
+        if self.rx_replay:
+            rx_class = TelstateReplayReceiver
+            rx_kwargs = dict(captures=self.rx_replay, speedup=self.rx_replay_speedup)
+        self.rx = rx_class(
             self.rx_spead_endpoints, self.rx_spead_ifaddr, self.rx_spead_ibv,
             self.rx_spead_max_streams,
             max_packet_size=self.rx_spead_max_packet_size,
             buffer_size=self.rx_spead_buffer_size,
+            zero_copy=self.rx_spead_zero_copy,
+            threaded=self.rx_spead_threaded,
+            max_active_frames=self.rx_spead_max_active_frames,
+            queue_frames=self.rx_spead_queue_frames,
+            overflow=self.rx_spead_overflow,
+            cores=self.rx_spead_cores,
             channel_range=self.channel_ranges.subscribed,
             cbf_channels=len(self.channel_ranges.cbf),
             sensors=self._my_sensors,
             cbf_attr=self.cbf_attr,
             telstates=telstates,
-            l0_int_time=self.cbf_attr['int_time'] * self._output_avg.ratio)
+            l0_int_time=self.cbf_attr['int_time'] * self._output_avg.ratio,
+            **rx_kwargs)
         # If stop() was called before we create self.rx, it won't have been able
         # to call self.rx.stop(), but it will have set _stopped.
         if self._stopped:
@@ -1761,16 +2219,14 @@ class CBFIngest:
         for name in ['channel_mask', 'channel_data_suspect', 'input_data_suspect']:
             self._add_sidecar_task(f'{name} updater', self._update_sensor, self.telstate_cbf, name)
 
-        antennas = set()
-        for a, b in self.bls_ordering.sdp_bls_ordering:
-            antennas.add(a[:-1])
-            antennas.add(b[:-1])
-        for antenna in antennas:
-            name = f'{antenna}_data_suspect'
-            self._add_sidecar_task(f'{name} updater', self._update_sensor, self.telstate, name)
+        for name in self._antenna_suspect_history.names:
+            self._add_sidecar_task(f'{name} updater', self._update_sensor, self.telstate, name,
+                                   self._antenna_suspect_history)
 
         # The main loop
         await self._get_data()
+        if self.rx.recorder is not None:
+            await self.stop_recording()
 
         logger.info('Joined with receiver. Flushing final groups...')
         await self._output_avg.finish()
@@ -1778,6 +2234,8 @@ class CBFIngest:
         logger.info('Waiting for jobs to complete...')
         await self.jobs.finish()
         logger.info('Jobs complete')
+        for tracker in self._latency.values():
+            tracker.publish()
         for (name, tx) in self.tx.items():
             logger.info('Stopping %s tx stream...', name)
             await tx.stop()
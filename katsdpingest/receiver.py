@@ -1,10 +1,18 @@
 """Receives from multiple SPEAD streams and combines heaps into frames."""
 
 import logging
+import os
 from collections import deque
 import asyncio
+import concurrent.futures
+import contextlib
+import ctypes
+import functools
+import threading
+import weakref
 import typing   # noqa: F401
-from typing import List, Sequence, Mapping, Any, Optional, Union   # noqa: F401
+from typing import (     # noqa: F401
+    List, Sequence, Mapping, Any, Optional, Tuple, Union, NamedTuple, Awaitable, TypeVar)
 
 import spead2
 import spead2.recv
@@ -12,12 +20,18 @@ import spead2.recv.asyncio
 from aiokatcp import Sensor
 
 import numpy as np
+import numba
+from numba import types
+import scipy
+from spead2.numba import intp_to_voidptr
+from spead2.recv.numba import chunk_place_data
 from katsdptelstate.endpoint import endpoints_to_str, Endpoint
 
 from .utils import Range
 
 
 _logger = logging.getLogger(__name__)
+_T = TypeVar('_T')
 
 
 REJECT_HEAP_TYPES = {
@@ -30,23 +44,336 @@ REJECT_HEAP_TYPES = {
     'bad-heap': 'heap items are missing, wrong shape etc'
 }
 
+# Actions that can be taken when a frame is complete but the queue of
+# complete frames is full.
+OVERFLOW_POLICIES = {
+    'block': 'wait for processing to catch up',
+    'drop-oldest': 'discard the oldest queued frame',
+    'drop-newest': 'discard the newly completed frame'
+}
+
+# Number of frames retired from the window between decisions to shrink an
+# adaptive window.
+_ADAPT_FRAMES = 16
+
+# Item IDs and payload type used by the CBF. These are only needed when
+# receiving in zero-copy mode, which does not use descriptors.
+TIMESTAMP_ID = 0x1600
+FREQUENCY_ID = 0x4103
+XENG_RAW_ID = 0x1800
+XENG_RAW_DTYPE = np.dtype('>i4')
+
+# Indices into the parameter array passed to the chunk placement callback
+_PLACE_INTERVAL = 0
+_PLACE_CHANNEL0 = 1
+_PLACE_CHANNELS = 2
+_PLACE_HEAP_CHANNELS = 3
+_PLACE_HEAP_BYTES = 4
+_PLACE_STAT_METADATA = 5
+_PLACE_STAT_BAD_CHANNEL = 6
+_PLACE_STAT_BAD_HEAP = 7
+_PLACE_PARAMS = 8
+
+
+@functools.lru_cache(maxsize=None)
+def _chunk_place_callback() -> Any:
+    """Compile the chunk placement callback for zero-copy reception.
+
+    This is done lazily because it takes a while.
+    """
+    @numba.cfunc(types.void(types.CPointer(chunk_place_data), types.size_t,
+                            types.CPointer(types.int64)),
+                 nopython=True)
+    def place(data_ptr, data_size, params):
+        data = numba.carray(data_ptr, 1)
+        items = numba.carray(intp_to_voidptr(data[0].items), 3, dtype=np.int64)
+        batch_stats = numba.carray(intp_to_voidptr(data[0].batch_stats),
+                                   params[_PLACE_STAT_BAD_HEAP] + 1, dtype=np.uint64)
+        timestamp = items[0]
+        channel0 = items[1]
+        heap_bytes = items[2]
+        if timestamp < 0 or channel0 < 0:
+            batch_stats[params[_PLACE_STAT_METADATA]] += 1
+            return
+        if heap_bytes != params[_PLACE_HEAP_BYTES]:
+            batch_stats[params[_PLACE_STAT_BAD_HEAP]] += 1
+            return
+        offset = channel0 - params[_PLACE_CHANNEL0]
+        heap_channels = params[_PLACE_HEAP_CHANNELS]
+        if offset < 0 or offset >= params[_PLACE_CHANNELS] or offset % heap_channels != 0:
+            batch_stats[params[_PLACE_STAT_BAD_CHANNEL]] += 1
+            return
+        heap_index = offset // heap_channels
+        data[0].chunk_id = timestamp // params[_PLACE_INTERVAL]
+        data[0].heap_index = heap_index
+        data[0].heap_offset = heap_index * heap_bytes
+        # Record the actual timestamp, so that misaligned heaps can be detected
+        extra = numba.carray(intp_to_voidptr(data[0].extra), 1, dtype=np.int64)
+        extra[0] = timestamp
+        data[0].extra_offset = heap_index * 8
+        data[0].extra_size = 8
+
+    return place
+
+
+def _recycle_chunk(group: spead2.recv.ChunkStreamRingGroup, chunk: spead2.recv.Chunk) -> None:
+    """Return a chunk to the free ring once the frame using it has been freed."""
+    chunk.present[:] = 0
+    try:
+        group.add_free_chunk(chunk)
+    except spead2.Stopped:
+        pass
+
+
+# When choosing the stream layout automatically, each stream's share of the
+# network buffer must hold at least this many heaps.
+_MIN_BUFFER_HEAPS = 4
+
+
+class StreamLayout(NamedTuple):
+    """Assignment of endpoints to spead2 receive streams (see :func:`plan_layout`).
+
+    Attributes
+    ----------
+    endpoint_groups : list of list of :class:`katsdptelstate.endpoint.Endpoint`
+        Endpoints for each stream
+    threads : list of int
+        Number of threads in the thread pool of each stream
+    affinity : list of list of int
+        CPU cores to which the thread pool of each stream is pinned, or an
+        empty list to leave it unpinned
+    buffer_size : int
+        Network buffer size for each stream
+    """
+    endpoint_groups: List[List[Endpoint]]
+    threads: List[int]
+    affinity: List[List[int]]
+    buffer_size: int
+
+    def thread_pool(self, stream_idx: int) -> spead2.ThreadPool:
+        """Create the thread pool for a stream."""
+        if self.affinity[stream_idx]:
+            return spead2.ThreadPool(self.threads[stream_idx], self.affinity[stream_idx])
+        else:
+            return spead2.ThreadPool(self.threads[stream_idx])
+
+    def describe(self) -> str:
+        """Summarise the layout for logging."""
+        streams = []
+        for i, group in enumerate(self.endpoint_groups):
+            desc = 'stream {}: {} ({} thread(s)'.format(
+                i, endpoints_to_str(group), self.threads[i])
+            if self.affinity[i]:
+                desc += ' on core(s) {}'.format(','.join(str(core) for core in self.affinity[i]))
+            streams.append(desc + ')')
+        return '{} stream(s) with {} bytes of buffer each; {}'.format(
+            len(self.endpoint_groups), self.buffer_size, '; '.join(streams))
+
+
+def plan_layout(endpoints: Sequence[Endpoint], heap_bytes: int, buffer_size: int,
+                max_streams: int = 0, cores: Optional[Sequence[int]] = None,
+                reserved_cores: int = 1) -> StreamLayout:
+    """Decide how to spread endpoints across spead2 receive streams.
+
+    If `max_streams` is positive, the endpoints are spread evenly across
+    that many streams (or fewer if there are not enough endpoints), each
+    with a single thread. The threads are unpinned unless `cores` is given,
+    in which case the cores after the first `reserved_cores` are shared out
+    between the streams as below (with streams sharing a core if there are
+    more streams than cores).
+
+    Otherwise the layout is chosen automatically:
+
+    - The first `reserved_cores` of `cores` are left for the event loop and
+      signal processing, and there is a stream for each of the remaining
+      cores, up to one per endpoint.
+    - The number of streams is limited so that each stream's share of
+      `buffer_size` can hold a few heaps of `heap_bytes`.
+    - The remaining cores are shared out between the streams, and each
+      stream gets a thread per core, up to one per endpoint (since a reader
+      is serviced by a single thread). The threads are pinned to those
+      cores.
+
+    Parameters
+    ----------
+    endpoints : list of :class:`katsdptelstate.endpoint.Endpoint`
+        Endpoints to subscribe to
+    heap_bytes : int
+        Payload size of each heap
+    buffer_size : int
+        Total network buffer size, which is split across the streams
+    max_streams : int, optional
+        Number of streams to use, or 0 to choose automatically
+    cores : list of int, optional
+        CPU cores available for receive threads (defaults to the affinity of
+        the process when the layout is chosen automatically)
+    reserved_cores : int, optional
+        Number of cores not to use for receive threads
+    """
+    n_endpoints = len(endpoints)
+    if cores is None and max_streams <= 0:
+        if hasattr(os, 'sched_getaffinity'):
+            cores = sorted(os.sched_getaffinity(0))
+        else:
+            cores = list(range(os.cpu_count() or 1))
+    spare = list(cores[reserved_cores:]) if cores is not None else []
+    if max_streams > 0:
+        n_streams = min(max_streams, n_endpoints)
+        threads_per_stream = 1
+    else:
+        threads_per_stream = n_endpoints
+        n_streams = min(n_endpoints, len(spare), buffer_size // (_MIN_BUFFER_HEAPS * heap_bytes))
+        n_streams = max(n_streams, 1)
+    endpoint_groups = []
+    threads = []
+    affinity = []        # type: List[List[int]]
+    for i in range(n_streams):
+        group = list(endpoints[n_endpoints * i // n_streams : n_endpoints * (i + 1) // n_streams])
+        endpoint_groups.append(group)
+        if spare:
+            stream_cores = spare[len(spare) * i // n_streams : len(spare) * (i + 1) // n_streams]
+            if not stream_cores:
+                stream_cores = [spare[len(spare) * i // n_streams]]
+            stream_cores = stream_cores[:min(len(group), threads_per_stream)]
+            threads.append(len(stream_cores))
+            affinity.append(stream_cores)
+        else:
+            threads.append(1)
+            affinity.append([])
+    return StreamLayout(endpoint_groups, threads, affinity, buffer_size // n_streams)
+
+
+class _HeapLayout(NamedTuple):
+    """Item IDs and data layout of CBF data heaps, for :meth:`Receiver._decode_heap`."""
+    timestamp_id: int
+    frequency_id: int
+    xeng_raw_id: int
+    dtype: np.dtype
+    shape: Tuple[int, ...]
+    nbytes: int
+
+
+class _DeferredSensor:
+    """Stand-in for a sensor that is updated from a receive thread.
+
+    The value is copied to the real sensor by :meth:`sync`, which must be
+    called from the event loop.
+    """
+    __slots__ = ['sensor', 'value']
+
+    def __init__(self, sensor: Sensor) -> None:
+        self.sensor = sensor
+        self.value = sensor.value
+
+    def sync(self) -> None:
+        if self.sensor.value != self.value:
+            self.sensor.value = self.value
+
 
 class Frame:
-    """A group of xeng_raw data with a common timestamp"""
+    """A group of xeng_raw data with a common timestamp
+
+    Items must be added with :meth:`add_item` rather than by assigning to
+    `items`, so that the presence bitmap and totals stay consistent.
+
+    Attributes
+    ----------
+    items : list of :class:`np.ndarray`
+        xeng_raw data for each X engine, or ``None`` where it is missing
+    present : :class:`np.ndarray`
+        Boolean array indicating which entries of `items` are populated
+    n_present : int
+        Number of populated entries of `items`
+    data : :class:`np.ndarray`, optional
+        If the frame was received in zero-copy mode, a single array holding
+        the data for all the X engines, indexed by channel, baseline and
+        real/imag. The entries of `items` are then views of this array, and
+        channels of missing items are zero.
+    """
+    __slots__ = ['idx', 'timestamp', 'items', 'present', 'n_present', 'data', '_nbytes']
+
     def __init__(self, idx: int, timestamp: int, n_xengs: int) -> None:
         self.idx = idx
         self.timestamp = timestamp
         self.items = [None] * n_xengs    # type: List[Optional[np.ndarray]]
+        self.present = np.zeros(n_xengs, np.bool_)
+        self.n_present = 0
+        self.data = None                 # type: Optional[np.ndarray]
+        self._nbytes = 0
+
+    def add_item(self, xeng_idx: int, item: np.ndarray) -> None:
+        """Populate the data for X engine `xeng_idx`, replacing any existing data."""
+        old = self.items[xeng_idx]
+        if old is None:
+            self.present[xeng_idx] = True
+            self.n_present += 1
+        else:
+            self._nbytes -= old.nbytes
+        self.items[xeng_idx] = item
+        self._nbytes += item.nbytes
 
     def ready(self) -> bool:
-        return all(item is not None for item in self.items)
+        return self.n_present == len(self.items)
 
     def empty(self) -> bool:
-        return all(item is None for item in self.items)
+        return self.n_present == 0
 
     @property
     def nbytes(self) -> int:
-        return sum([(item.nbytes if item is not None else 0) for item in self.items])
+        return self._nbytes
+
+
+class _CompletionQueue:
+    """Queue of complete frames, with a limit on the number of frames.
+
+    It may also contain integers (the indices of finished streams), which
+    do not count towards the limit and so never block.
+
+    Parameters
+    ----------
+    max_frames : int
+        Maximum number of frames in the queue
+    """
+    def __init__(self, max_frames: int) -> None:
+        self.max_frames = max_frames
+        self._items = deque()    # type: typing.Deque[Union[Frame, int]]
+        self._n_frames = 0
+        self._changed = asyncio.Condition()
+
+    def qsize(self) -> int:
+        """Number of frames in the queue"""
+        return self._n_frames
+
+    def full(self) -> bool:
+        return self._n_frames >= self.max_frames
+
+    async def put(self, item: Union[Frame, int]) -> None:
+        """Append an item, waiting for space if it is a frame."""
+        async with self._changed:
+            if isinstance(item, Frame):
+                await self._changed.wait_for(lambda: not self.full())
+                self._n_frames += 1
+            self._items.append(item)
+            self._changed.notify_all()
+
+    async def get(self) -> Union[Frame, int]:
+        """Remove and return the oldest item, waiting for one if necessary."""
+        async with self._changed:
+            await self._changed.wait_for(lambda: bool(self._items))
+            item = self._items.popleft()
+            if isinstance(item, Frame):
+                self._n_frames -= 1
+            self._changed.notify_all()
+            return item
+
+    def drop_oldest(self) -> Optional[Frame]:
+        """Remove and return the oldest frame, if any."""
+        for i, item in enumerate(self._items):
+            if isinstance(item, Frame):
+                del self._items[i]
+                self._n_frames -= 1
+                return item
+        return None
 
 
 class Receiver:
@@ -64,7 +391,9 @@ class Receiver:
         If true, use ibverbs for acceleration
     max_streams : int
         Maximum number of separate streams to use. The endpoints are spread
-        across the streams, with a thread per stream.
+        across the streams, with a thread per stream. If zero, the number
+        of streams, threads per stream and their CPU affinity are chosen
+        by :func:`plan_layout`.
     max_packet_size : int
         Maximum packet size in bytes.
     buffer_size : int
@@ -78,16 +407,66 @@ class Receiver:
     cbf_attr : dict
         Dictionary mapping CBF attribute names to value
     active_frames : int, optional
-        Maximum number of incomplete frames to keep at one time
+        Maximum number of incomplete frames to keep at one time. If
+        `max_active_frames` is given, this is instead the minimum.
+    queue_frames : int, optional
+        Maximum number of complete frames to hold while waiting for
+        :meth:`get` to be called
+    overflow : str, optional
+        What to do with a complete frame when `queue_frames` frames are
+        already waiting (one of the keys of :data:`OVERFLOW_POLICIES`).
+        Dropping a frame sacrifices a whole dump, rather than blocking the
+        receive coroutines and losing arbitrary packets in the network
+        buffers.
+    max_active_frames : int, optional
+        If specified, the number of incomplete frames is adapted to the
+        lateness of arriving heaps, between `active_frames` and this value.
+        The window grows as soon as a heap arrives that is too late for it,
+        and shrinks by one frame at a time once a period passes in which no
+        heap would have needed the extra depth. Memory for the larger window
+        is only allocated when it is needed. This is not supported in
+        zero-copy mode.
+    zero_copy : bool, optional
+        If true, use spead2 chunking to have packet payloads written directly
+        into a contiguous array per frame (see :attr:`Frame.data`), instead
+        of allocating each heap separately. In this mode descriptors are not
+        used (the item IDs and types are assumed to match the CBF ICD),
+        timestamp wrapping is not handled, and a stream stops as soon as any
+        one of its endpoints sends a stop heap.
+    threaded : bool, optional
+        If true, heaps from each stream are processed and assembled into
+        frames by a dedicated thread (with its own event loop), so that only
+        complete frames are handed to the caller's event loop. The frame
+        window is shared between the threads and protected by a lock. This
+        is not supported in zero-copy mode, which already assembles frames
+        outside the event loop.
+    cores : list of int, optional
+        CPU cores to which the receive thread pools are pinned. They are
+        shared out between the streams by :func:`plan_layout`. If not
+        specified, the cores are chosen automatically when `max_streams` is
+        zero and the threads are unpinned otherwise.
 
     Attributes
     ----------
     cbf_attr : dict
         Dictionary mapping CBF attribute names to value
     active_frames : int
-        Value of `active_frames` passed to constructor
+        Current number of incomplete frames kept. This is the value of
+        `active_frames` passed to constructor unless the window is adaptive.
+    max_active_frames : int, optional
+        Value of `max_active_frames` passed to constructor
     interval : int
         Timestamp change between successive frames.
+    zero_copy : bool
+        Value of `zero_copy` passed to constructor
+    threaded : bool
+        Value of `threaded` passed to constructor
+    layout : :class:`StreamLayout`
+        Assignment of endpoints to streams
+    recorder : :class:`katsdpingest.replay.HeapRecorder`, optional
+        If set, every complete heap received is passed to its
+        :meth:`~katsdpingest.replay.HeapRecorder.record` method. This is not
+        supported in zero-copy mode.
     timestamp_base : Optional[int]
         Timestamp associated with the frame with index 0. It is initially
         ``None``, and is set when the first dump is received. The raw
@@ -97,7 +476,7 @@ class Receiver:
         Deque of :class:`Frame` objects representing incomplete frames. After
         initialization, it always contains exactly `active_frames`
         elements, with timestamps separated by the inter-dump interval.
-    _frames_complete : :class:`asyncio.Queue`
+    _frames_complete : :class:`_CompletionQueue`
         Queue of complete frames of type :class:`Frame`. It may also contain
         integers, which are the numbers of finished streams.
     _running : int
@@ -105,10 +484,23 @@ class Receiver:
     _futures : list of :class:`asyncio.Future`
         Futures associated with each call to :meth:`_read_stream`
     _streams : list of :class:`spead2.recv.asyncio.Stream`
-        Individual SPEAD streams
+        Individual SPEAD streams. In zero-copy mode, it instead contains a
+        single :class:`spead2.recv.ChunkStreamRingGroup`.
     _stopping : bool
         Set to try by stop(). Note that some streams may still be running
         (:attr:`_running` > 0) at the same time.
+    _heap_layout : :class:`_HeapLayout`, optional
+        Layout of data heaps derived from the descriptors, if they are
+        suitable for :meth:`_decode_heap`.
+    _pool_heaps : list of int
+        Number of heaps from the memory pool of each stream that are still
+        referenced by frames (not used in zero-copy mode)
+    _pool_capacity : list of int
+        Number of heaps that the memory pool of each stream is sized for
+    _lateness : :class:`np.ndarray`, optional
+        Histogram of heap lateness (in frames behind the newest timestamp
+        seen) since the last adaptation decision. It is ``None`` if the
+        window is not adaptive.
     """
     def __init__(
             self,
@@ -118,7 +510,24 @@ class Receiver:
             channel_range: Range, cbf_channels: int,
             sensors: Mapping[str, Sensor],
             cbf_attr: Mapping[str, Any],
-            active_frames: int = 1) -> None:
+            active_frames: int = 1,
+            zero_copy: bool = False,
+            threaded: bool = False,
+            max_active_frames: Optional[int] = None,
+            queue_frames: int = 1,
+            overflow: str = 'block',
+            cores: Optional[Sequence[int]] = None) -> None:
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError('Unknown overflow policy {!r}'.format(overflow))
+        if queue_frames < 1:
+            raise ValueError('queue_frames must be positive')
+        if zero_copy and threaded:
+            raise ValueError('threaded mode cannot be combined with zero-copy mode')
+        if max_active_frames is not None:
+            if zero_copy:
+                raise ValueError('max_active_frames is not supported in zero-copy mode')
+            if max_active_frames < active_frames:
+                raise ValueError('max_active_frames must be at least active_frames')
         # Determine the endpoints to actually use
         if cbf_channels % len(endpoints):
             raise ValueError('cbf_channels not divisible by the number of endpoints')
@@ -133,18 +542,34 @@ class Receiver:
 
         self.cbf_attr = cbf_attr
         self.active_frames = active_frames
+        self.queue_frames = queue_frames
+        self.overflow = overflow
+        self.max_active_frames = max_active_frames
+        self._min_active_frames = active_frames
+        self._newest_timestamp = None    # type: Optional[int]
+        self._lateness = None            # type: Optional[np.ndarray]
+        if max_active_frames is not None:
+            self._lateness = np.zeros(max_active_frames + 1, np.int64)
+        self._adapt_countdown = _ADAPT_FRAMES
         self.channel_range = channel_range
         self.cbf_channels = cbf_channels
         self._interface_address = interface_address
         self._ibv = ibv
+        self.zero_copy = zero_copy
+        self.threaded = threaded
+        self._loop = asyncio.get_event_loop()
+        self._assembly_lock: typing.ContextManager = \
+            threading.Lock() if threaded else contextlib.nullcontext()
+        self.recorder = None     # type: Any
         self._streams = []      # type: List[spead2.recv.asyncio.Stream]
         self._frames = deque()  # type: typing.Deque[Frame]
-        self._frames_complete = asyncio.Queue(maxsize=1)  # type: asyncio.Queue[Union[Frame, int]]
+        self._frames_complete = _CompletionQueue(queue_frames)
         self._futures = []      # type: List[Optional[asyncio.Future]]
         self._stopping = False
         self.interval = cbf_attr['ticks_between_spectra'] * cbf_attr['n_accs']
         self.timestamp_base = None
         self._ig_cbf = spead2.ItemGroup()
+        self._heap_layout = None    # type: Optional[_HeapLayout]
 
         self._input_bytes = sensors['input-bytes-total']
         self._input_bytes.value = 0
@@ -152,6 +577,16 @@ class Receiver:
         self._input_heaps.value = 0
         self._input_dumps = sensors['input-dumps-total']
         self._input_dumps.value = 0
+        self._active_frames_sensor = sensors['input-active-frames']
+        self._active_frames_sensor.value = active_frames
+        self._frames_queued = sensors['input-frames-queued']
+        self._frames_queued.value = 0
+        self._overflow_sensors = {
+            policy: sensors['input-frames-overflow-' + policy + '-total']
+            for policy in OVERFLOW_POLICIES
+        }
+        for sensor in self._overflow_sensors.values():
+            sensor.value = 0
         self._descriptors_received = sensors['descriptors-received']
         self._descriptors_received.value = False
         self._metadata_heaps = sensors['input-metadata-heaps-total']
@@ -161,17 +596,87 @@ class Receiver:
         }
         for sensor in self._reject_heaps.values():
             sensor.value = 0
+        self._deferred_sensors = []    # type: List[_DeferredSensor]
+        if threaded:
+            # Sensors must only be touched from the event loop, so the
+            # receive threads update stand-ins which are synchronised by
+            # _put_frame and get.
+            self._input_bytes = self._defer_sensor(self._input_bytes)
+            self._input_heaps = self._defer_sensor(self._input_heaps)
+            self._descriptors_received = self._defer_sensor(self._descriptors_received)
+            self._metadata_heaps = self._defer_sensor(self._metadata_heaps)
+            self._active_frames_sensor = self._defer_sensor(self._active_frames_sensor)
+            self._reject_heaps = {name: self._defer_sensor(sensor)
+                                  for name, sensor in self._reject_heaps.items()}
 
-        n_streams = min(max_streams, len(use_endpoints))
-        stream_buffer_size = buffer_size // n_streams
+        heap_bytes = (XENG_RAW_DTYPE.itemsize * cbf_attr['n_chans_per_substream']
+                      * len(cbf_attr['bls_ordering']) * 2)
+        if cores is not None:
+            self.layout = plan_layout(use_endpoints, heap_bytes, buffer_size, max_streams,
+                                      cores=cores, reserved_cores=0)
+        else:
+            self.layout = plan_layout(use_endpoints, heap_bytes, buffer_size, max_streams)
+        _logger.info('Input layout: %s', self.layout.describe())
+        endpoint_groups = self.layout.endpoint_groups
+        n_streams = len(endpoint_groups)
+        stream_buffer_size = self.layout.buffer_size
+        self._stream_sensors = []    # type: List[typing.Dict[str, Sensor]]
         for i in range(n_streams):
-            first = len(use_endpoints) * i // n_streams
-            last = len(use_endpoints) * (i + 1) // n_streams
-            self._streams.append(self._make_stream(use_endpoints[first:last],
-                                                   max_packet_size, stream_buffer_size))
+            stream_sensors = {
+                name: sensors['input-stream{}-{}'.format(i, name)]
+                for name in ['pool-occupancy', 'ring-occupancy',
+                             'evicted-heaps-total', 'worker-blocked-total']
+            }
+            for sensor in stream_sensors.values():
+                sensor.value = 0
+            self._stream_sensors.append(stream_sensors)
+        self._pool_heaps = [0] * n_streams
+        self._pool_capacity = []     # type: List[int]
+        self._pool_lock = threading.Lock()
+        self._endpoints = use_endpoints
+        self._endpoint_groups = endpoint_groups
+        if zero_copy:
+            group = self._make_chunk_group(endpoint_groups, max_packet_size, stream_buffer_size)
+            self._streams.append(group)
             self._futures.append(asyncio.get_event_loop().create_task(
-                self._read_stream(self._streams[-1], i, last - first)))
-        self._running = n_streams
+                self._read_chunks(group)))
+            self._running = 1
+        else:
+            if threaded:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    n_streams, thread_name_prefix='receiver')
+            for i, stream_endpoints in enumerate(endpoint_groups):
+                self._streams.append(self._make_stream(stream_endpoints,
+                                                       max_packet_size, stream_buffer_size,
+                                                       self.layout.thread_pool(i)))
+                coro = self._read_stream(self._streams[-1], i, len(stream_endpoints))
+                if threaded:
+                    self._futures.append(self._loop.run_in_executor(
+                        self._executor, asyncio.run, coro))
+                else:
+                    self._futures.append(self._loop.create_task(coro))
+            self._running = n_streams
+
+    def _defer_sensor(self, sensor: Sensor) -> Any:
+        deferred = _DeferredSensor(sensor)
+        self._deferred_sensors.append(deferred)
+        return deferred
+
+    def _sync_sensors(self) -> None:
+        """Copy values from receive threads to the sensors."""
+        for sensor in self._deferred_sensors:
+            sensor.sync()
+
+    async def _on_loop(self, coro: Awaitable[_T]) -> _T:
+        """Await `coro` on the event loop that constructed the receiver.
+
+        In threaded mode, this is used by the receive threads to hand
+        frames to the event loop.
+        """
+        if self.threaded:
+            return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self._loop))
+        else:
+            return await coro
 
     def stop(self) -> None:
         """Stop all the individual streams."""
@@ -211,9 +716,9 @@ class Receiver:
         next_idx = self._frames[-1].idx + 1
         next_timestamp = self._frames[-1].timestamp + self.interval
         frame = self._frames.popleft()
-        if replace:
+        if replace and not self._shrink_window():
             self._frames.append(Frame(next_idx, next_timestamp, xengs))
-        actual = sum(item is not None for item in frame.items)
+        actual = frame.n_present
         self._reject_heaps['missing'].value += xengs - actual
         if actual == 0:
             _logger.debug('Frame with timestamp %d is empty, discarding', frame.timestamp)
@@ -223,12 +728,113 @@ class Receiver:
                           frame.timestamp, actual, xengs)
         return frame
 
+    def _set_active_frames(self, active_frames: int) -> None:
+        self.active_frames = active_frames
+        self._active_frames_sensor.value = active_frames
+
+    def _observe_lateness(self, timestamp: int) -> None:
+        """Update the lateness histogram for a data heap and grow the window if needed.
+
+        The window is only ever extended at the new end, so :attr:`_frames`
+        keeps the same first frame.
+        """
+        assert self._lateness is not None and self.max_active_frames is not None
+        if self._newest_timestamp is None or timestamp > self._newest_timestamp:
+            self._newest_timestamp = timestamp
+        late = (self._newest_timestamp - timestamp) // self.interval
+        late = min(late, self.max_active_frames)
+        self._lateness[late] += 1
+        if late >= self.active_frames and self.active_frames < self.max_active_frames:
+            active_frames = min(late + 1, self.max_active_frames)
+            _logger.info('Heap arrived %d frames late, growing window from %d to %d frames',
+                         late, self.active_frames, active_frames)
+            last = self._frames[-1]
+            xengs = len(last.items)
+            for i in range(1, active_frames - self.active_frames + 1):
+                self._frames.append(
+                    Frame(last.idx + i, last.timestamp + i * self.interval, xengs))
+            self._set_active_frames(active_frames)
+
+    def _shrink_window(self) -> bool:
+        """Decide whether to shrink the window after a frame is retired.
+
+        Every :data:`_ADAPT_FRAMES` frames, the window shrinks by one frame if
+        no heap since the previous decision needed the full depth.
+
+        Returns
+        -------
+        shrink
+            If true, the frame that was just retired should not be replaced
+        """
+        if self._lateness is None:
+            return False
+        self._adapt_countdown -= 1
+        if self._adapt_countdown > 0:
+            return False
+        self._adapt_countdown = _ADAPT_FRAMES
+        needed = int(np.flatnonzero(self._lateness)[-1]) + 1 if self._lateness.any() else 1
+        self._lateness[:] = 0
+        if needed < self.active_frames and self.active_frames > self._min_active_frames:
+            _logger.debug('Shrinking window from %d to %d frames',
+                          self.active_frames, self.active_frames - 1)
+            self._set_active_frames(self.active_frames - 1)
+            return True
+        return False
+
+    def _release_heap(self, stream_idx: int) -> None:
+        """Account for a heap's memory being returned to its memory pool.
+
+        This is a finalizer, so it may be called from any thread.
+        """
+        with self._pool_lock:
+            self._pool_heaps[stream_idx] -= 1
+
+    def _update_stream_sensors(self) -> None:
+        """Update the per-stream sensors that show how close the receive path is to
+        running out of buffers.
+
+        In zero-copy mode the chunks and the data ring buffer are shared by
+        all the streams, so every stream reports the same occupancy.
+        """
+        if self.zero_copy:
+            group = self._streams[0]
+            free = group.free_ringbuffer
+            data = group.data_ringbuffer
+            pool_occupancy = [1.0 - free.qsize() / free.maxsize] * len(self._stream_sensors)
+            ring_occupancy = [data.qsize() / data.maxsize] * len(self._stream_sensors)
+            stats = [member.stats for member in group]
+        else:
+            pool_occupancy = [heaps / capacity
+                              for heaps, capacity in zip(self._pool_heaps, self._pool_capacity)]
+            ring_occupancy = [stream.ringbuffer.size() / stream.ringbuffer.capacity()
+                              for stream in self._streams]
+            stats = [stream.stats for stream in self._streams]
+        for i, stream_sensors in enumerate(self._stream_sensors):
+            stream_sensors['pool-occupancy'].value = pool_occupancy[i]
+            stream_sensors['ring-occupancy'].value = ring_occupancy[i]
+            stream_sensors['evicted-heaps-total'].value = stats[i]['incomplete_heaps_evicted']
+            stream_sensors['worker-blocked-total'].value = stats[i]['worker_blocked']
+
     async def _put_frame(self, frame: Frame) -> None:
-        """Put a frame onto :attr:`_frames_complete` and update the sensor."""
+        """Put a frame onto :attr:`_frames_complete` and update the sensors."""
+        self._sync_sensors()
+        self._update_stream_sensors()
         self._input_dumps.value += 1
+        if self._frames_complete.full():
+            self._overflow_sensors[self.overflow].value += 1
+            if self.overflow == 'drop-newest':
+                _logger.warning('Frame queue is full, dropping frame %d', frame.idx)
+                return
+            elif self.overflow == 'drop-oldest':
+                dropped = self._frames_complete.drop_oldest()
+                if dropped is not None:
+                    _logger.warning('Frame queue is full, dropping frame %d', dropped.idx)
+                del dropped
         await self._frames_complete.put(frame)
+        self._frames_queued.value = self._frames_complete.qsize()
 
-    def _add_readers(self, stream: spead2.recv.asyncio.Stream,
+    def _add_readers(self, stream: Union[spead2.recv.asyncio.Stream,
+                                         spead2.recv.ChunkStreamGroupMember],
                      endpoints: Sequence[Endpoint],
                      max_packet_size: int, buffer_size: int) -> None:
         """Subscribe a stream to a list of endpoints."""
@@ -259,7 +865,8 @@ class Receiver:
             ' with ibv' if self._ibv else '')
 
     def _make_stream(self, endpoints: Sequence[Endpoint],
-                     max_packet_size: int, buffer_size: int) -> spead2.recv.asyncio.Stream:
+                     max_packet_size: int, buffer_size: int,
+                     thread_pool: spead2.ThreadPool) -> spead2.recv.asyncio.Stream:
         """Prepare a stream, which may combine multiple endpoints."""
         # Figure out how many heaps will have the same timestamp, and set
         # up the stream.
@@ -281,14 +888,19 @@ class Receiver:
         # - per X-engine:
         #   - heap that has just been popped from the ringbuffer (1)
         #   - active frames
-        #   - complete frames queue (1)
+        #   - complete frames queue
         #   - frame being processed by ingest_session (which could be several, depending on
         #     latency of the pipeline, but assume 4 to be on the safe side)
-        memory_pool_heaps = ring_heaps + max_heaps + stream_xengs * (self.active_frames + 6)
+        # An adaptive window only preallocates for its minimum size.
+        max_frames = self.max_active_frames or self.active_frames
+        extra_frames = self.queue_frames + 5
+        memory_pool_heaps = ring_heaps + max_heaps + stream_xengs * (max_frames + extra_frames)
+        initial_heaps = ring_heaps + max_heaps + stream_xengs * (self.active_frames + extra_frames)
         memory_pool = spead2.MemoryPool(16384, heap_data_size + 512,
-                                        memory_pool_heaps, memory_pool_heaps)
+                                        memory_pool_heaps, initial_heaps)
+        self._pool_capacity.append(memory_pool_heaps)
         stream = spead2.recv.asyncio.Stream(
-            spead2.ThreadPool(),
+            thread_pool,
             spead2.recv.StreamConfig(
                 max_heaps=max_heaps,
                 memory_allocator=memory_pool,
@@ -303,6 +915,126 @@ class Receiver:
         self._add_readers(stream, endpoints, max_packet_size, buffer_size)
         return stream
 
+    def _make_chunk_group(self, endpoint_groups: Sequence[Sequence[Endpoint]],
+                          max_packet_size: int,
+                          buffer_size: int) -> spead2.recv.ChunkStreamRingGroup:
+        """Prepare a group of chunking streams for zero-copy reception.
+
+        Each chunk holds the data for one frame. There is one stream per
+        element of `endpoint_groups`, each with its own thread pool (sharing
+        a thread pool can deadlock a lossy group), created by :attr:`layout`.
+        """
+        heap_channels = self.cbf_attr['n_chans_per_substream']
+        baselines = len(self.cbf_attr['bls_ordering'])
+        xengs = len(self.channel_range) // heap_channels
+        heap_bytes = XENG_RAW_DTYPE.itemsize * heap_channels * baselines * 2
+        # We need chunks for:
+        # - the active frames
+        # - the data ringbuffer (2)
+        # - the frame being handled by _read_chunks (1)
+        # - the complete frames queue
+        # - frames being processed by ingest_session (assume 4, as for _make_stream)
+        n_chunks = self.active_frames + self.queue_frames + 7
+        group = spead2.recv.ChunkStreamRingGroup(
+            spead2.recv.ChunkStreamGroupConfig(
+                max_chunks=self.active_frames,
+                eviction_mode=spead2.recv.ChunkStreamGroupConfig.EvictionMode.LOSSY
+            ),
+            spead2.recv.asyncio.ChunkRingbuffer(2),
+            spead2.recv.ChunkRingbuffer(n_chunks)
+        )
+        self._place_params = np.zeros(_PLACE_PARAMS, np.int64)
+        self._place_params[_PLACE_INTERVAL] = self.interval
+        self._place_params[_PLACE_CHANNEL0] = self.channel_range.start
+        self._place_params[_PLACE_CHANNELS] = len(self.channel_range)
+        self._place_params[_PLACE_HEAP_CHANNELS] = heap_channels
+        self._place_params[_PLACE_HEAP_BYTES] = heap_bytes
+        place = scipy.LowLevelCallable(
+            _chunk_place_callback().ctypes,
+            user_data=self._place_params.ctypes.data_as(ctypes.c_void_p),
+            signature='void (void *, size_t, void *)')
+        for i, endpoints in enumerate(endpoint_groups):
+            stream_xengs = len(endpoints) * self._endpoint_channels // heap_channels
+            stream_config = spead2.recv.StreamConfig(
+                max_heaps=2 * stream_xengs + len(endpoints),
+                memcpy=spead2.MEMCPY_NONTEMPORAL
+            )
+            for index, name in [(_PLACE_STAT_METADATA, 'katsdpingest_metadata'),
+                                (_PLACE_STAT_BAD_CHANNEL, 'katsdpingest_bad_channel'),
+                                (_PLACE_STAT_BAD_HEAP, 'katsdpingest_bad_heap')]:
+                self._place_params[index] = stream_config.add_stat(name)
+            chunk_config = spead2.recv.ChunkStreamConfig(
+                items=[TIMESTAMP_ID, FREQUENCY_ID, spead2.HEAP_LENGTH_ID],
+                max_chunks=self.active_frames,
+                max_heap_extra=8,
+                place=place
+            )
+            member = group.emplace_back(self.layout.thread_pool(i), stream_config, chunk_config)
+            self._add_readers(member, endpoints, max_packet_size, buffer_size)
+        for i in range(n_chunks):
+            group.add_free_chunk(spead2.recv.Chunk(
+                present=np.zeros(xengs, np.uint8),
+                data=np.empty(xengs * heap_bytes, np.uint8),
+                extra=np.zeros(xengs * 8, np.uint8)))
+        return group
+
+    def _update_heap_layout(self, heap_address_bits: int) -> None:
+        """Update :attr:`_heap_layout` after descriptors have been received.
+
+        The fast path is only used if the timestamp and frequency are
+        immediate items and `xeng_raw` has a fixed shape and dtype, as is
+        the case for the MeerKAT CBF.
+        """
+        self._heap_layout = None
+        try:
+            timestamp = self._ig_cbf['timestamp']
+            frequency = self._ig_cbf['frequency']
+            xeng_raw = self._ig_cbf['xeng_raw']
+        except KeyError:
+            return
+        immediate_format = [('u', heap_address_bits)]
+        if (timestamp.format != immediate_format or frequency.format != immediate_format
+                or xeng_raw.dtype is None or xeng_raw.order != 'C'
+                or any(dim is None for dim in xeng_raw.shape)):
+            _logger.info('CBF items are not suitable for fast decoding')
+            return
+        shape = tuple(xeng_raw.shape)
+        self._heap_layout = _HeapLayout(
+            timestamp.id, frequency.id, xeng_raw.id, xeng_raw.dtype, shape,
+            int(np.prod(shape)) * xeng_raw.dtype.itemsize)
+
+    def _decode_heap(self, heap: spead2.recv.Heap) -> Optional[Tuple[Any, Any, Any]]:
+        """Extract the timestamp, first channel and visibilities from a heap
+        without going through :meth:`spead2.ItemGroup.update`.
+
+        Values for items that are not present are ``None``. This returns
+        ``None`` (with no side effects) if the heap cannot be handled by the
+        fast path, in which case the caller should fall back to the item
+        group.
+        """
+        layout = self._heap_layout
+        if layout is None:
+            return None
+        timestamp = channel0 = data = None
+        for raw in heap.get_items():
+            item_id = raw.id
+            if item_id == layout.timestamp_id:
+                if not raw.is_immediate:
+                    return None
+                timestamp = raw.immediate_value
+            elif item_id == layout.frequency_id:
+                if not raw.is_immediate:
+                    return None
+                channel0 = raw.immediate_value
+            elif item_id == layout.xeng_raw_id:
+                if raw.is_immediate:
+                    return None
+                buf = memoryview(raw)
+                if buf.nbytes != layout.nbytes:
+                    return None
+                data = np.frombuffer(buf, layout.dtype).reshape(layout.shape)
+        return timestamp, channel0, data
+
     async def _first_timestamp(self, candidate: int) -> int:
         """Get raw ADC timestamp of the first frame across all ingests.
 
@@ -379,25 +1111,35 @@ class Receiver:
                     _logger.debug('Received non-descriptor heap before descriptors')
                     return 'no-descriptor'
                 else:
-                    try:
-                        # We suppress the conversion to little endian. The data
-                        # gets copied later anyway and numpy will do the endian
-                        # swapping then without an extraneous copy.
-                        updated = self._ig_cbf.update(heap, new_order='|')
-                    except ValueError:
-                        _logger.warning('Exception updating item group from heap', exc_info=True)
-                        return 'bad-heap'
-                    # The _ig_cbf is shared between streams, so we need to use the values
-                    # before next yielding.
-                    if 'timestamp' in updated:
-                        data_ts = updated['timestamp'].value
-                    if 'xeng_raw' in updated:
-                        data_item = updated['xeng_raw'].value
-                    if 'frequency' in updated:
-                        channel0 = updated['frequency'].value
-                    if not self._descriptors_received.value and 'xeng_raw' in self._ig_cbf:
-                        # This heap added the descriptors
-                        self._descriptors_received.value = True
+                    # Fast path for plain data heaps
+                    decoded = None
+                    if not heap.get_descriptors():
+                        decoded = self._decode_heap(heap)
+                    if decoded is not None:
+                        data_ts, channel0, data_item = decoded
+                    else:
+                        try:
+                            # We suppress the conversion to little endian. The data
+                            # gets copied later anyway and numpy will do the endian
+                            # swapping then without an extraneous copy.
+                            updated = self._ig_cbf.update(heap, new_order='|')
+                        except ValueError:
+                            _logger.warning('Exception updating item group from heap',
+                                            exc_info=True)
+                            return 'bad-heap'
+                        # The _ig_cbf is shared between streams, so we need to use the values
+                        # before next yielding.
+                        if 'timestamp' in updated:
+                            data_ts = updated['timestamp'].value
+                        if 'xeng_raw' in updated:
+                            data_item = updated['xeng_raw'].value
+                        if 'frequency' in updated:
+                            channel0 = updated['frequency'].value
+                        if not self._descriptors_received.value and 'xeng_raw' in self._ig_cbf:
+                            # This heap added the descriptors
+                            self._descriptors_received.value = True
+                        if heap.get_descriptors():
+                            self._update_heap_layout(heap.flavour.heap_address_bits)
 
                 if data_ts is None:
                     _logger.debug("Heap without timestamp received on stream %d", stream_idx)
@@ -425,11 +1167,13 @@ class Receiver:
                               data_ts, stream_idx, channel0)
                 prev_ts = data_ts
                 if not self._frames:
-                    self.timestamp_base = await self._first_timestamp(data_ts)
+                    self.timestamp_base = await self._on_loop(self._first_timestamp(data_ts))
                     for i in range(self.active_frames):
                         self._frames.append(
                             Frame(i, self.timestamp_base + self.interval * i, xengs))
                 ts0 = self._frames[0].timestamp
+                if self._lateness is not None and (data_ts - ts0) % self.interval == 0:
+                    self._observe_lateness(data_ts)
                 if data_ts < ts0:
                     _logger.debug('Timestamp %d is too far in the past, discarding '
                                   '(channel %s)', data_ts, channel0)
@@ -442,7 +1186,7 @@ class Receiver:
                 while data_ts >= ts0 + self.interval * self.active_frames:
                     frame = self._pop_frame()
                     if frame:
-                        await self._put_frame(frame)
+                        await self._on_loop(self._put_frame(frame))
                     del frame   # Free it up, particularly if discarded
                     ts0 = self._frames[0].timestamp
 
@@ -464,13 +1208,21 @@ class Receiver:
                     return 'bad-channel'
                 xeng_idx = (channel0 - self.channel_range.start) // heap_channels
                 frame_idx = (data_ts - ts0) // self.interval
-                self._frames[frame_idx].items[xeng_idx] = data_item
+                self._frames[frame_idx].add_item(xeng_idx, data_item)
+                with self._pool_lock:
+                    self._pool_heaps[stream_idx] += 1
+                weakref.finalize(data_item, self._release_heap, stream_idx)
                 self._input_bytes.value += data_item.nbytes
                 self._input_heaps.value += 1
                 return heap_type
 
             async for heap in stream:
-                heap_type = await process_heap(heap)
+                recorder = self.recorder
+                if recorder is not None and not isinstance(heap, spead2.recv.IncompleteHeap) \
+                        and not heap.is_end_of_stream():
+                    recorder.record(heap, stream_idx)
+                with self._assembly_lock:
+                    heap_type = await process_heap(heap)
                 if heap_type == 'stop':
                     if n_stop == n_endpoints:
                         stream.stop()
@@ -486,7 +1238,92 @@ class Receiver:
                 else:
                     assert heap_type is None
         finally:
-            await self._frames_complete.put(stream_idx)
+            await self._on_loop(self._frames_complete.put(stream_idx))
+
+    def _update_chunk_sensors(self, group: spead2.recv.ChunkStreamRingGroup,
+                              too_old: int) -> None:
+        """Update sensors from the statistics of the streams in `group`.
+
+        Parameters
+        ----------
+        group
+            Group of streams
+        too_old
+            Number of heaps discarded by :meth:`_read_chunks` for being older
+            than the first frame.
+        """
+        totals = {}   # type: typing.Dict[str, int]
+        for member in group:
+            stats = member.stats
+            for name in ['incomplete_heaps_evicted', 'incomplete_heaps_flushed',
+                         'too_old_heaps', 'katsdpingest_metadata',
+                         'katsdpingest_bad_channel', 'katsdpingest_bad_heap']:
+                totals[name] = totals.get(name, 0) + stats[name]
+        self._reject_heaps['incomplete'].value = \
+            totals['incomplete_heaps_evicted'] + totals['incomplete_heaps_flushed']
+        self._reject_heaps['too-old'].value = totals['too_old_heaps'] + too_old
+        self._reject_heaps['bad-channel'].value = totals['katsdpingest_bad_channel']
+        self._reject_heaps['bad-heap'].value = totals['katsdpingest_bad_heap']
+        self._metadata_heaps.value = totals['katsdpingest_metadata']
+
+    async def _read_chunks(self, group: spead2.recv.ChunkStreamRingGroup) -> None:
+        """Co-routine that turns chunks from a zero-copy stream group into frames
+        and populates :attr:`_frames_complete`."""
+        try:
+            heap_channels = self.cbf_attr['n_chans_per_substream']
+            baselines = len(self.cbf_attr['bls_ordering'])
+            xengs = len(self.channel_range) // heap_channels
+            heap_bytes = XENG_RAW_DTYPE.itemsize * heap_channels * baselines * 2
+            too_old = 0
+            async for chunk in group.data_ringbuffer:
+                present = chunk.present.astype(np.bool_)
+                heap_timestamps = chunk.extra.view(np.int64)
+                if self.timestamp_base is None:
+                    if not np.any(present):
+                        # Window was created before the first heap arrived
+                        _recycle_chunk(group, chunk)
+                        continue
+                    candidate = int(heap_timestamps[present][0])
+                    self.timestamp_base = await self._first_timestamp(candidate)
+                phase = self.timestamp_base % self.interval
+                timestamp = chunk.chunk_id * self.interval + phase
+                valid = present & (heap_timestamps == timestamp)
+                self._reject_heaps['bad-timestamp'].value += int(np.sum(present & ~valid))
+                n_valid = int(np.sum(valid))
+                if timestamp < self.timestamp_base:
+                    _logger.debug('Timestamp %d is too far in the past, discarding', timestamp)
+                    too_old += n_valid
+                    n_valid = 0
+                self._update_chunk_sensors(group, too_old)
+                if n_valid == 0:
+                    _logger.debug('Frame with timestamp %d is empty, discarding', timestamp)
+                    if timestamp >= self.timestamp_base:
+                        self._reject_heaps['missing'].value += xengs
+                    _recycle_chunk(group, chunk)
+                    continue
+                _logger.debug('Frame with timestamp %d is %d/%d complete',
+                              timestamp, n_valid, xengs)
+                # The frame holds a view of the chunk's memory. The chunk is
+                # returned to the free ring once nothing refers to it any more.
+                raw = np.frombuffer(memoryview(chunk.data), XENG_RAW_DTYPE)
+                weakref.finalize(raw, _recycle_chunk, group, chunk)
+                frame = Frame((timestamp - self.timestamp_base) // self.interval,
+                              timestamp, xengs)
+                frame.data = raw.reshape(len(self.channel_range), baselines, 2)
+                del raw
+                for i in range(xengs):
+                    item = frame.data[i * heap_channels : (i + 1) * heap_channels]
+                    if valid[i]:
+                        frame.add_item(i, item)
+                    else:
+                        item.fill(0)    # Chunks are recycled, so may have stale data
+                self._reject_heaps['missing'].value += xengs - n_valid
+                self._input_bytes.value += n_valid * heap_bytes
+                self._input_heaps.value += n_valid
+                await self._put_frame(frame)
+                del frame
+        finally:
+            await self._frames_complete.put(0)
 
     async def get(self) -> Frame:
         """Return the next frame.
@@ -500,6 +1337,7 @@ class Receiver:
         """
         while self._running > 0:
             frame = await self._frames_complete.get()
+            self._frames_queued.value = self._frames_complete.qsize()
             if isinstance(frame, int):
                 # It's actually the index of a finished stream
                 self._streams[frame].stop()   # In case the co-routine exited with an exception
@@ -514,5 +1352,9 @@ class Receiver:
         while self._frames:
             tail_frame = self._pop_frame(replace=False)
             if tail_frame:
+                self._sync_sensors()
+                self._update_stream_sensors()
                 return tail_frame
+        self._sync_sensors()
+        self._update_stream_sensors()
         raise spead2.Stopped('End of streams')
@@ -0,0 +1,593 @@
+"""Replay recorded CBF SPEAD traffic from capture files.
+
+:class:`ReplayReceiver` is a drop-in replacement for
+:class:`katsdpingest.receiver.Receiver` which, instead of subscribing to
+the network, reads packets from capture files and feeds them to the same
+spead2 streams (via in-process queues), so that frames are assembled by
+exactly the same code. This makes it possible to reprocess problematic
+observations and to profile ingest deterministically on a workstation.
+
+Two capture formats are supported, and are distinguished by their magic
+number:
+
+pcap
+    Standard (non-ng) pcap files with Ethernet, Linux cooked or raw IP
+    link types. Only unfragmented UDP over IPv4 is used.
+native
+    A compact format written by :class:`CaptureWriter`. It consists of a
+    file header followed by one record per packet. Each record has a
+    header holding the arrival time, destination address and length,
+    followed by the packet, padded to a multiple of 8 bytes.
+
+Files are memory-mapped rather than read, and packets are passed to spead2
+as views of the mapping.
+
+:class:`HeapRecorder` taps a live :class:`~katsdpingest.receiver.Receiver`
+to produce native capture files. It encodes each heap as a single packet,
+and also writes an index (see :func:`read_index`) giving the offset,
+timestamp and channel of each heap.
+"""
+
+import heapq
+import logging
+import mmap
+import queue
+import socket
+import struct
+import threading
+import time
+from typing import (     # noqa: F401
+    Any, BinaryIO, Dict, Iterator, List, Optional, Sequence, Tuple, Union)
+
+import numpy as np
+import spead2
+import spead2.recv
+import spead2.recv.asyncio
+import spead2.send
+from katsdptelstate.endpoint import Endpoint, endpoints_to_str
+
+from .receiver import Receiver, TIMESTAMP_ID, FREQUENCY_ID
+
+
+_logger = logging.getLogger(__name__)
+
+#: Magic number at the start of native capture files
+CAPTURE_MAGIC = b'KSDPCAPT'
+#: Version of the native capture file format
+CAPTURE_VERSION = 1
+_FILE_HEADER = struct.Struct('<8sI4x')
+# Arrival time, IPv4 address, UDP port, packet length
+_RECORD_HEADER = struct.Struct('<d4sH2xI4x')
+_ALIGN = 8
+#: Type of the entries in a capture index. Timestamps and channels are -1
+#: for heaps without them.
+INDEX_DTYPE = np.dtype([('offset', '<u8'), ('time', '<f8'),
+                        ('timestamp', '<i8'), ('channel', '<i8')])
+
+_PCAP_MAGIC = {
+    b'\xd4\xc3\xb2\xa1': ('<', 1e-6),
+    b'\xa1\xb2\xc3\xd4': ('>', 1e-6),
+    b'\x4d\x3c\xb2\xa1': ('<', 1e-9),
+    b'\xa1\xb2\x3c\x4d': ('>', 1e-9)
+}
+_LINKTYPE_ETHERNET = 1
+_LINKTYPE_RAW = 101
+_LINKTYPE_LINUX_SLL = 113
+_ETHERTYPE_IPV4 = 0x0800
+_ETHERTYPE_VLAN = 0x8100
+_IPPROTO_UDP = 17
+
+#: A packet read from a capture: arrival time, destination and payload
+Packet = Tuple[float, Endpoint, memoryview]
+
+
+def _padded(size: int) -> int:
+    return (size + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def split_packets(data: Union[bytes, memoryview]) -> Iterator[memoryview]:
+    """Split a concatenation of SPEAD packets into the individual packets.
+
+    This is useful with :class:`spead2.send.BytesStream`, which produces
+    such concatenations.
+
+    Raises
+    ------
+    ValueError
+        if `data` is not a sequence of complete SPEAD packets
+    """
+    data = memoryview(data).cast('B')
+    pos = 0
+    while pos < len(data):
+        if len(data) - pos < 8 or data[pos] != 0x53 or data[pos + 1] != 4:
+            raise ValueError('Invalid SPEAD header at offset {}'.format(pos))
+        heap_address_bits = data[pos + 3] * 8
+        pointer_bits = (data[pos + 2] + data[pos + 3]) * 8
+        n_items = struct.unpack_from('>H', data, pos + 6)[0]
+        payload_length = None
+        for i in range(n_items):
+            pointer = struct.unpack_from('>Q', data, pos + 8 + 8 * i)[0]
+            pointer >>= 64 - pointer_bits
+            item_id = (pointer >> heap_address_bits) \
+                & ((1 << (pointer_bits - heap_address_bits - 1)) - 1)
+            if item_id == spead2.PAYLOAD_LENGTH_ID:
+                payload_length = pointer & ((1 << heap_address_bits) - 1)
+        if payload_length is None:
+            raise ValueError('SPEAD packet at offset {} has no payload length'.format(pos))
+        size = 8 + 8 * n_items + payload_length
+        if pos + size > len(data):
+            raise ValueError('Truncated SPEAD packet at offset {}'.format(pos))
+        yield data[pos : pos + size]
+        pos += size
+
+
+class CaptureWriter:
+    """Write packets to a native capture file.
+
+    It can be used as a context manager, which closes the file on exit.
+
+    Parameters
+    ----------
+    file
+        Filename, or binary file object open for writing
+    """
+    def __init__(self, file: Union[str, BinaryIO]) -> None:
+        if isinstance(file, str):
+            self._file = open(file, 'wb')   # type: BinaryIO
+            self._owner = True
+        else:
+            self._file = file
+            self._owner = False
+        self._file.write(_FILE_HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION))
+        #: Number of bytes written so far
+        self.offset = _FILE_HEADER.size
+
+    def write(self, packet: Union[bytes, memoryview, Sequence[Union[bytes, memoryview]]],
+              endpoint: Endpoint, timestamp: Optional[float] = None) -> int:
+        """Append a packet to the file.
+
+        Parameters
+        ----------
+        packet
+            Raw SPEAD packet (UDP payload), or a list of pieces to concatenate
+        endpoint
+            Destination of the packet, which must have an IPv4 address
+        timestamp
+            UNIX time at which the packet arrived (defaults to now)
+
+        Returns
+        -------
+        offset
+            Position of the record in the file
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        parts = [packet] if isinstance(packet, (bytes, memoryview)) else packet
+        parts = [memoryview(part).cast('B') for part in parts]
+        size = sum(len(part) for part in parts)
+        offset = self.offset
+        self._file.write(_RECORD_HEADER.pack(
+            timestamp, socket.inet_aton(endpoint.host or '0.0.0.0'), endpoint.port, size))
+        for part in parts:
+            self._file.write(part)
+        self._file.write(bytes(_padded(size) - size))
+        self.offset += _RECORD_HEADER.size + _padded(size)
+        return offset
+
+    def close(self) -> None:
+        if self._owner:
+            self._file.close()
+        else:
+            self._file.flush()
+
+    def __enter__(self) -> 'CaptureWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+def index_filename(filename: str) -> str:
+    """Name of the index file that accompanies a recorded capture file."""
+    return filename + '.idx'
+
+
+def read_index(filename: str) -> np.ndarray:
+    """Load the index of a capture file written by :class:`HeapRecorder`.
+
+    The index is memory-mapped and has dtype :const:`INDEX_DTYPE`.
+
+    Parameters
+    ----------
+    filename
+        Name of the capture file (not the index file)
+    """
+    try:
+        return np.memmap(index_filename(filename), dtype=INDEX_DTYPE, mode='r')
+    except ValueError:
+        # np.memmap refuses to map empty files
+        return np.zeros(0, INDEX_DTYPE)
+
+
+class _RawItem:
+    """Adapts a raw received item for :meth:`spead2.send.Heap.add_item`."""
+    def __init__(self, item: Any, address_bytes: int) -> None:
+        self.id = item.id
+        self._immediate = item.is_immediate
+        if item.is_immediate:
+            self._buffer = item.immediate_value.to_bytes(address_bytes, 'big')
+        else:
+            self._buffer = memoryview(item)
+
+    def to_buffer(self) -> Union[bytes, memoryview]:
+        return self._buffer
+
+    def allow_immediate(self) -> bool:
+        return self._immediate
+
+
+def encode_heap(heap: spead2.recv.Heap) -> List[List[Union[bytes, memoryview]]]:
+    """Encode a received heap as SPEAD packets.
+
+    Heaps without descriptors (which includes all CBF data heaps) are encoded
+    as a single packet, which is returned as a list of pieces that refer to
+    the memory of the heap rather than copying it. Heaps with descriptors are
+    re-encoded by spead2, and may span several packets.
+
+    Returns
+    -------
+    packets
+        Packets, each as a list of pieces to concatenate
+    """
+    address_bits = heap.flavour.heap_address_bits
+    descriptors = heap.get_descriptors()
+    if descriptors:
+        send_heap = spead2.send.Heap(heap.flavour)
+        for descriptor in descriptors:
+            send_heap.add_descriptor(spead2.Descriptor.from_raw(descriptor, heap.flavour))
+        for item in heap.get_items():
+            send_heap.add_item(_RawItem(item, address_bits // 8))
+        stream = spead2.send.BytesStream(
+            spead2.ThreadPool(), spead2.send.StreamConfig(max_packet_size=9000))
+        stream.send_heap(send_heap, heap.cnt)
+        return [[packet] for packet in split_packets(stream.getvalue())]
+
+    pointers = []
+    payload = []     # type: List[Union[bytes, memoryview]]
+    size = 0
+    for item in heap.get_items():
+        if item.is_immediate:
+            pointers.append((1 << 63) | (item.id << address_bits) | item.immediate_value)
+        else:
+            buf = memoryview(item).cast('B')
+            pointers.append((item.id << address_bits) | size)
+            payload.append(buf)
+            size += len(buf)
+    header = [(spead2.HEAP_CNT_ID, heap.cnt), (spead2.HEAP_LENGTH_ID, size),
+              (spead2.PAYLOAD_OFFSET_ID, 0), (spead2.PAYLOAD_LENGTH_ID, size)]
+    pointers[:0] = [(1 << 63) | (item_id << address_bits) | value for item_id, value in header]
+    packet_header = struct.pack('>BBBBHH{}Q'.format(len(pointers)),
+                                0x53, 4, (64 - address_bits) // 8, address_bits // 8, 0,
+                                len(pointers), *pointers)
+    return [[packet_header] + payload]
+
+
+class HeapRecorder:
+    """Record heaps received by a :class:`~katsdpingest.receiver.Receiver`.
+
+    The heaps are written to a native capture file (which can be replayed
+    with :class:`ReplayReceiver`), together with an index (see
+    :func:`read_index`). To keep the cost to the receiver low, heaps are
+    written by a separate thread. If the thread falls too far behind, heaps
+    are dropped from the recording rather than stalling reception.
+
+    Recording stops once `max_bytes` have been written, but the recorder
+    must still be closed with :meth:`close`.
+
+    Parameters
+    ----------
+    rx
+        Receiver whose heaps will be recorded. The recorder is not attached
+        to it; that is left to the caller (by setting its ``recorder``
+        attribute).
+    filename
+        Name of the capture file to write
+    max_bytes
+        Maximum size of the capture file
+    max_queue
+        Maximum number of heaps waiting to be written
+
+    Raises
+    ------
+    ValueError
+        if `rx` is using zero-copy mode, which does not produce heaps
+
+    Attributes
+    ----------
+    heaps : int
+        Number of heaps written
+    dropped : int
+        Number of heaps that could not be recorded because the writer thread
+        fell behind
+    """
+    def __init__(self, rx: Receiver, filename: str,
+                 max_bytes: int = 2**30, max_queue: int = 256) -> None:
+        if rx.zero_copy:
+            raise ValueError('Heaps cannot be recorded in zero-copy mode')
+        self.filename = filename
+        self.heaps = 0
+        self.dropped = 0
+        self._endpoints = rx._endpoints
+        self._endpoint_groups = rx._endpoint_groups
+        self._channel0 = rx.channel_range.start
+        self._endpoint_channels = rx._endpoint_channels
+        self._max_bytes = max_bytes
+        self._full = False
+        self._closed = False
+        self._writer = CaptureWriter(filename)
+        self._index = open(index_filename(filename), 'wb')
+        self._queue = queue.Queue(max_queue)    # type: queue.Queue
+        self._thread = threading.Thread(target=self._run, name='recorder', daemon=True)
+        self._thread.start()
+
+    def record(self, heap: spead2.recv.Heap, stream_idx: int) -> None:
+        """Queue a heap for writing.
+
+        Parameters
+        ----------
+        heap
+            Complete heap to record
+        stream_idx
+            Index of the receiver stream that received the heap
+        """
+        if self._full or self._closed:
+            return
+        try:
+            self._queue.put_nowait((time.time(), heap, stream_idx))
+        except queue.Full:
+            self.dropped += 1
+
+    def _endpoint(self, channel: int, stream_idx: int) -> Endpoint:
+        idx = (channel - self._channel0) // self._endpoint_channels
+        if channel >= 0 and 0 <= idx < len(self._endpoints):
+            return self._endpoints[idx]
+        else:
+            return self._endpoint_groups[stream_idx][0]
+
+    def _run(self) -> None:
+        index = np.zeros(1, INDEX_DTYPE)
+        try:
+            while True:
+                entry = self._queue.get()
+                if entry is None:
+                    break
+                if self._full:
+                    continue
+                arrival, heap, stream_idx = entry
+                timestamp = channel = -1
+                for item in heap.get_items():
+                    if item.is_immediate and item.id == TIMESTAMP_ID:
+                        timestamp = item.immediate_value
+                    elif item.is_immediate and item.id == FREQUENCY_ID:
+                        channel = item.immediate_value
+                packets = encode_heap(heap)
+                size = sum(_RECORD_HEADER.size + _padded(sum(len(part) for part in packet))
+                           for packet in packets)
+                if self._writer.offset + size > self._max_bytes:
+                    _logger.info('Recording to %s reached its size limit', self.filename)
+                    self._full = True
+                    continue
+                endpoint = self._endpoint(channel, stream_idx)
+                index['offset'] = self._writer.offset
+                for packet in packets:
+                    self._writer.write(packet, endpoint, arrival)
+                index['time'] = arrival
+                index['timestamp'] = timestamp
+                index['channel'] = channel
+                self._index.write(index.tobytes())
+                self.heaps += 1
+        except Exception:
+            _logger.exception('Recording to %s failed', self.filename)
+            self._full = True
+        finally:
+            self._writer.close()
+            self._index.close()
+
+    def close(self) -> None:
+        """Finish writing queued heaps and close the files.
+
+        This blocks until the writer thread has finished.
+        """
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join()
+
+
+def _read_native(data: memoryview) -> Iterator[Packet]:
+    magic, version = _FILE_HEADER.unpack_from(data)
+    if version != CAPTURE_VERSION:
+        raise ValueError('Unsupported capture version {}'.format(version))
+    pos = _FILE_HEADER.size
+    while pos + _RECORD_HEADER.size <= len(data):
+        timestamp, addr, port, size = _RECORD_HEADER.unpack_from(data, pos)
+        pos += _RECORD_HEADER.size
+        if pos + size > len(data):
+            _logger.warning('Capture file is truncated')
+            break
+        yield timestamp, Endpoint(socket.inet_ntoa(addr), port), data[pos : pos + size]
+        pos += _padded(size)
+
+
+def _read_pcap(data: memoryview) -> Iterator[Packet]:
+    order, time_scale = _PCAP_MAGIC[bytes(data[:4])]
+    linktype = struct.unpack_from(order + 'I', data, 20)[0] & 0xfffffff
+    if linktype not in {_LINKTYPE_ETHERNET, _LINKTYPE_RAW, _LINKTYPE_LINUX_SLL}:
+        raise ValueError('Unsupported pcap link type {}'.format(linktype))
+    record_header = struct.Struct(order + 'IIII')
+    pos = 24
+    while pos + record_header.size <= len(data):
+        sec, frac, caplen, origlen = record_header.unpack_from(data, pos)
+        pos += record_header.size
+        frame = data[pos : pos + caplen]
+        pos += caplen
+        if caplen != origlen or len(frame) != caplen:
+            continue     # Truncated
+        if linktype == _LINKTYPE_ETHERNET:
+            offset = 12
+            ethertype = struct.unpack_from('>H', frame, offset)[0]
+            while ethertype == _ETHERTYPE_VLAN:
+                offset += 4
+                ethertype = struct.unpack_from('>H', frame, offset)[0]
+            offset += 2
+        elif linktype == _LINKTYPE_LINUX_SLL:
+            offset = 16
+            ethertype = struct.unpack_from('>H', frame, 14)[0]
+        else:
+            offset = 0
+            ethertype = _ETHERTYPE_IPV4
+        if ethertype != _ETHERTYPE_IPV4 or len(frame) < offset + 20 \
+                or frame[offset] >> 4 != 4 or frame[offset + 9] != _IPPROTO_UDP:
+            continue
+        ihl = (frame[offset] & 0xf) * 4
+        total_length, flags_fragment = struct.unpack_from('>H2xH', frame, offset + 2)
+        if flags_fragment & 0x3fff:
+            continue     # Fragmented
+        addr = bytes(frame[offset + 16 : offset + 20])
+        udp = offset + ihl
+        port, udp_length = struct.unpack_from('>HH', frame, udp + 2)
+        yield ((sec + frac * time_scale), Endpoint(socket.inet_ntoa(addr), port),
+               frame[udp + 8 : udp + udp_length])
+
+
+def read_capture(data: Union[bytes, memoryview]) -> Iterator[Packet]:
+    """Iterate over the packets in a capture.
+
+    Parameters
+    ----------
+    data
+        Contents of a pcap or native capture file (typically memory-mapped)
+
+    Raises
+    ------
+    ValueError
+        if the format is not recognised
+    """
+    data = memoryview(data).cast('B')
+    if bytes(data[:len(CAPTURE_MAGIC)]) == CAPTURE_MAGIC:
+        return _read_native(data)
+    elif bytes(data[:4]) in _PCAP_MAGIC:
+        return _read_pcap(data)
+    else:
+        raise ValueError('Unrecognised capture file format')
+
+
+class ReplayReceiver(Receiver):
+    """Receiver that replays packets from capture files.
+
+    The packets from all the files are merged in order of arrival time, and
+    those sent to the receiver's endpoints are fed to the corresponding
+    streams from a separate thread, so that the event loop is not burdened.
+    At most `max_backlog` packets are queued for each stream, so that replay
+    is lossless even when the streams cannot keep up.
+
+    Once all the packets have been replayed, the streams are stopped. The
+    constructor arguments `interface_address` and `ibv` are ignored.
+
+    Parameters
+    ----------
+    captures : list of str
+        Filenames of capture files (pcap or native format)
+    speedup : float, optional
+        Ratio of replay rate to the original rate, or 0 (the default) to
+        replay as fast as possible
+    max_backlog : int, optional
+        Maximum number of packets queued for each stream
+    """
+    def __init__(self, *args, **kwargs) -> None:
+        captures: Sequence[str] = kwargs.pop('captures')
+        self._speedup: float = kwargs.pop('speedup', 0.0)
+        self._max_backlog: int = kwargs.pop('max_backlog', 4096)
+        if self._speedup < 0:
+            raise ValueError('speedup cannot be negative')
+        # Populated by _add_readers
+        self._replay_queues = {}   # type: Dict[Tuple[str, int], int]
+        self._replay_streams = \
+            []  # type: List[Tuple[spead2.InprocQueue, spead2.recv.asyncio.Stream]]
+        self._replay_stop = threading.Event()
+        self._captures = []        # type: List[mmap.mmap]
+        for filename in captures:
+            with open(filename, 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._captures.append(data)
+            read_capture(data)     # Validates the format
+        super().__init__(*args, **kwargs)
+        self._replay_thread = threading.Thread(
+            target=self._replay, name='replay', daemon=True)
+        self._replay_thread.start()
+
+    def _add_readers(self, stream: Union[spead2.recv.asyncio.Stream,
+                                         spead2.recv.ChunkStreamGroupMember],
+                     endpoints: Sequence[Endpoint],
+                     max_packet_size: int, buffer_size: int) -> None:
+        queue = spead2.InprocQueue()
+        stream.add_inproc_reader(queue)
+        for endpoint in endpoints:
+            self._replay_queues[(endpoint.host, endpoint.port)] = len(self._replay_streams)
+        self._replay_streams.append((queue, stream))
+        _logger.info("CBF SPEAD stream replay for %s", endpoints_to_str(endpoints))
+
+    def _stream_index(self, endpoint: Endpoint) -> Optional[int]:
+        idx = self._replay_queues.get((endpoint.host, endpoint.port))
+        if idx is None:
+            # Endpoints may specify only a port
+            idx = self._replay_queues.get(('', endpoint.port))
+        return idx
+
+    def _wait_backlog(self, stream: Union[spead2.recv.asyncio.Stream,
+                                          spead2.recv.ChunkStreamGroupMember],
+                      fed: int) -> bool:
+        """Wait until fewer than `max_backlog` packets are queued for `stream`.
+
+        Returns false if the receiver was stopped while waiting.
+        """
+        while fed - stream.stats['packets'] >= self._max_backlog:
+            if self._replay_stop.wait(0.001):
+                return False
+        return True
+
+    def _replay(self) -> None:
+        fed = [0] * len(self._replay_streams)
+        packets = heapq.merge(*[read_capture(data) for data in self._captures],
+                              key=lambda packet: packet[0])
+        start_time = None
+        start_wall = time.monotonic()
+        try:
+            for timestamp, endpoint, payload in packets:
+                if self._replay_stop.is_set():
+                    break
+                idx = self._stream_index(endpoint)
+                if idx is None:
+                    continue
+                if self._speedup:
+                    if start_time is None:
+                        start_time = timestamp
+                    delay = start_wall + (timestamp - start_time) / self._speedup \
+                        - time.monotonic()
+                    if delay > 0 and self._replay_stop.wait(delay):
+                        break
+                queue, stream = self._replay_streams[idx]
+                if fed[idx] % 64 == 0 and not self._wait_backlog(stream, fed[idx]):
+                    break
+                queue.add_packet(payload)
+                fed[idx] += 1
+            _logger.info('Replayed %d packets', sum(fed))
+        except Exception:
+            _logger.exception('Replay failed')
+        finally:
+            for queue, stream in self._replay_streams:
+                queue.stop()
+
+    def stop(self) -> None:
+        self._replay_stop.set()
+        super().stop()
@@ -2,9 +2,12 @@
 
 import logging
 import asyncio
-from typing import List, Dict, Sequence, Any   # noqa: F401
+import time
+from collections import OrderedDict
+from typing import List, Dict, Sequence, Tuple, Optional, Mapping, Any   # noqa: F401
 
 import numpy as np
+import aiokatcp
 from katsdptelstate.endpoint import Endpoint
 import spead2.send.asyncio
 
@@ -38,18 +41,189 @@ class Data:
 
 
 async def async_send_heap(stream: spead2.send.asyncio.UdpStream,
-                          heap: spead2.send.Heap) -> None:
+                          heap: spead2.send.Heap, cnt: int = -1,
+                          substream_index: int = 0, rate: float = -1.0) -> int:
     """Send a heap on a stream and wait for it to complete, but log and
-    suppress exceptions."""
+    suppress exceptions.
+
+    Returns
+    -------
+    int
+        Number of bytes sent (0 if there was an error)
+    """
     try:
-        await stream.async_send_heap(heap)
+        return await stream.async_send_heap(heap, cnt, substream_index, rate)
     except Exception:
         _logger.warn("Error sending heap", exc_info=True)
+        return 0
+
+
+async def async_send_heaps(stream: spead2.send.asyncio.UdpStream,
+                           heaps: List[spead2.send.HeapReference]) -> int:
+    """Send a group of heaps on a stream, interleaving their packets, and
+    wait for it to complete, but log and suppress exceptions.
+
+    Returns
+    -------
+    int
+        Number of bytes sent (0 if there was an error)
+    """
+    try:
+        return await stream.async_send_heaps(heaps, spead2.send.GroupMode.ROUND_ROBIN)
+    except Exception:
+        _logger.warn("Error sending heaps", exc_info=True)
+        return 0
+
+
+def _dump_size(channels: int, baselines: int) -> int:
+    """Estimate the transmitted size in bytes of one L0 heap."""
+    item_size = np.dtype(np.complex64).itemsize + 2 * np.dtype(np.uint8).itemsize
+    dump_size = channels * baselines * item_size
+    dump_size += channels * np.dtype(np.float32).itemsize
+    # Add a guess for SPEAD protocol overhead (including descriptors). This just needs
+    # to be conservative, to make sure we don't try to send too slow.
+    dump_size += 2048
+    return dump_size
+
+
+def _dump_rate(channels: int, baselines: int, int_time: float) -> float:
+    """Initial transmission rate (in bytes per second) for one L0 heap per dump."""
+    if not int_time:
+        return 0.0
+    return _dump_size(channels, baselines) / int_time * RatePacer.HEADROOM
+
+
+class RatePacer:
+    """Choose the transmission rate for each dump of an L0 output.
+
+    The nominal rate transmits a dump in `int_time`, based on the number of
+    bytes actually sent for the previous dump, with a small amount of
+    headroom for other network overheads. When the sender falls behind,
+    because previous dumps are still being sent or because dumps are being
+    handed over more often than every `int_time` while the pipeline catches
+    up after a stall, the rate is raised in proportion, up to `max_ratio`
+    times the nominal rate. This drains the backlog quickly (releasing the
+    buffers holding it) without bursting at line rate.
+
+    If `sensors` is given, it must contain sensors called
+    :samp:`output-{name}-rate` and :samp:`output-{name}-queue-depth`, which
+    are updated with the current rate (in bytes per second) and the number
+    of dumps being sent.
+
+    Parameters
+    ----------
+    int_time
+        Time between dumps, in seconds of wall clock time. If zero, the
+        rate is not limited.
+    dump_bytes
+        Initial estimate of the bytes sent per dump
+    max_ratio
+        Maximum ratio of the rate to the nominal rate
+    sensors
+        Sensors, which must include those named above
+    name
+        Name of the output, used in the sensor names
+    """
+    #: Ratio of the nominal rate to the rate that just keeps up
+    HEADROOM = 1.05
+
+    def __init__(self, int_time: float, dump_bytes: int = 0, max_ratio: float = 4.0,
+                 sensors: Mapping[str, aiokatcp.Sensor] = None, name: str = None) -> None:
+        if max_ratio < 1.0:
+            raise ValueError('max_ratio must be at least 1')
+        self.int_time = int_time
+        self.dump_bytes = dump_bytes
+        self.max_ratio = max_ratio
+        self.rate = 0.0
+        self.depth = 0
+        self._last_begin = None       # type: Optional[float]
+        if sensors is not None:
+            self._rate_sensor = sensors['output-{}-rate'.format(name)]
+            self._depth_sensor = sensors['output-{}-queue-depth'.format(name)]
+        else:
+            self._rate_sensor = self._depth_sensor = None
+
+    def _update_sensors(self) -> None:
+        if self._rate_sensor is not None:
+            self._rate_sensor.value = self.rate
+            self._depth_sensor.value = self.depth
+
+    def begin(self) -> float:
+        """Record that a dump is about to be sent.
+
+        Returns
+        -------
+        float
+            Rate at which to send the dump, in bytes per second, or -1 to use
+            the (unlimited) rate of the stream if `int_time` is zero.
+        """
+        now = time.monotonic()
+        self.depth += 1
+        ratio = float(self.depth)
+        if self._last_begin is not None and now > self._last_begin:
+            ratio = max(ratio, self.int_time / (now - self._last_begin))
+        self._last_begin = now
+        ratio = min(ratio, self.max_ratio)
+        if self.int_time and self.dump_bytes:
+            self.rate = self.dump_bytes / self.int_time * self.HEADROOM * ratio
+            ret = self.rate
+        else:
+            ret = -1.0
+        self._update_sensors()
+        return ret
+
+    def end(self, nbytes: int) -> None:
+        """Record that a dump has been sent.
+
+        Parameters
+        ----------
+        nbytes
+            Number of bytes sent for the dump (including protocol
+            overheads), or 0 if unknown
+        """
+        self.depth -= 1
+        if nbytes > 0:
+            self.dump_bytes = nbytes
+        self._update_sensors()
+
+
+def _make_stream(thread_pool: spead2.ThreadPool, endpoints: Sequence[Endpoint],
+                 interface_address: str, rate: float,
+                 max_heaps: int = spead2.send.StreamConfig.DEFAULT_MAX_HEAPS
+                 ) -> spead2.send.asyncio.UdpStream:
+    """Create a UDP stream with a substream per endpoint."""
+    kwargs = {}      # type: Dict[str, Any]
+    if interface_address is not None:
+        kwargs['interface_address'] = interface_address
+        kwargs['ttl'] = 1
+    return spead2.send.asyncio.UdpStream(
+        thread_pool, [(endpoint.host, endpoint.port) for endpoint in endpoints],
+        spead2.send.StreamConfig(max_packet_size=8872, rate=rate, max_heaps=max_heaps),
+        **kwargs)
+
+
+class _VisHeap:
+    """Prebuilt data heap for :class:`VisSender`.
+
+    The heap references the visibility buffers and its own scalar arrays
+    directly, so that it can be sent again after updating the scalars in
+    place.
+    """
+    def __init__(self, heap: spead2.send.Heap,
+                 timestamp: np.ndarray, dump_index: np.ndarray) -> None:
+        self.heap = heap
+        self.timestamp = timestamp
+        self.dump_index = dump_index
 
 
 class VisSender:
     """A single output SPEAD stream of L0 visibility data.
 
+    A heap is built once for each set of buffers passed to :meth:`send`
+    (which are expected to be a small number of reusable staging buffers),
+    and later sends from the same buffers only update the timestamp and dump
+    index. Every heap carries the item descriptors.
+
     Parameters
     ----------
     thread_pool : `spead2.ThreadPool`
@@ -71,34 +245,40 @@ class VisSender:
         Number of channels in the full L0 output
     baselines : int
         number of baselines in output
+    stream : `spead2.send.asyncio.UdpStream`, optional
+        Stream shared with other senders. If specified, `thread_pool`,
+        `endpoint` and `interface_address` are ignored and heaps are sent to
+        substream `substream_index` of this stream.
+    substream_index : int, optional
+        Substream of `stream` to which heaps are sent
     """
+    #: Maximum number of sets of buffers for which heaps are kept
+    MAX_HEAPS = 4
+
     def __init__(self, thread_pool: spead2.ThreadPool,
                  endpoint: Endpoint, interface_address: str,
                  flavour: spead2.Flavour,
                  int_time: float, channel_range: Range,
-                 channel0: int, all_channels: int, baselines: int) -> None:
+                 channel0: int, all_channels: int, baselines: int,
+                 stream: spead2.send.asyncio.UdpStream = None,
+                 substream_index: int = 0) -> None:
         channels = len(channel_range)
-        item_size = np.dtype(np.complex64).itemsize + 2 * np.dtype(np.uint8).itemsize
-        dump_size = channels * baselines * item_size
-        dump_size += channels * np.dtype(np.float32).itemsize
-        # Add a guess for SPEAD protocol overhead (including descriptors). This just needs
-        # to be conservative, to make sure we don't try to send too slow.
-        dump_size += 2048
-        # Send slightly faster to allow for other network overheads (e.g. overhead per
-        # packet, which is a fraction of total size) and to allow us to catch
-        # up if we temporarily fall behind the rate.
-        rate = dump_size / int_time * 1.05 if int_time else 0.0
-        kwargs = {}      # type: Dict[str, Any]
-        if interface_address is not None:
-            kwargs['interface_address'] = interface_address
-            kwargs['ttl'] = 1
-        self._stream = spead2.send.asyncio.UdpStream(
-            thread_pool, [(endpoint.host, endpoint.port)],
-            spead2.send.StreamConfig(max_packet_size=8872, rate=rate), **kwargs)
-        self._stream.set_cnt_sequence(channel0, all_channels)
+        if stream is None:
+            stream = _make_stream(thread_pool, [endpoint], interface_address,
+                                  _dump_rate(channels, baselines, int_time))
+        self._stream = stream
+        self._substream_index = substream_index
+        # Heap counters are assigned explicitly rather than with
+        # set_cnt_sequence, so that they remain unique when the stream is
+        # shared. The first channel is used as a unique key.
+        self._next_cnt = channel0
+        self._cnt_step = all_channels
         self._ig = spead2.send.ItemGroup(descriptor_frequency=1, flavour=flavour)
+        self._flavour = flavour
         self._channel_range = channel_range
         self._channel0 = channel0
+        # Prebuilt heaps, keyed by the identities of the buffers in Data
+        self._heaps = OrderedDict()     # type: OrderedDict[Tuple[int, ...], _VisHeap]
         self._ig.add_item(id=None, name='correlator_data',
                           description="Visibilities",
                           shape=(channels, baselines), dtype=np.complex64)
@@ -121,33 +301,98 @@ class VisSender:
                           description="Channel index of first channel in the heap",
                           shape=(), dtype=np.uint32)
 
+    def _take_cnt(self) -> int:
+        cnt = self._next_cnt
+        self._next_cnt += self._cnt_step
+        return cnt
+
     async def start(self):
         """Send a start packet to the stream."""
-        await async_send_heap(self._stream, self._ig.get_start())
+        await async_send_heap(self._stream, self._ig.get_start(),
+                              self._take_cnt(), self._substream_index)
 
     async def stop(self):
         """Send a stop packet to the stream. To ensure that it won't be lost
         on the sending side, the stream is first flushed, then the stop
         heap is sent and waited for."""
         await self._stream.async_flush()
-        await self._stream.async_send_heap(self._ig.get_end())
+        await self._stream.async_send_heap(self._ig.get_end(),
+                                           self._take_cnt(), self._substream_index)
 
-    async def send(self, data, idx, ts_rel):
-        """Asynchronously send visibilities to the receiver"""
+    def _make_heap(self, data: Data) -> _VisHeap:
+        """Build a heap referencing the buffers in `data`."""
         data = data[self._channel_range.asslice()]
-        self._ig['correlator_data'].value = data.vis
-        self._ig['flags'].value = data.flags
-        self._ig['weights'].value = data.weights
-        self._ig['weights_channel'].value = data.weights_channel
-        self._ig['timestamp'].value = ts_rel
-        self._ig['dump_index'].value = idx
-        self._ig['frequency'].value = self._channel0
-        await async_send_heap(self._stream, self._ig.get_heap())
+        timestamp = np.zeros((), np.dtype('>f8'))
+        dump_index = np.zeros((), np.dtype('>u8'))
+        values = [
+            ('correlator_data', data.vis),
+            ('flags', data.flags),
+            ('weights', data.weights),
+            ('weights_channel', data.weights_channel),
+            ('timestamp', timestamp),
+            ('dump_index', dump_index),
+            ('frequency', np.array(self._channel0, np.uint32))
+        ]
+        heap = spead2.send.Heap(self._flavour)
+        for name, value in values:
+            item = self._ig[name]
+            # The heap keeps a reference to the value (not a copy), and
+            # immediate values are only encoded when the heap is sent.
+            item.value = value
+            heap.add_descriptor(item)
+            heap.add_item(item)
+        return _VisHeap(heap, timestamp, dump_index)
+
+    def prepare(self, data: Data, idx: int, ts_rel: float,
+                rate: float = -1.0) -> spead2.send.HeapReference:
+        """Prepare a heap of visibilities for sending.
+
+        This is used to batch heaps from several senders sharing a stream;
+        :meth:`send` should be used otherwise. The buffers in `data` must
+        not be modified until the heap has been sent. If `rate` is
+        non-negative, it overrides the rate of the stream.
+        """
+        key = (id(data.vis), id(data.flags), id(data.weights), id(data.weights_channel))
+        vis_heap = self._heaps.get(key)
+        if vis_heap is None:
+            vis_heap = self._make_heap(data)
+            self._heaps[key] = vis_heap
+            # The heaps keep the buffers alive, so bound their number in
+            # case the caller does not reuse buffers.
+            if len(self._heaps) > self.MAX_HEAPS:
+                self._heaps.popitem(last=False)
+        vis_heap.timestamp[()] = ts_rel
+        vis_heap.dump_index[()] = idx
+        return spead2.send.HeapReference(vis_heap.heap, cnt=self._take_cnt(),
+                                         substream_index=self._substream_index, rate=rate)
+
+    async def send(self, data: Data, idx: int, ts_rel: float, rate: float = -1.0) -> int:
+        """Asynchronously send visibilities to the receiver.
+
+        The buffers in `data` must not be modified until this completes. If
+        `rate` is non-negative, it overrides the rate of the stream.
+
+        Returns
+        -------
+        int
+            Number of bytes sent (0 if there was an error)
+        """
+        ref = self.prepare(data, idx, ts_rel, rate)
+        return await async_send_heap(self._stream, ref.heap, ref.cnt, ref.substream_index,
+                                     ref.rate)
 
 
 class VisSenderSet:
     """Manages a collection of :class:`VisSender` objects, and provides similar
     functions that work collectively on all the streams.
+
+    If `batched` is true, the senders share a single stream with a substream
+    per endpoint, and the heaps for a dump are submitted to it in one call
+    (with their packets interleaved). Otherwise each sender has its own
+    stream.
+
+    The rate of each dump is chosen by `pacer`, which defaults to a
+    :class:`RatePacer` without sensors.
     """
     def __init__(self,
                  thread_pool: spead2.ThreadPool,
@@ -156,20 +401,35 @@ class VisSenderSet:
                  flavour: spead2.Flavour,
                  int_time: float,
                  channel_range: Range,
-                 channel0: int, all_channels: int, baselines: int) -> None:
+                 channel0: int, all_channels: int, baselines: int,
+                 batched: bool = False, pacer: RatePacer = None) -> None:
         channels = len(channel_range)
         n = len(endpoints)
         if channels % n != 0:
             raise ValueError('Number of channels not evenly divisible by number of endpoints')
         sub_channels = channels // n
         self.sub_channels = sub_channels
+        self.batched = batched
+        if pacer is None:
+            pacer = RatePacer(int_time)
+        if not pacer.dump_bytes:
+            pacer.dump_bytes = n * _dump_size(sub_channels, baselines)
+        self.pacer = pacer
+        self._stream = None    # type: Optional[spead2.send.asyncio.UdpStream]
+        if batched:
+            # Allow as many heaps in flight as the same number of separate streams
+            self._stream = _make_stream(
+                thread_pool, endpoints, interface_address,
+                n * _dump_rate(sub_channels, baselines, int_time),
+                n * spead2.send.StreamConfig.DEFAULT_MAX_HEAPS)
         self._senders = []     # type: List[VisSender]
         for i in range(n):
             a = channel_range.start + i * sub_channels
             b = a + sub_channels
             self._senders.append(
                 VisSender(thread_pool, endpoints[i], interface_address, flavour, int_time,
-                          Range(a, b), channel0 + i * sub_channels, all_channels, baselines))
+                          Range(a, b), channel0 + i * sub_channels, all_channels, baselines,
+                          stream=self._stream, substream_index=i if batched else 0))
 
     @property
     def size(self) -> int:
@@ -185,5 +445,215 @@ class VisSenderSet:
 
     async def send(self, data: Data, idx: int, ts_rel: float) -> None:
         """Send a data heap to all streams, splitting the data between them."""
-        await asyncio.gather(*(sender.send(data, idx, ts_rel)
-                               for sender in self._senders))
+        rate = self.pacer.begin()
+        nbytes = 0
+        try:
+            if self._stream is not None:
+                # Packets are interleaved, so each heap gets the full rate
+                heaps = [sender.prepare(data, idx, ts_rel, rate) for sender in self._senders]
+                nbytes = await async_send_heaps(self._stream, heaps)
+            else:
+                if rate >= 0:
+                    rate /= len(self._senders)
+                sizes = await asyncio.gather(*(sender.send(data, idx, ts_rel, rate)
+                                               for sender in self._senders))
+                nbytes = sum(sizes) if all(sizes) else 0
+        finally:
+            self.pacer.end(nbytes)
+
+
+#: Encodings of signal display payloads supported by :class:`SdEncoder`
+SD_ENCODINGS = {
+    'float32': 'full precision',
+    'float16': 'half-precision floating point',
+    'int16': '16-bit integers with a per-item scale factor'
+}
+
+#: Signal display items re-encoded by :class:`SdEncoder`, with the IDs of
+#: their scale factor and block index items
+_SD_ENCODED_ITEMS = {
+    'sd_blmxdata': (0x3520, 0x3530),
+    'sd_percspectrum': (0x3521, 0x3531)
+}
+_SD_DELTA_BLOCK_ID = 0x3540
+
+
+def parse_sd_mode(mode: str) -> Tuple[str, bool]:
+    """Parse a signal display mode for :class:`SdEncoder`.
+
+    The mode is a comma-separated list containing at most one of the keys
+    of :data:`SD_ENCODINGS` (defaulting to ``float32``) and optionally
+    ``delta``.
+
+    Returns
+    -------
+    encoding : str
+        Key of :data:`SD_ENCODINGS`
+    delta : bool
+        Whether to send only changed blocks
+
+    Raises
+    ------
+    ValueError
+        if `mode` is not valid
+    """
+    encodings = []
+    delta = False
+    for part in mode.split(','):
+        if part == 'delta':
+            delta = True
+        elif part in SD_ENCODINGS:
+            encodings.append(part)
+        else:
+            raise ValueError('Unknown signal display mode {!r}'.format(part))
+    if len(encodings) > 1:
+        raise ValueError('At most one signal display encoding may be given')
+    encoding = encodings[0] if encodings else 'float32'
+    if delta and encoding == 'float16':
+        raise ValueError('delta mode cannot be combined with float16')
+    return encoding, delta
+
+
+class SdEncoder:
+    """Reduce the size of the signal display heaps sent to one server.
+
+    The large floating-point items (``sd_blmxdata`` and ``sd_percspectrum``)
+    can be quantised to float16, or to int16 with a scale factor per item
+    and heap (sent as :samp:`{name}_scale`, with NaN encoded as -32768). In
+    delta mode, the channels of those items are split into blocks, and only
+    the blocks that differ from those last sent are included (at least one,
+    since spead2 drops empty items), with their indices in
+    :samp:`{name}_blocks`. Other items are passed through.
+
+    The heaps never refer to the arrays in the source item group, so they
+    can still be in flight after those arrays are reused.
+
+    A delta-encoded item has a variable leading dimension, which a SPEAD
+    descriptor can only express with a SPEAD format rather than a numpy
+    dtype. Formats cannot represent float16, so delta mode cannot be
+    combined with it (for the same reason ``sd_data`` is never quantised).
+
+    Parameters
+    ----------
+    flavour : `spead2.Flavour`
+        SPEAD flavour of the heaps
+    encoding : str
+        Key of :data:`SD_ENCODINGS`
+    delta : bool
+        If true, send only changed blocks
+    block_channels : int
+        Number of channels per block in delta mode
+    """
+    def __init__(self, flavour: spead2.Flavour, encoding: str = 'float32',
+                 delta: bool = False, block_channels: int = 64) -> None:
+        if encoding not in SD_ENCODINGS:
+            raise ValueError('Unknown signal display encoding {!r}'.format(encoding))
+        if delta and encoding == 'float16':
+            raise ValueError('delta mode cannot be combined with float16')
+        if block_channels <= 0:
+            raise ValueError('block_channels must be positive')
+        self.encoding = encoding
+        self.delta = delta
+        self.block_channels = block_channels
+        self._flavour = flavour
+        self._ig = None         # type: Optional[spead2.send.ItemGroup]
+        self._last = {}         # type: Dict[str, np.ndarray]
+        self._last_scale = {}   # type: Dict[str, np.float32]
+
+    def reset(self) -> None:
+        """Forget the items and values seen, e.g. because a new session started."""
+        self._ig = None
+        self._last.clear()
+        self._last_scale.clear()
+
+    def _encoded(self, name: str) -> bool:
+        return name in _SD_ENCODED_ITEMS and (self.encoding != 'float32' or self.delta)
+
+    def _make_ig(self, source: spead2.send.ItemGroup) -> spead2.send.ItemGroup:
+        ig = spead2.send.ItemGroup(flavour=self._flavour)
+        if self.delta:
+            ig.add_item(_SD_DELTA_BLOCK_ID, 'sd_delta_block_channels',
+                        'Number of channels in each block of delta-encoded items',
+                        (), np.uint32, value=np.uint32(self.block_channels))
+        for item in source.values():
+            if not self._encoded(item.name):
+                ig.add_item(item.id, item.name, item.description, item.shape,
+                            item.dtype, item.order, item.format)
+                continue
+            scale_id, blocks_id = _SD_ENCODED_ITEMS[item.name]
+            dtype = format = None
+            shape = item.shape
+            if self.encoding == 'int16':
+                ig.add_item(scale_id, item.name + '_scale',
+                            'Scale factor for {} (NaN is encoded as -32768)'.format(item.name),
+                            (), np.float32)
+                if self.delta:
+                    format = [('i', 16)]
+                else:
+                    dtype = np.dtype('>i2')
+            elif self.encoding == 'float16':
+                dtype = np.dtype('<f2')
+            else:
+                format = [('f', 32)]
+            if self.delta:
+                ig.add_item(blocks_id, item.name + '_blocks',
+                            'Indices of the blocks of channels in {}'.format(item.name),
+                            (None,), None, format=[('u', 32)])
+                shape = (None,) + tuple(shape[1:])
+            ig.add_item(item.id, item.name, item.description, shape, dtype, format=format)
+        return ig
+
+    def _encode(self, ig: spead2.send.ItemGroup, name: str, value: np.ndarray) -> np.ndarray:
+        if self.encoding == 'float16':
+            value = value.astype(np.float16)
+        elif self.encoding == 'int16':
+            finite = np.isfinite(value)
+            peak = np.max(np.abs(value), where=finite, initial=0.0)
+            scale = np.float32(peak / 32767) if peak > 0 else np.float32(1)
+            value = np.where(finite, np.rint(value / scale), -32768).astype(np.dtype('>i2'))
+            ig[name + '_scale'].value = scale
+            if self._last_scale.get(name) != scale:
+                # Unchanged values would be scaled differently
+                self._last.pop(name, None)
+            self._last_scale[name] = scale
+        else:
+            # The source buffer is reused, so it must be copied to keep it
+            value = value.astype(np.dtype('>f4'))
+        if self.delta:
+            n = value.shape[0]
+            starts = np.arange(0, n, self.block_channels)
+            last = self._last.get(name)
+            if last is None:
+                changed = np.ones(len(starts), np.bool_)
+            else:
+                # Compare bit patterns, so that NaNs compare equal
+                diff = value.view(np.uint8).reshape(n, -1) != last.view(np.uint8).reshape(n, -1)
+                changed = np.logical_or.reduceat(np.any(diff, axis=1), starts)
+                # Zero-length items are not received at all, which would
+                # leave the receiver with a stale block list
+                if not np.any(changed):
+                    changed[0] = True
+            self._last[name] = value
+            ig[name + '_blocks'].value = np.flatnonzero(changed).astype(np.uint32)
+            value = value[np.repeat(changed, self.block_channels)[:n]]
+        return value
+
+    def get_heap(self, source: spead2.send.ItemGroup, descriptors: bool) -> spead2.send.Heap:
+        """Encode the current values of the signal display items in `source`.
+
+        All items in `source` must have the same names, IDs and descriptors
+        as on previous calls, unless :meth:`reset` has been called.
+        """
+        if self._ig is None:
+            self._ig = self._make_ig(source)
+        ig = self._ig
+        for item in source.values():
+            value = item.value
+            if value is None:
+                continue
+            if self._encoded(item.name):
+                value = self._encode(ig, item.name, np.asarray(value))
+            elif isinstance(value, np.ndarray):
+                value = value.copy()
+            ig[item.name].value = value
+        return ig.get_heap(descriptors='all' if descriptors else 'none', data='all')
@@ -0,0 +1,840 @@
+# coding: utf-8
+"""CPU implementation of the ingest signal processing.
+
+This provides the same interface as :class:`katsdpingest.sigproc.IngestTemplate`
+and :class:`katsdpingest.sigproc.IngestOperation` (slot names, shapes and the
+``start_sum``/``end_sum``/``start_sd_sum``/``end_sd_sum`` protocol), but
+computes everything with vectorised NumPy. A minimal emulation of the
+katsdpsigproc context, command queue and device buffer classes is provided
+so that :class:`katsdpingest.ingest_session.CBFIngest` can drive it without
+modification: work is queued to a per-queue worker thread and executed in
+order, and markers can be waited for just like device events.
+
+To use more than one core, the channels can be split across worker processes
+(see :class:`ShardedIngestOperationHost`).
+"""
+
+import os
+import math
+import tempfile
+import weakref
+import multiprocessing
+import concurrent.futures
+from typing import List, Tuple, Iterable, Mapping, Dict, Callable, Optional, Type, Any
+
+import numpy as np
+import katsdpsigproc.rfi.host as rfi_host
+from katsdpsigproc.rfi import MAD_NORMAL
+from katdal.flags import CAL_RFI, CAM, INGEST_RFI
+
+from .utils import Range
+
+
+class HostEvent:
+    """Marker in a :class:`HostCommandQueue`. This is the equivalent of a device event."""
+
+    def __init__(self, command_queue: 'HostCommandQueue',
+                 future: 'concurrent.futures.Future[None]') -> None:
+        self.command_queue = command_queue
+        self._future = future
+
+    def wait(self) -> None:
+        """Block until all work enqueued before the marker has completed.
+
+        Raises
+        ------
+        Exception
+            if any work enqueued on the command queue raised an exception
+        """
+        self._future.result()
+
+
+class HostContext:
+    """Stand-in for a katsdpsigproc context, for running :mod:`sigproc_host` operations.
+
+    It can be used as a context manager (which does nothing), for
+    compatibility with code that makes a device context current.
+
+    Parameters
+    ----------
+    processes
+        Number of worker processes across which to split the channels. If
+        it is 1, all processing is done in-process.
+    """
+
+    def __init__(self, processes: int = 1) -> None:
+        if processes < 1:
+            raise ValueError('processes must be positive')
+        self.processes = processes
+
+    def create_command_queue(self) -> 'HostCommandQueue':
+        return HostCommandQueue(self)
+
+    def __enter__(self) -> 'HostContext':
+        return self
+
+    def __exit__(self, *args) -> None:
+        pass
+
+
+class HostCommandQueue:
+    """In-order queue of work, executed by a dedicated worker thread.
+
+    NumPy releases the GIL for most of the heavy lifting, so the event loop
+    remains responsive while work is in progress. If any work item raises an
+    exception, all subsequent work on the queue is skipped and the exception
+    is re-raised when waiting for any later marker (analogous to a sticky
+    device error).
+    """
+
+    def __init__(self, context: HostContext) -> None:
+        self.context = context
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='host-command-queue')
+        self._error: Optional[Exception] = None
+
+    def enqueue(self, func: Callable[..., Any], *args: Any) -> None:
+        """Add a function call to the queue."""
+        def run() -> None:
+            if self._error is None:
+                try:
+                    func(*args)
+                except Exception as exc:
+                    self._error = exc
+
+        self._executor.submit(run)
+
+    def enqueue_marker(self) -> HostEvent:
+        def check() -> None:
+            if self._error is not None:
+                raise self._error
+
+        return HostEvent(self, self._executor.submit(check))
+
+    def enqueue_wait_for_events(self, events: Iterable[HostEvent]) -> None:
+        for event in events:
+            # Events from this queue are already ordered
+            if event.command_queue is not self:
+                self.enqueue(event.wait)
+
+    def flush(self) -> None:
+        pass
+
+    def finish(self) -> None:
+        self.enqueue_marker().wait()
+
+
+class HostBuffer:
+    """Stand-in for :class:`katsdpsigproc.accel.DeviceArray`, backed by host memory.
+
+    The transfer methods take a command queue and are ordered relative to
+    other work on that queue. There is never any padding.
+
+    Parameters
+    ----------
+    shape, dtype
+        Shape and type of the buffer
+    array
+        Existing storage to use (which must match `shape` and `dtype`). If
+        not specified, a zero-initialised array is allocated.
+
+    Attributes
+    ----------
+    array : :class:`np.ndarray`
+        Backing storage. It should only be accessed by work running on a
+        command queue.
+    """
+
+    def __init__(self, shape: Tuple[int, ...], dtype: Any,
+                 array: Optional[np.ndarray] = None) -> None:
+        if array is None:
+            array = np.zeros(shape, dtype)
+        elif array.shape != tuple(shape) or array.dtype != np.dtype(dtype):
+            raise ValueError('array does not match shape and dtype')
+        self.array = array
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self.array.shape
+
+    @property
+    def padded_shape(self) -> Tuple[int, ...]:
+        return self.array.shape
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.array.dtype
+
+    def empty_like(self) -> np.ndarray:
+        return np.empty(self.shape, self.dtype)
+
+    def zero(self, command_queue: HostCommandQueue) -> None:
+        command_queue.enqueue(self.array.fill, 0)
+
+    def set_async(self, command_queue: HostCommandQueue, ary: np.ndarray) -> None:
+        command_queue.enqueue(np.copyto, self.array, ary)
+
+    def get_async(self, command_queue: HostCommandQueue, ary: np.ndarray) -> None:
+        command_queue.enqueue(np.copyto, ary, self.array)
+
+    def set(self, command_queue: HostCommandQueue, ary: np.ndarray) -> None:
+        self.set_async(command_queue, ary)
+        command_queue.finish()
+
+    def get(self, command_queue: HostCommandQueue, ary: np.ndarray = None) -> np.ndarray:
+        if ary is None:
+            ary = self.empty_like()
+        self.get_async(command_queue, ary)
+        command_queue.finish()
+        return ary
+
+
+class NoiseEstMADNZHost(rfi_host.AbstractNoiseEstHost):
+    """Estimate noise using the median of non-zero absolute deviations.
+
+    This computes the same thing as :class:`katsdpsigproc.rfi.host.NoiseEstMADHost`,
+    but handles all baselines at once rather than looping over them.
+    """
+
+    def __call__(self, deviations: np.ndarray) -> np.ndarray:
+        abs_dev = np.sort(np.abs(deviations), axis=0)
+        channels = abs_dev.shape[0]
+        nz = channels - np.count_nonzero(abs_dev, axis=0)    # Number of zeros
+        n = channels - nz
+        lo = np.minimum(nz + (n - 1) // 2, channels - 1)[np.newaxis, :]
+        hi = np.minimum(nz + n // 2, channels - 1)[np.newaxis, :]
+        median = 0.5 * (np.take_along_axis(abs_dev, lo, axis=0)[0]
+                        + np.take_along_axis(abs_dev, hi, axis=0)[0])
+        median = np.where(n > 0, median, np.nan)
+        return median * MAD_NORMAL
+
+
+class IngestTemplateHost:
+    """Template for the entire ingest processing, running on the CPU.
+
+    This is the host counterpart of :class:`katsdpingest.sigproc.IngestTemplate`.
+    Since there is no code to compile or tune, it is cheap to construct.
+
+    Parameters
+    ----------
+    context
+        Host context
+    excise
+        Excise flagged data by downweighting it massively.
+    continuum
+        Perform continuum averaging of L0 data.
+    background_width
+        Width of the median filter used by the RFI flagger's backgrounder
+    background_use_flags
+        If true, the backgrounder ignores data that has prior flags (the
+        equivalent of :attr:`katsdpsigproc.rfi.device.BackgroundFlags.FULL`).
+    flag_value
+        Flag value for data detected as RFI
+    """
+
+    def __init__(self, context: HostContext, excise: bool, continuum: bool, *,
+                 background_width: int = 13, background_use_flags: bool = True,
+                 flag_value: int = INGEST_RFI) -> None:
+        self.context = context
+        self.excise = excise
+        self.continuum = continuum
+        self.background_width = background_width
+        self.background_use_flags = background_use_flags
+        self.flag_value = flag_value
+        # See IngestTemplate for why this bit is safe to use
+        self.unflagged_bit = CAL_RFI
+
+    def instantiate(self, command_queue: HostCommandQueue,
+                    channels: int, channel_range: Range, count_flags_channel_range: Range,
+                    cbf_baselines: int, baselines: int, masks: int,
+                    cont_factor: int, sd_cont_factor: int,
+                    percentile_ranges: Iterable[Tuple[int, int]],
+                    background_args: Mapping[str, Any] = {},
+                    noise_est_args: Mapping[str, Any] = {},
+                    threshold_args: Mapping[str, Any] = {}) -> 'IngestOperationHost':
+        """Create an operation for this template.
+
+        If the context has more than one process, the result is a
+        :class:`ShardedIngestOperationHost`.
+        """
+        cls: Type[IngestOperationHost]
+        if self.context.processes > 1:
+            cls = ShardedIngestOperationHost
+        else:
+            cls = IngestOperationHost
+        return cls(self, command_queue, channels,
+                   channel_range, count_flags_channel_range,
+                   cbf_baselines, baselines, masks,
+                   cont_factor, sd_cont_factor,
+                   percentile_ranges,
+                   background_args, noise_est_args, threshold_args)
+
+
+class IngestOperationHost:
+    """Concrete instance of :class:`IngestTemplateHost`.
+
+    The slots are the same as for :class:`katsdpingest.sigproc.IngestOperation`
+    (refer to it for details), except that there are no scratch slots and no
+    padding. Slots are always bound, and :meth:`buffer` raises
+    :exc:`KeyError` for unknown names.
+
+    Parameters
+    ----------
+    template
+        Template holding the configuration
+    command_queue
+        Command queue on which work will be scheduled
+    channels, channel_range, count_flags_channel_range, cbf_baselines, baselines, masks, \
+    cont_factor, sd_cont_factor, percentile_ranges
+        See :class:`katsdpingest.sigproc.IngestOperation`
+    background_args
+        Extra keyword arguments for :class:`katsdpsigproc.rfi.host.BackgroundMedianFilterHost`
+    noise_est_args
+        Extra keyword arguments for :class:`NoiseEstMADNZHost`
+    threshold_args
+        Extra keyword arguments for :class:`katsdpsigproc.rfi.host.ThresholdSimpleHost`
+
+    Attributes
+    ----------
+    percentiles : list of pairs of int
+        The percentile ranges passed to the constructor
+
+    Raises
+    ------
+    ValueError
+        if the length of `channel_range` values is not a multiple of
+        `cont_factor` and `sd_cont_factor`
+    ValueError
+        if `cbf_baselines` is less than `baselines`
+    """
+
+    def __init__(self, template: IngestTemplateHost,
+                 command_queue: HostCommandQueue,
+                 channels: int, channel_range: Range, count_flags_channel_range: Range,
+                 cbf_baselines: int, baselines: int, masks: int,
+                 cont_factor: int, sd_cont_factor: int,
+                 percentile_ranges: Iterable[Tuple[int, int]],
+                 background_args: Mapping[str, Any] = {},
+                 noise_est_args: Mapping[str, Any] = {},
+                 threshold_args: Mapping[str, Any] = {}) -> None:
+        if template.continuum and len(channel_range) % cont_factor:
+            raise ValueError('channel_range length is not a multiple of cont_factor')
+        if len(channel_range) % sd_cont_factor:
+            raise ValueError('channel_range length is not a multiple of sd_cont_factor')
+        if cbf_baselines < baselines:
+            raise ValueError('Baselines can only be discarded, not amplified')
+        if not template.continuum:
+            cont_factor = 1
+        kept_channels = len(channel_range)
+        self.template = template
+        self.command_queue = command_queue
+        self.channels = channels
+        self.channel_range = channel_range
+        self.count_flags_channel_range = count_flags_channel_range
+        self.cbf_baselines = cbf_baselines
+        self.baselines = baselines
+        self.masks = masks
+        self.cont_factor = cont_factor
+        self.sd_cont_factor = sd_cont_factor
+        self.percentiles = [tuple(prange) for prange in percentile_ranges]
+        self.n_accs = 1
+        self.flagger = rfi_host.FlaggerHost(
+            rfi_host.BackgroundMedianFilterHost(template.background_width, **background_args),
+            NoiseEstMADNZHost(**noise_est_args),
+            rfi_host.ThresholdSimpleHost(flag_value=template.flag_value, **threshold_args))
+        self._background_args = dict(background_args)
+        self._noise_est_args = dict(noise_est_args)
+        self._threshold_args = dict(threshold_args)
+
+        shapes: Dict[str, Tuple[Tuple[int, ...], Any]] = {
+            'vis_in': ((channels, cbf_baselines, 2), np.int32),
+            'channel_mask': ((masks, channels), np.uint8),
+            'channel_mask_idx': ((baselines,), np.uint32),
+            'baseline_flags': ((baselines,), np.uint8),
+            'permutation': ((cbf_baselines,), np.int16),
+            'timeseries_weights': ((kept_channels,), np.float32),
+            'timeseries': ((baselines,), np.complex64),
+            'timeseriesabs': ((baselines,), np.float32),
+            'sd_flag_counts': ((baselines, 8), np.uint32),
+            'sd_flag_any_counts': ((baselines,), np.uint32)
+        }
+        products = [('spec', 1), ('sd_spec', 1), ('sd_cont', sd_cont_factor)]
+        if template.continuum:
+            products.append(('cont', cont_factor))
+        for prefix, factor in products:
+            shape = (kept_channels // factor, baselines)
+            shapes[prefix + '_vis'] = (shape, np.complex64)
+            shapes[prefix + '_flags'] = (shape, np.uint8)
+            shapes[prefix + '_weights_fp32'] = (shape, np.float32)
+            shapes[prefix + '_weights'] = (shape, np.uint8)
+            shapes[prefix + '_weights_channel'] = (shape[:1], np.float32)
+        for i in range(len(self.percentiles)):
+            name = 'percentile{0}'.format(i)
+            shapes[name] = ((5, kept_channels), np.float32)
+            shapes[name + '_flags'] = ((kept_channels,), np.uint8)
+        self._shapes = shapes
+        self._buffers = {name: HostBuffer(shape, dtype)
+                         for name, (shape, dtype) in shapes.items()}
+
+    def buffer(self, name: str) -> HostBuffer:
+        """Retrieve the buffer bound to a slot.
+
+        Raises
+        ------
+        KeyError
+            if there is no such slot
+        """
+        return self._buffers[name]
+
+    def bind(self, **kwargs: HostBuffer) -> None:
+        """Bind buffers to slots by keyword.
+
+        Raises
+        ------
+        KeyError
+            if a named slot does not exist
+        ValueError
+            if a buffer has the wrong shape or type for the slot
+        """
+        for name, buffer in kwargs.items():
+            old = self._buffers[name]
+            if buffer.shape != old.shape or buffer.dtype != old.dtype:
+                raise ValueError('Buffer for {} has the wrong shape or type'.format(name))
+        self._buffers.update(kwargs)
+
+    def ensure_all_bound(self) -> None:
+        """Provided for compatibility: slots are always bound."""
+        pass
+
+    def _array(self, name: str) -> np.ndarray:
+        return self._buffers[name].array
+
+    def _prepare(self) -> np.ndarray:
+        """Convert to floating point, scale and permute baselines.
+
+        Unlike the device version, the result is channel-major.
+        """
+        vis_in = self._array('vis_in')
+        permutation = self._array('permutation')
+        keep = permutation >= 0
+        dest = permutation[keep]
+        scale = np.float32(1.0 / self.n_accs)
+        vis = np.zeros((self.channels, self.baselines), np.complex64)
+        src = vis_in[:, keep, :].astype(np.float32)
+        src *= scale
+        vis.real[:, dest] = src[..., 0]
+        vis.imag[:, dest] = src[..., 1]
+        return vis
+
+    def _prepare_flags(self, vis: np.ndarray) -> np.ndarray:
+        """Expand the channel masks per baseline and flag zero visibilities"""
+        idx = np.minimum(self._array('channel_mask_idx'), self.masks - 1)
+        flags = self._array('channel_mask').T[:, idx]    # Fancy indexing makes a copy
+        flags[vis == 0] |= np.uint8(CAM)
+        return flags
+
+    def _count_flags(self, flags: np.ndarray) -> None:
+        mask = np.uint8(0xff - self.template.unflagged_bit)
+        counted = flags[self.count_flags_channel_range.asslice()] & mask
+        counts = self._array('sd_flag_counts')
+        any_counts = self._array('sd_flag_any_counts')
+        any_counts += np.count_nonzero(counted, axis=0).astype(np.uint32)
+        for i in range(8):
+            counts[:, i] += np.count_nonzero(counted & np.uint8(1 << i), axis=0).astype(np.uint32)
+
+    def _accum(self, vis: np.ndarray, flags: np.ndarray) -> None:
+        rng = self.channel_range.asslice()
+        vis = vis[rng]
+        flags = flags[rng]
+        weight = np.float32(self.n_accs)
+        if self.template.excise:
+            flagged = flags != 0
+            weight = np.where(flagged, weight * np.float32(2**-64), weight)
+            flags = np.where(flagged, flags, np.uint8(self.template.unflagged_bit))
+        weighted = vis * weight
+        for prefix in ['spec', 'sd_spec']:
+            self._array(prefix + '_vis')[:] += weighted
+            self._array(prefix + '_weights_fp32')[:] += weight
+            self._array(prefix + '_flags')[:] |= flags
+
+    def _postproc(self, vis: np.ndarray, weights: np.ndarray, flags: np.ndarray) -> None:
+        """Normalise accumulated visibilities in-place, undoing the excision scaling."""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scale = np.reciprocal(weights)
+        if self.template.excise:
+            unflagged = (flags & np.uint8(self.template.unflagged_bit)) != 0
+            weights[~unflagged] *= np.float32(2**64)
+            flags[unflagged] = 0
+            # Flush tiny values to zero (see postproc.mako for an explanation)
+            parts = vis.view(np.float32).reshape(vis.shape + (2,))
+            parts[(np.abs(parts) < np.float32(2e-9)) & unflagged[..., np.newaxis]] = 0
+        with np.errstate(invalid='ignore'):
+            vis *= scale
+
+    @staticmethod
+    def _compress_weights(prefix: str, weights_in: np.ndarray,
+                          buffers: Mapping[str, HostBuffer]) -> None:
+        # Lower bound of 2^-96 avoids division by zero if all weights are zero
+        max_weight = np.fmax.reduce(weights_in, axis=1, initial=np.float32(2**-96))
+        weights_channel = max_weight.astype(np.float32) * np.float32(1.0 / 255.0)
+        scale = np.float32(1.0) / weights_channel
+        buffers[prefix + '_weights_channel'].array[:] = weights_channel
+        weights = weights_in * scale[:, np.newaxis] + np.float32(0.5)
+        buffers[prefix + '_weights'].array[:] = weights.astype(np.uint8)
+
+    def _finalise(self, prefix: str, cont_factor: Optional[int]) -> None:
+        """Finalise the spectral product named by `prefix` and optionally
+        produce a continuum product from it."""
+        spec = prefix + 'spec'
+        vis = self._array(spec + '_vis')
+        weights = self._array(spec + '_weights_fp32')
+        flags = self._array(spec + '_flags')
+        if cont_factor is not None:
+            # Continuum sums must be taken before the spectral values are normalised
+            cont = prefix + 'cont'
+            shape = (vis.shape[0] // cont_factor, cont_factor, vis.shape[1])
+            cont_vis = self._array(cont + '_vis')
+            cont_weights = self._array(cont + '_weights_fp32')
+            cont_flags = self._array(cont + '_flags')
+            np.sum(vis.reshape(shape), axis=1, out=cont_vis)
+            np.sum(weights.reshape(shape), axis=1, out=cont_weights)
+            np.bitwise_or.reduce(flags.reshape(shape), axis=1, out=cont_flags)
+            self._postproc(cont_vis, cont_weights, cont_flags)
+            self._compress_weights(cont, cont_weights, self._buffers)
+        self._postproc(vis, weights, flags)
+        self._compress_weights(spec, weights, self._buffers)
+
+    def _run(self) -> None:
+        vis = self._prepare()
+        flags_in = self._prepare_flags(vis)
+        if self.template.background_use_flags:
+            flags = self.flagger(vis, flags_in)
+        else:
+            flags = self.flagger(vis)
+        # merge_flags
+        flags |= flags_in
+        flags |= self._array('baseline_flags')[np.newaxis, :]
+        self._count_flags(flags)
+        self._accum(vis, flags)
+
+    def _zero(self, prefix: str) -> None:
+        for suffix in ['_vis', '_weights_fp32', '_flags']:
+            self._array(prefix + suffix).fill(0)
+
+    def _start_sum(self) -> None:
+        self._zero('spec')
+
+    def _end_sum(self) -> None:
+        self._finalise('', self.cont_factor if self.template.continuum else None)
+
+    def _start_sd_sum(self) -> None:
+        self._zero('sd_spec')
+        self._array('sd_flag_counts').fill(0)
+        self._array('sd_flag_any_counts').fill(0)
+
+    def _end_sd_sum(self) -> None:
+        self._finalise('sd_', self.sd_cont_factor)
+        sd_spec_vis = self._array('sd_spec_vis')
+        sd_spec_flags = self._array('sd_spec_flags')
+        mask = self._array('timeseries_weights')
+        self._array('timeseries')[:] = np.dot(mask, sd_spec_vis)
+        amplitudes = np.abs(sd_spec_vis)
+        self._array('timeseriesabs')[:] = np.dot(mask, amplitudes)
+        for i, (start, end) in enumerate(self.percentiles):
+            name = 'percentile{0}'.format(i)
+            if start == end:
+                self._array(name).fill(np.nan)
+                self._array(name + '_flags').fill(0)
+                continue
+            n = end - start
+            # Same ranks as katsdpsigproc.percentile.Percentile5
+            ranks = [0, n - 1, (n - 1) // 4, (n - 1) * 3 // 4, (n - 1) // 2]
+            part = np.partition(amplitudes[:, start:end], sorted(set(ranks)), axis=1)
+            self._array(name)[:] = part[:, ranks].T
+            np.bitwise_or.reduce(sd_spec_flags[:, start:end], axis=1,
+                                 out=self._array(name + '_flags'))
+
+    def __call__(self) -> None:
+        """Process a single input dump"""
+        self.command_queue.enqueue(self._run)
+
+    def start_sum(self, **kwargs: HostBuffer) -> None:
+        """Reset accumulation buffers for a new output dump"""
+        self.bind(**kwargs)
+        self.command_queue.enqueue(self._start_sum)
+
+    def end_sum(self) -> None:
+        """Perform postprocessing for an output dump."""
+        self.command_queue.enqueue(self._end_sum)
+
+    def start_sd_sum(self, **kwargs: HostBuffer) -> None:
+        """Reset accumulation buffers for a new signal display dump"""
+        self.bind(**kwargs)
+        self.command_queue.enqueue(self._start_sd_sum)
+
+    def end_sd_sum(self) -> None:
+        """Perform postprocessing for a signal display dump."""
+        self.command_queue.enqueue(self._end_sd_sum)
+
+    def parameters(self) -> Mapping[str, Any]:
+        return {
+            'channels': self.channels,
+            'channel_range': self.channel_range.astuple(),
+            'count_flags_channel_range': self.count_flags_channel_range.astuple(),
+            'cbf_baselines': self.cbf_baselines,
+            'baselines': self.baselines,
+            'masks': self.masks,
+            'excise': self.template.excise,
+            'continuum': self.template.continuum,
+            'cont_factor': self.cont_factor,
+            'sd_cont_factor': self.sd_cont_factor,
+            'percentile_ranges': self.percentiles,
+            'unflagged_bit': self.template.unflagged_bit,
+            'n_accs': self.n_accs
+        }
+
+    def descriptions(self) -> List[Tuple[str, Mapping[str, Any]]]:
+        """Generate descriptions of all the components.
+
+        This has the same format as
+        :meth:`katsdpingest.sigproc.IngestOperation.descriptions`.
+        """
+        def describe(obj: Any, params: Mapping[str, Any]) -> Dict[str, Any]:
+            ans = dict(params)
+            ans['class'] = obj.__class__.__module__ + '.' + obj.__class__.__name__
+            return ans
+
+        return [
+            ('ingest', describe(self, self.parameters())),
+            ('ingest:flagger:background', describe(
+                self.flagger.background,
+                dict(self._background_args, width=self.template.background_width,
+                     use_flags=self.template.background_use_flags))),
+            ('ingest:flagger:noise_est', describe(self.flagger.noise_est,
+                                                  self._noise_est_args)),
+            ('ingest:flagger:threshold', describe(
+                self.flagger.threshold,
+                dict(self._threshold_args, flag_value=self.template.flag_value)))
+        ]
+
+
+# Layout of a shared memory file: name -> (offset, shape, dtype)
+_Layout = Dict[str, Tuple[int, Tuple[int, ...], str]]
+# Per-shard view of a shared array: slot name -> (array name, index)
+_Views = Dict[str, Tuple[str, Tuple[slice, ...]]]
+# Operations for each shard, in a worker process
+_worker_ops: List[IngestOperationHost] = []
+
+
+def _map_arrays(path: str, layout: _Layout) -> Dict[str, np.ndarray]:
+    raw = np.memmap(path, np.uint8, 'r+')
+    arrays = {}
+    for name, (offset, shape, dtype) in layout.items():
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        arrays[name] = raw[offset : offset + nbytes].view(dtype).reshape(shape)
+    return arrays
+
+
+def _worker_init(path: str, layout: _Layout, template_kwargs: Mapping[str, Any],
+                 shards: List[Tuple[tuple, Mapping[str, Any], _Views]]) -> None:
+    arrays = _map_arrays(path, layout)
+    template = IngestTemplateHost(HostContext(), **template_kwargs)
+    for args, kwargs, views in shards:
+        op = IngestOperationHost(template, None, *args, **kwargs)
+        buffers = {}
+        for slot, (name, index) in views.items():
+            view = arrays[name][index]
+            buffers[slot] = HostBuffer(view.shape, view.dtype, array=view)
+        op.bind(**buffers)
+        _worker_ops.append(op)
+
+
+def _worker_call(shard: int, method: str, n_accs: int) -> None:
+    op = _worker_ops[shard]
+    op.n_accs = n_accs
+    getattr(op, method)()
+
+
+def _shutdown_shards(pool: concurrent.futures.Executor, path: str) -> None:
+    pool.shutdown()
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+class ShardedIngestOperationHost(IngestOperationHost):
+    """Variant of :class:`IngestOperationHost` that splits the channels
+    across worker processes.
+
+    The input channels are divided into contiguous shards, aligned so that
+    no continuum channel spans two shards, and each worker process runs a
+    :class:`IngestOperationHost` for a shard. All slots live in a single
+    shared-memory file which the workers map, so no data is copied between
+    processes. Each shard is extended on either side by half the width of the
+    background median filter, so that backgrounding is identical to the
+    unsharded case. The noise estimate is computed per shard (just as it is
+    computed per server when the band is split over multiple servers), so the
+    flags may differ slightly from :class:`IngestOperationHost`.
+
+    The timeseries and flag counts are reduced across shards by
+    :meth:`end_sd_sum`, so the ``sd_flag_counts`` and ``sd_flag_any_counts``
+    slots are only valid after it. Slots cannot be rebound.
+
+    The parameters are the same as for :class:`IngestOperationHost`. The
+    number of worker processes is taken from the context of the template,
+    but is reduced if there are too few channels to split.
+
+    Attributes
+    ----------
+    shards : list of :class:`katsdpingest.utils.Range`
+        Range of input channels handled by each shard
+    """
+
+    def __init__(self, template: IngestTemplateHost,
+                 command_queue: HostCommandQueue,
+                 channels: int, channel_range: Range, count_flags_channel_range: Range,
+                 cbf_baselines: int, baselines: int, masks: int,
+                 cont_factor: int, sd_cont_factor: int,
+                 percentile_ranges: Iterable[Tuple[int, int]],
+                 background_args: Mapping[str, Any] = {},
+                 noise_est_args: Mapping[str, Any] = {},
+                 threshold_args: Mapping[str, Any] = {}) -> None:
+        super().__init__(template, command_queue, channels,
+                         channel_range, count_flags_channel_range,
+                         cbf_baselines, baselines, masks,
+                         cont_factor, sd_cont_factor, percentile_ranges,
+                         background_args, noise_est_args, threshold_args)
+        align = self.cont_factor * sd_cont_factor // math.gcd(self.cont_factor, sd_cont_factor)
+        units = len(channel_range) // align
+        n_shards = max(1, min(template.context.processes, units))
+        bounds = [0]
+        for i in range(1, n_shards):
+            bounds.append(channel_range.start + units * i // n_shards * align)
+        bounds.append(channels)
+        self.shards = [Range(bounds[i], bounds[i + 1]) for i in range(n_shards)]
+
+        # Lay out all the arrays in one shared-memory file
+        shapes = dict(self._shapes)
+        reduced = ['timeseries', 'timeseriesabs', 'sd_flag_counts', 'sd_flag_any_counts']
+        for name in reduced:
+            shape, dtype = shapes[name]
+            shapes['shard:' + name] = ((n_shards,) + shape, dtype)
+        layout: _Layout = {}
+        size = 0
+        for name, (shape, dtype) in shapes.items():
+            layout[name] = (size, shape, np.dtype(dtype).str)
+            nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            size += (nbytes + 63) // 64 * 64    # Keep everything cache-line aligned
+        shm_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+        fd, path = tempfile.mkstemp(prefix='katsdpingest-', dir=shm_dir)
+        try:
+            os.ftruncate(fd, max(size, 1))
+        finally:
+            os.close(fd)
+        self._arrays = _map_arrays(path, layout)
+        for name, (shape, dtype) in self._shapes.items():
+            self._buffers[name] = HostBuffer(shape, dtype, array=self._arrays[name])
+
+        template_kwargs = {
+            'excise': template.excise,
+            'continuum': template.continuum,
+            'background_width': template.background_width,
+            'background_use_flags': template.background_use_flags,
+            'flag_value': template.flag_value
+        }
+        kwargs = {
+            'background_args': dict(background_args),
+            'noise_est_args': dict(noise_est_args),
+            'threshold_args': dict(threshold_args)
+        }
+        overlap = template.background_width // 2
+        shard_args = []
+        for i, core in enumerate(self.shards):
+            ext = Range(max(core.start - overlap, 0), min(core.stop + overlap, channels))
+            kept = channel_range.intersection(core)
+            kept_rel = kept.relative_to(channel_range)
+            count_range = count_flags_channel_range.intersection(core)
+            count_range = count_range.relative_to(ext) if count_range else Range(0, 0)
+            args = (len(ext), kept.relative_to(ext), count_range,
+                    cbf_baselines, baselines, masks, cont_factor, sd_cont_factor,
+                    self.percentiles)
+            everything = slice(None)
+            views: _Views = {
+                'vis_in': ('vis_in', (ext.asslice(),)),
+                'channel_mask': ('channel_mask', (everything, ext.asslice())),
+                'channel_mask_idx': ('channel_mask_idx', ()),
+                'baseline_flags': ('baseline_flags', ()),
+                'permutation': ('permutation', ()),
+                'timeseries_weights': ('timeseries_weights', (kept_rel.asslice(),))
+            }
+            for name in reduced:
+                views[name] = ('shard:' + name, (i,))
+            for name, (shape, dtype) in self._shapes.items():
+                if name.startswith('percentile'):
+                    if name.endswith('_flags'):
+                        views[name] = (name, (kept_rel.asslice(),))
+                    else:
+                        views[name] = (name, (everything, kept_rel.asslice()))
+                elif name not in views:
+                    # Channel-major output product
+                    factor = len(channel_range) // shape[0]
+                    views[name] = (name, (slice(kept_rel.start // factor,
+                                                kept_rel.stop // factor),))
+            shard_args.append((args, kwargs, views))
+
+        self._pool = concurrent.futures.ProcessPoolExecutor(
+            n_shards,
+            # Avoid forking a process that may be running other threads
+            mp_context=multiprocessing.get_context('forkserver'),
+            initializer=_worker_init,
+            initargs=(path, layout, template_kwargs, shard_args))
+        self._finalizer = weakref.finalize(self, _shutdown_shards, self._pool, path)
+
+    def bind(self, **kwargs: HostBuffer) -> None:
+        """Bind buffers to slots by keyword.
+
+        Raises
+        ------
+        ValueError
+            if any buffers are given, since the slots must live in shared memory
+        """
+        if kwargs:
+            raise ValueError('Slots of a sharded operation cannot be rebound')
+
+    def close(self) -> None:
+        """Shut down the worker processes and release the shared memory.
+
+        This also happens automatically when the object is garbage-collected.
+        """
+        self._finalizer()
+
+    def _dispatch(self, method: str) -> None:
+        """Call a method on every shard and wait for them all to complete."""
+        futures = [self._pool.submit(_worker_call, i, method, self.n_accs)
+                   for i in range(len(self.shards))]
+        concurrent.futures.wait(futures)
+        for future in futures:
+            future.result()
+
+    def _run(self) -> None:
+        self._dispatch('_run')
+
+    def _start_sum(self) -> None:
+        self._dispatch('_start_sum')
+
+    def _end_sum(self) -> None:
+        self._dispatch('_end_sum')
+
+    def _start_sd_sum(self) -> None:
+        self._dispatch('_start_sd_sum')
+
+    def _end_sd_sum(self) -> None:
+        self._dispatch('_end_sd_sum')
+        for name in ['timeseries', 'timeseriesabs', 'sd_flag_counts', 'sd_flag_any_counts']:
+            np.sum(self._arrays['shard:' + name], axis=0, out=self._arrays[name])
+
+    def parameters(self) -> Mapping[str, Any]:
+        ans = dict(super().parameters())
+        ans['shards'] = [shard.astuple() for shard in self.shards]
+        return ans
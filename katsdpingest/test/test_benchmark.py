@@ -0,0 +1,25 @@
+"""Tests for :mod:`katsdpingest.benchmark`."""
+
+import asynctest
+from nose.tools import assert_equal, assert_greater, assert_in
+
+from katsdpingest import benchmark
+
+
+class TestRunBenchmark(asynctest.TestCase):
+    async def test_cpu(self):
+        config = benchmark.BenchmarkConfig(2, 1024, continuum_factor=16, dumps=4,
+                                           output_int_time=2, sd_int_time=2, n_xengs=4,
+                                           cpu=True)
+        results = await benchmark.run_benchmark(config)
+        assert_equal(results['dumps'], 4)
+        assert_greater(results['dumps_per_second'], 0)
+        # 2 spectral + 2 continuum + 2 signal display dumps, plus start and stop heaps
+        assert_greater(results['sink_heaps'], 6)
+        assert_greater(results['output_bytes'], 0)
+        for stage in ['frame_job', 'flush_output_job', 'flush_sd_job']:
+            assert_in(stage, results['latency'])
+        assert_equal(results['latency']['frame_job']['count'], 4)
+        assert_equal(results['latency']['flush_output_job']['count'], 2)
+        table = benchmark.format_results([results])
+        assert_equal(len(table.splitlines()), 2)
@@ -0,0 +1,83 @@
+"""Tests for cbf_generator module"""
+
+import collections
+from unittest import mock
+
+import numpy as np
+import spead2
+import spead2.recv.asyncio
+import asynctest
+import async_timeout
+import katsdptelstate.endpoint
+from katsdptelstate.endpoint import Endpoint
+from nose.tools import assert_equal, assert_raises
+
+from katsdpingest import cbf_generator
+from katsdpingest.receiver import Receiver
+from katsdpingest.utils import Range
+
+
+class TestMakeCbfAttr:
+    def test_simple(self):
+        cbf_attr = cbf_generator.make_cbf_attr(3, 4096, 16, 0.5)
+        assert_equal(cbf_attr['n_chans_per_substream'], 256)
+        assert_equal(len(cbf_attr['bls_ordering']), 3 * 4 * 4 // 2)
+        assert_equal(len(cbf_attr['input_labels']), 6)
+        np.testing.assert_allclose(cbf_attr['int_time'], 0.5, rtol=1e-4)
+        assert_equal(cbf_generator.heap_shape(cbf_attr), (256, 24, 2))
+        assert_equal(cbf_generator.dump_size(cbf_attr), 4096 * 24 * 8)
+
+    def test_bad_xengs(self):
+        with assert_raises(ValueError):
+            cbf_generator.make_cbf_attr(3, 4096, 12)
+
+
+class TestCBFGenerator(asynctest.TestCase):
+    def setUp(self):
+        self.n_endpoints = 2
+        self.endpoints = katsdptelstate.endpoint.endpoint_list_parser(7148)(
+            '239.0.0.1+{}'.format(self.n_endpoints - 1))
+        self.queues = {endpoint: spead2.InprocQueue() for endpoint in self.endpoints}
+        for queue in self.queues.values():
+            self.addCleanup(queue.stop)
+
+        def add_udp_reader(rx, multicast_group, port, *args, **kwargs):
+            rx.add_inproc_reader(self.queues[Endpoint(multicast_group, port)])
+
+        patcher = mock.patch.object(
+            spead2.recv.asyncio.Stream, 'add_udp_reader', add_udp_reader)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.cbf_attr = cbf_generator.make_cbf_attr(2, 1024, 4, 0.5)
+        config = cbf_generator.make_stream_config(self.cbf_attr, speedup=0)
+        stream = cbf_generator.make_inproc_stream(
+            spead2.ThreadPool(), [self.queues[endpoint] for endpoint in self.endpoints], config)
+        shape = cbf_generator.heap_shape(self.cbf_attr)
+        self.data = np.random.randint(-1000, 1000, size=(4,) + shape).astype('>i4')
+        self.generator = cbf_generator.CBFGenerator(
+            stream, self.cbf_attr, self.data, first_timestamp=1234567 * self.cbf_attr['n_accs'])
+
+    async def test_receive(self):
+        """Heaps must be accepted by :class:`.Receiver`"""
+        self.rx = Receiver(self.endpoints, '127.0.0.1', False, self.n_endpoints, 9200,
+                           32 * 1024**2, Range(0, 1024), 1024,
+                           collections.defaultdict(mock.MagicMock),
+                           self.cbf_attr, active_frames=2)
+        await self.generator.run(3, speedup=0)
+        await self.generator.stop()
+        for i in range(3):
+            with async_timeout.timeout(5):
+                frame = await self.rx.get()
+            assert_equal(frame.idx, i)
+            assert_equal(frame.timestamp, self.generator.timestamp(i))
+            assert_equal(len(frame.items), 4)
+            for j in range(4):
+                np.testing.assert_equal(frame.items[j], self.data[j])
+        with assert_raises(spead2.Stopped):
+            with async_timeout.timeout(5):
+                await self.rx.get()
+
+    def test_bad_data(self):
+        with assert_raises(ValueError):
+            cbf_generator.CBFGenerator(self.generator._stream, self.cbf_attr, self.data[:, :1])
@@ -88,7 +88,7 @@ class MockReceiver:
         for i in range(self._substreams):
             start = self._channel_range.start + i * item_channels
             stop = start + item_channels
-            frame.items[i] = self._data[self._next_frame, start:stop, ...]
+            frame.add_item(i, self._data[self._next_frame, start:stop, ...])
         self._next_frame += 1
         return frame
 
@@ -132,7 +132,8 @@ class TestIngestDeviceServer(asynctest.TestCase):
         return mock_obj
 
     def _get_tx(self, thread_pool, endpoints, interface_address, flavour,
-                int_time, channel_range, channel0, all_channels, baselines):
+                int_time, channel_range, channel0, all_channels, baselines,
+                batched=False, pacer=None):
         if endpoints == self.user_args.l0_spectral_spead[1:2]:
             return self._tx['spectral']
         elif endpoints == self.user_args.l0_continuum_spead[1:2]:
@@ -144,6 +145,7 @@ class TestIngestDeviceServer(asynctest.TestCase):
         assert_equal(len(endpoints), 1)
         tx = spead2.send.asyncio.InprocStream(thread_pool, [spead2.InprocQueue()])
         self._sd_tx[Endpoint(*endpoints[0])] = tx
+        self._sd_config[Endpoint(*endpoints[0])] = config
         return tx
 
     def _create_data(self):
@@ -214,6 +216,7 @@ class TestIngestDeviceServer(asynctest.TestCase):
             l0_continuum_interface='dummyif3',
             l0_continuum_name='sdp_l0_continuum',
             output_int_time=4.0,
+            output_batch=False,
             sd_int_time=4.0,
             antenna_mask=['m090', 'm091', 'm093'],
             output_channels=Range(464, 1744),
@@ -224,7 +227,19 @@ class TestIngestDeviceServer(asynctest.TestCase):
             input_streams=2,
             input_max_packet_size=9200,
             input_buffer=32*1024**2,
+            input_zero_copy=False,
+            input_threads=False,
+            input_max_active_frames=None,
+            input_queue_frames=1,
+            input_overflow='block',
+            input_affinity=None,
+            output_affinity=None,
+            sd_affinity=None,
+            numa_local=False,
+            cbf_replay=[],
+            cbf_replay_speedup=0.0,
             sd_spead_rate=1000000000.0,
+            sd_descriptor_interval=1,
             excise=False,
             use_data_suspect=True,
             servers=4,
@@ -286,6 +301,7 @@ class TestIngestDeviceServer(asynctest.TestCase):
         self._VisSenderSet = self._patch(
             'katsdpingest.sender.VisSenderSet', side_effect=self._get_tx)
         self._sd_tx: Dict[Endpoint, spead2.send.asyncio.InprocStream] = {}
+        self._sd_config: Dict[Endpoint, spead2.send.StreamConfig] = {}
         self._UdpStream = self._patch('spead2.send.asyncio.UdpStream',
                                       side_effect=self._get_sd_tx)
         self._patch('katsdpservices.get_interface_address',
@@ -441,7 +457,8 @@ class TestIngestDeviceServer(asynctest.TestCase):
         send_range = Range(16, 336)
         self._VisSenderSet.assert_any_call(
             mock.ANY, self.user_args.l0_spectral_spead[1:2], '127.0.0.2',
-            l0_flavour, l0_int_time, send_range, 320, 1280, 24)
+            l0_flavour, l0_int_time, send_range, 320, 1280, 24, batched=False,
+            pacer=mock.ANY)
         self._check_output(self._tx['spectral'], expected_output_vis, expected_output_flags,
                            expected_ts, send_range.asslice())
         self._tx['spectral'].stop.assert_called_once_with()
@@ -449,7 +466,8 @@ class TestIngestDeviceServer(asynctest.TestCase):
         send_range = Range(1, 21)
         self._VisSenderSet.assert_any_call(
             mock.ANY, self.user_args.l0_continuum_spead[1:2], '127.0.0.3',
-            l0_flavour, l0_int_time, send_range, 20, 80, 24)
+            l0_flavour, l0_int_time, send_range, 20, 80, 24, batched=False,
+            pacer=mock.ANY)
         self._check_output(
             self._tx['continuum'],
             self._channel_average(expected_output_vis, self.user_args.continuum_factor),
@@ -515,6 +533,36 @@ class TestIngestDeviceServer(asynctest.TestCase):
         for tx in self._sd_tx.values():
             assert_equal(5, len(get_heaps(tx)))
 
+    async def test_add_sdisp_ip_mode(self):
+        """Add an address with a reduced signal display mode."""
+        await self.make_request('add-sdisp-ip', '127.0.0.3:8000', 'int16,delta')
+        await self.assert_request_fails('Unknown signal display mode',
+                                        'add-sdisp-ip', '127.0.0.4', 'int8')
+        await self.make_request('capture-init', 'cb1')
+        await self.make_request('capture-done')
+        assert_equal({Endpoint('127.0.0.2', 7149), Endpoint('127.0.0.3', 8000)},
+                     self._sd_tx.keys())
+        heaps = get_heaps(self._sd_tx[Endpoint('127.0.0.3', 8000)])
+        assert_equal(5, len(heaps))
+        ig = spead2.ItemGroup()
+        for heap in heaps:
+            ig.update(heap)
+        assert_in('sd_blmxdata_scale', ig)
+        assert_in('sd_blmxdata_blocks', ig)
+
+    async def test_add_sdisp_ip_subsample(self):
+        """Add an address with its own rate and subsampling."""
+        await self.make_request('add-sdisp-ip', '127.0.0.3:8000', 'float32', 8e6, 2)
+        await self.assert_request_fails('subsample', 'add-sdisp-ip', '127.0.0.4', 'float32', 0, 0)
+        await self.assert_request_fails('rate', 'add-sdisp-ip', '127.0.0.4', 'float32', -1)
+        await self.make_request('capture-init', 'cb1')
+        await self.make_request('capture-done')
+        endpoint = Endpoint('127.0.0.3', 8000)
+        assert_equal(1e6, self._sd_config[endpoint].rate)
+        # Start and stop heaps, plus every second of the 3 signal display dumps
+        assert_equal(4, len(get_heaps(self._sd_tx[endpoint])))
+        assert_equal(5, len(get_heaps(self._sd_tx[Endpoint('127.0.0.2', 7149)])))
+
     async def test_drop_sdisp_ip_not_capturing(self):
         """Dropping a sdisp IP when not capturing sends no data at all."""
         await self.make_request('drop-sdisp-ip', '127.0.0.2')
@@ -213,7 +213,7 @@ class TestSensorHistory:
         assert_equal(self.sh.get(5.0), 'hello')
         assert_equal(self.sh.get(6.0), 'world')
         assert_equal(self.sh.get(7.0), 'world')
-        assert_equal(len(self.sh._data), 1, 'old data was not pruned')
+        assert_equal(len(self.sh), 1, 'old data was not pruned')
 
     def test_query_empty(self) -> None:
         assert_is_none(self.sh.get(4.0))
@@ -245,6 +245,62 @@ class TestSensorHistory:
         with assert_raises(ValueError):
             self.sh.get(4.0)
 
+    def test_many(self) -> None:
+        for i in range(100):
+            self.sh.add(float(i), i)
+        for i in range(0, 100, 7):
+            assert_equal(self.sh.get(i + 0.5), i)
+        assert_equal(len(self.sh), 100 - 98)
+
+
+class TestSensorHistoryGroup:
+    def setUp(self):
+        self.group = ingest_session.SensorHistoryGroup(['a', 'b', 'c'])
+
+    def test_simple(self) -> None:
+        self.group.add('a', 4.0, 'hello')
+        self.group.add('c', 5.0, 'world')
+        self.group.add('a', 6.0, 'goodbye')
+        values, updated = self.group.get(3.0)
+        assert_equal(list(values), [None, None, None])
+        np.testing.assert_equal(updated, [])
+        values, updated = self.group.get(5.0)
+        assert_equal(list(values), ['hello', None, 'world'])
+        np.testing.assert_equal(updated, [0, 2])
+        values, updated = self.group.get(5.5)
+        assert_equal(list(values), ['hello', None, 'world'])
+        np.testing.assert_equal(updated, [])
+        values, updated = self.group.get(6.0)
+        assert_equal(list(values), ['goodbye', None, 'world'])
+        np.testing.assert_equal(updated, [0])
+
+    def test_add_before_query(self) -> None:
+        self.group.get(5.0)
+        with assert_logs(ingest_session.logger, logging.WARNING):
+            self.group.add('b', 4.0, 'oops')
+        values, updated = self.group.get(5.0)
+        assert_equal(values[1], 'oops')
+        np.testing.assert_equal(updated, [1])
+
+    def test_add_out_of_order(self) -> None:
+        self.group.add('a', 5.0, 'first')
+        with assert_logs(ingest_session.logger, logging.WARNING):
+            self.group.add('a', 4.0, 'second')
+        self.group.add('b', 4.0, 'other')     # Other sensors are unaffected
+        values, updated = self.group.get(4.0)
+        assert_equal(list(values), [None, 'other', None])
+
+    def test_replace_latest(self) -> None:
+        self.group.add('a', 5.0, 'first')
+        self.group.add('a', 5.0, 'second')
+        values, updated = self.group.get(5.0)
+        assert_equal(values[0], 'second')
+
+    def test_query_out_of_order(self) -> None:
+        self.group.get(5.0)
+        with assert_raises(ValueError):
+            self.group.get(4.0)
+
 
 class TestCBFIngest:
     @device_test
@@ -1,7 +1,10 @@
 """Tests for receiver module"""
 
+import unittest
 from unittest import mock
 import asyncio
+import collections
+import gc
 from typing import Dict, Tuple     # noqa: F401
 
 import numpy as np
@@ -11,7 +14,7 @@ import spead2.recv.asyncio
 import asynctest
 import async_timeout
 
-from katsdpingest.receiver import Receiver
+from katsdpingest.receiver import Receiver, Frame, plan_layout
 from katsdpingest.sigproc import Range
 from katsdpingest.test.test_ingest_session import fake_cbf_attr
 import katsdptelstate.endpoint
@@ -19,25 +22,103 @@ from katsdptelstate.endpoint import Endpoint
 from nose.tools import assert_equal, assert_is_none, assert_raises
 
 
+class TestFrame:
+    def test_add_item(self):
+        frame = Frame(3, 12345, 4)
+        assert frame.empty()
+        assert not frame.ready()
+        assert_equal(0, frame.nbytes)
+        frame.add_item(2, np.zeros(10, np.int32))
+        frame.add_item(0, np.zeros(10, np.int32))
+        # Replacing an item must not count it twice
+        frame.add_item(2, np.zeros(5, np.int32))
+        assert not frame.empty()
+        assert not frame.ready()
+        assert_equal(2, frame.n_present)
+        assert_equal(60, frame.nbytes)
+        np.testing.assert_equal([True, False, True, False], frame.present)
+        frame.add_item(1, np.zeros(1, np.int32))
+        frame.add_item(3, np.zeros(1, np.int32))
+        assert frame.ready()
+        assert_equal(68, frame.nbytes)
+
+
+class TestPlanLayout(unittest.TestCase):
+    def setUp(self):
+        self.endpoints = katsdptelstate.endpoint.endpoint_list_parser(7148)('239.0.0.1+7')
+
+    def test_fixed(self):
+        layout = plan_layout(self.endpoints, 1024, 2**20, max_streams=3)
+        assert_equal([2, 3, 3], [len(group) for group in layout.endpoint_groups])
+        assert_equal(self.endpoints, sum(layout.endpoint_groups, []))
+        assert_equal([1, 1, 1], layout.threads)
+        assert_equal([[], [], []], layout.affinity)
+        assert_equal(2**20 // 3, layout.buffer_size)
+
+    def test_fixed_pinned(self):
+        """Explicit cores pin the threads of a fixed number of streams"""
+        layout = plan_layout(self.endpoints, 1024, 2**20, max_streams=2,
+                             cores=[4, 5, 6, 7], reserved_cores=0)
+        assert_equal([1, 1], layout.threads)
+        assert_equal([[4], [6]], layout.affinity)
+        # More streams than cores: cores are shared
+        layout = plan_layout(self.endpoints, 1024, 2**20, max_streams=4,
+                             cores=[4, 5], reserved_cores=0)
+        assert_equal([[4], [4], [5], [5]], layout.affinity)
+
+    def test_auto(self):
+        """A stream per spare core, pinned to that core"""
+        layout = plan_layout(self.endpoints, 1024, 2**20, cores=[0, 1, 2, 3, 4])
+        assert_equal([2, 2, 2, 2], [len(group) for group in layout.endpoint_groups])
+        assert_equal([1, 1, 1, 1], layout.threads)
+        assert_equal([[1], [2], [3], [4]], layout.affinity)
+        assert_equal(2**18, layout.buffer_size)
+
+    def test_auto_threads(self):
+        """Cores beyond one per endpoint become extra threads"""
+        layout = plan_layout(self.endpoints[:2], 1024, 2**20, cores=list(range(16)))
+        assert_equal([1, 1], [len(group) for group in layout.endpoint_groups])
+        assert_equal([[1], [8]], layout.affinity)
+        layout = plan_layout(self.endpoints, 10**6, 2**23, cores=list(range(4, 12)))
+        # Buffer only has space for enough heaps with 2 streams
+        assert_equal([4, 4], [len(group) for group in layout.endpoint_groups])
+        assert_equal([3, 4], layout.threads)
+        assert_equal([[5, 6, 7], [8, 9, 10, 11]], layout.affinity)
+
+    def test_auto_single_core(self):
+        layout = plan_layout(self.endpoints, 1024, 2**20, cores=[0])
+        assert_equal([self.endpoints], layout.endpoint_groups)
+        assert_equal([1], layout.threads)
+        assert_equal([[]], layout.affinity)
+
+
 class TestReceiver(asynctest.TestCase):
+    zero_copy = False
+    threaded = False
+    max_active_frames = None
+
     def setUp(self):
         self._streams = {}    # Dict[Endpoint, spead2.send.InprocStream]
 
         def add_udp_reader(rx, multicast_group, port, *args, **kwargs):
             endpoint = Endpoint(multicast_group, port)
             tx = self._streams[endpoint]
-            rx.add_inproc_reader(tx.queue)
+            rx.add_inproc_reader(tx.queues[0])
 
         patcher = mock.patch.object(
             spead2.recv.asyncio.Stream, 'add_udp_reader', add_udp_reader)
         patcher.start()
         self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(
+            spead2.recv.ChunkStreamGroupMember, 'add_udp_reader', add_udp_reader)
+        patcher.start()
+        self.addCleanup(patcher.stop)
 
         self.n_streams = 2
         endpoints = katsdptelstate.endpoint.endpoint_list_parser(7148)(
             '239.0.0.1+{}'.format(self.n_streams - 1))
         self.n_xengs = 4
-        sensors = mock.MagicMock()
+        self.sensors = collections.defaultdict(mock.MagicMock)
         self.cbf_attr = fake_cbf_attr(4, self.n_xengs)
         self.n_chans = self.cbf_attr['n_chans']
         self.n_bls = len(self.cbf_attr['bls_ordering'])
@@ -51,8 +132,13 @@ class TestReceiver(asynctest.TestCase):
             self.addCleanup(lambda: tx.queues[0].stop())
         self.rx = Receiver(endpoints, '127.0.0.1', False, self.n_streams, 9200, 32 * 1024**2,
                            Range(0, self.n_chans), self.n_chans,
-                           sensors, self.cbf_attr, active_frames=3)
-        self.tx_ig = [spead2.send.ItemGroup() for tx in self.tx]
+                           self.sensors, self.cbf_attr, active_frames=3,
+                           zero_copy=self.zero_copy, threaded=self.threaded,
+                           max_active_frames=self.max_active_frames)
+        # Matches the CBF, and ensures that the timestamp and frequency are
+        # immediate items (required for zero-copy mode).
+        flavour = spead2.Flavour(4, 64, 48, 0)
+        self.tx_ig = [spead2.send.ItemGroup(flavour=flavour) for tx in self.tx]
         for i, ig in enumerate(self.tx_ig):
             ig.add_item(0x1600, 'timestamp',
                         'Timestamp of start of this integration. '
@@ -201,3 +287,237 @@ class TestReceiver(asynctest.TestCase):
                     await self.rx.get()
         finally:
             await send_future
+
+    async def _check_overflow(self, overflow, expected, n_dropped=1):
+        self.rx.overflow = overflow
+        self.rx._frames_complete.max_frames = 2
+        n_frames = 6
+        xeng_raw, indices, timestamps = self._make_data(n_frames)
+        # Send everything before retrieving any frames, so that the queue overflows
+        await self._send_in_order(xeng_raw, timestamps)
+        await asyncio.sleep(0.1)
+        idx = []
+        with assert_raises(spead2.Stopped):
+            while True:
+                with async_timeout.timeout(3):
+                    idx.append((await self.rx.get()).idx)
+        assert_equal([indices[t] for t in expected], idx)
+        for policy in ['block', 'drop-oldest', 'drop-newest']:
+            value = self.sensors['input-frames-overflow-' + policy + '-total'].value
+            if policy != overflow:
+                assert_equal(0, value)
+            elif policy == 'block':
+                # Depends on how soon the receiver is woken up
+                assert value >= 1
+            else:
+                assert_equal(n_dropped, value)
+
+    async def test_overflow_block(self):
+        await self._check_overflow('block', [0, 1, 2, 3, 4, 5])
+
+    async def test_overflow_drop_oldest(self):
+        await self._check_overflow('drop-oldest', [1, 2, 3, 4, 5])
+
+    async def test_overflow_drop_newest(self):
+        await self._check_overflow('drop-newest', [0, 1, 3, 4, 5])
+
+    async def test_buffer_sensors(self):
+        """Sensors must show the buffers held by frames"""
+        n_frames = 3
+        xeng_raw, indices, timestamps = self._make_data(n_frames)
+        send_future = self.loop.create_task(self._send_in_order(xeng_raw, timestamps))
+        frames = []
+        for t in range(n_frames):
+            with async_timeout.timeout(3):
+                frames.append(await self.rx.get())
+        with assert_raises(spead2.Stopped):
+            with async_timeout.timeout(3):
+                await self.rx.get()
+        await send_future
+        for i in range(self.n_streams):
+            prefix = 'input-stream{}-'.format(i)
+            assert 0 < self.sensors[prefix + 'pool-occupancy'].value <= 1
+            assert 0 <= self.sensors[prefix + 'ring-occupancy'].value <= 1
+            assert_equal(0, self.sensors[prefix + 'evicted-heaps-total'].value)
+        assert_equal(0, self.sensors['input-frames-queued'].value)
+        if not self.zero_copy:
+            assert_equal(n_frames * self.n_xengs, sum(self.rx._pool_heaps))
+            del frames
+            gc.collect()
+            assert_equal([0] * self.n_streams, self.rx._pool_heaps)
+
+    async def test_fast_path(self):
+        """Data heaps must be decoded without updating the item group"""
+        n_frames = 3
+        xeng_raw, indices, timestamps = self._make_data(n_frames)
+        with mock.patch.object(self.rx._ig_cbf, 'update', wraps=self.rx._ig_cbf.update) as update:
+            send_future = self.loop.create_task(self._send_in_order(xeng_raw, timestamps))
+            for t in range(n_frames):
+                with async_timeout.timeout(3):
+                    frame = await self.rx.get()
+                for i in range(self.n_xengs):
+                    np.testing.assert_equal(xeng_raw[t, i], frame.items[i])
+            await send_future
+        # Only descriptor heaps may use the item group
+        for call in update.call_args_list:
+            assert call[0][0].get_descriptors()
+
+    async def test_fast_path_fallback(self):
+        """Heaps that don't match the descriptors must use the item group"""
+        n_frames = 2
+        xeng_raw, indices, timestamps = self._make_data(n_frames)
+        # Give the second X-engine of the last frame the wrong size
+        ig = self.tx_ig[0]
+        for t in range(n_frames):
+            for i in range(2):
+                ig['timestamp'].value = timestamps[t]
+                ig['frequency'].value = i * self.n_chans // self.n_xengs
+                ig['xeng_raw'].value = xeng_raw[t, i]
+                heap = ig.get_heap()
+                if (t, i) == (n_frames - 1, 1):
+                    heap = spead2.send.Heap(spead2.Flavour(4, 64, 48, 0))
+                    heap.add_item(ig['timestamp'])
+                    heap.add_item(ig['frequency'])
+                    bad = spead2.Item(ig['xeng_raw'].id, 'xeng_raw', '', (3,), np.dtype('>i4'))
+                    bad.value = np.zeros(3, np.dtype('>i4'))
+                    heap.add_item(bad)
+                self.tx[0].send_heap(heap)
+        for tx, tx_ig in zip(self.tx, self.tx_ig):
+            tx.send_heap(tx_ig.get_end())
+        with mock.patch.object(self.rx._ig_cbf, 'update', wraps=self.rx._ig_cbf.update) as update:
+            with async_timeout.timeout(3):
+                frame = await self.rx.get()
+            np.testing.assert_equal(xeng_raw[0, 1], frame.items[1])
+            with async_timeout.timeout(3):
+                frame = await self.rx.get()
+            assert_is_none(frame.items[1])
+            with assert_raises(spead2.Stopped):
+                with async_timeout.timeout(3):
+                    await self.rx.get()
+        # Apart from descriptor heaps, only the bad heap uses the item group
+        calls = [call for call in update.call_args_list if not call[0][0].get_descriptors()]
+        assert_equal(1, len(calls))
+
+
+class TestReceiverThreaded(TestReceiver):
+    threaded = True
+
+    async def test_zero_copy(self):
+        """Threaded mode cannot be combined with zero-copy mode"""
+        with assert_raises(ValueError):
+            Receiver(self.rx._endpoints, '127.0.0.1', False, self.n_streams, 9200,
+                     32 * 1024**2, Range(0, self.n_chans), self.n_chans,
+                     mock.MagicMock(), self.cbf_attr, zero_copy=True, threaded=True)
+        # The receive threads must be shut down before the event loop goes away
+        self.rx.stop()
+        with async_timeout.timeout(30):
+            await self.rx.join()
+
+
+class TestReceiverAdaptive(TestReceiver):
+    max_active_frames = 6
+
+    async def _send(self, xeng_raw, timestamps, order):
+        for (t, i) in order:
+            stream_idx = i * self.n_streams // self.n_xengs
+            self.tx_ig[stream_idx]['timestamp'].value = timestamps[t]
+            self.tx_ig[stream_idx]['frequency'].value = i * self.n_chans // self.n_xengs
+            self.tx_ig[stream_idx]['xeng_raw'].value = xeng_raw[t, i]
+            self.tx[stream_idx].send_heap(self.tx_ig[stream_idx].get_heap())
+        # Give the receiver time to process the heaps
+        await asyncio.sleep(0.1)
+
+    async def _collect(self):
+        frames = []
+        try:
+            while True:
+                frames.append(await self.rx.get())
+        except spead2.Stopped:
+            return frames
+
+    @mock.patch('katsdpingest.receiver._ADAPT_FRAMES', 4)
+    async def test_adaptive(self):
+        """The window must grow for late heaps and shrink again once they stop"""
+        n_frames = 60
+        xeng_raw, indices, timestamps = self._make_data(n_frames)
+        collect_future = self.loop.create_task(self._collect())
+        # X-engines 0 and 1 are both on the first stream, so ordering is preserved
+        await self._send(xeng_raw, timestamps, [(0, 0), (1, 0), (6, 0)])
+        assert_equal(3, self.rx.active_frames)
+        # Frame 2 has already been flushed, so this is too late by 4 frames
+        await self._send(xeng_raw, timestamps, [(2, 1)])
+        assert_equal(5, self.rx.active_frames)
+        # A heap 4 frames late is now accepted
+        await self._send(xeng_raw, timestamps, [(10, 0), (6, 1)])
+        assert_equal(5, self.rx.active_frames)
+        # Once heaps arrive in order the window gradually returns to the minimum
+        await self._send(xeng_raw, timestamps,
+                         [(t, i) for t in range(11, 40) for i in range(2)])
+        assert_equal(3, self.rx.active_frames)
+        # The window never exceeds the maximum
+        await self._send(xeng_raw, timestamps, [(59, 0), (40, 0)])
+        assert_equal(6, self.rx.active_frames)
+        for i in range(self.n_streams):
+            self.tx[i].send_heap(self.tx_ig[i].get_end())
+        with async_timeout.timeout(3):
+            frames = await collect_future
+        idx = [frame.idx for frame in frames]
+        assert_equal(sorted(idx), idx)
+        frame6 = frames[idx.index(indices[6])]
+        np.testing.assert_equal(xeng_raw[6, 0], frame6.items[0])
+        np.testing.assert_equal(xeng_raw[6, 1], frame6.items[1])
+        # Frame 2 only received a heap after it was flushed
+        assert indices[2] not in idx
+
+    async def test_bad_max_active_frames(self):
+        with assert_raises(ValueError):
+            Receiver(self.rx._endpoints, '127.0.0.1', False, self.n_streams, 9200,
+                     32 * 1024**2, Range(0, self.n_chans), self.n_chans,
+                     mock.MagicMock(), self.cbf_attr, active_frames=3, max_active_frames=2)
+        self.rx.stop()
+        with async_timeout.timeout(30):
+            await self.rx.join()
+
+
+class TestReceiverZeroCopy(TestReceiver):
+    zero_copy = True
+
+    async def test_fast_path(self):
+        pass        # Zero-copy mode does not decode heaps
+
+    async def test_fast_path_fallback(self):
+        pass
+
+    # The frames still in the window when the streams stop are also passed
+    # through the queue.
+    async def test_overflow_drop_oldest(self):
+        await self._check_overflow('drop-oldest', [4, 5], 4)
+
+    async def test_overflow_drop_newest(self):
+        await self._check_overflow('drop-newest', [0, 1], 4)
+
+    async def test_missing(self):
+        """Missing heaps must be zero-filled in :attr:`.Frame.data`"""
+        n_frames = 3
+        xeng_raw, indices, timestamps = self._make_data(n_frames)
+        xeng_raw[1, 2] = 0
+        order = [(t, i) for t in range(n_frames) for i in range(self.n_xengs) if (t, i) != (1, 2)]
+        for (t, i) in order:
+            stream_idx = i * self.n_streams // self.n_xengs
+            self.tx_ig[stream_idx]['timestamp'].value = timestamps[t]
+            self.tx_ig[stream_idx]['frequency'].value = i * self.n_chans // self.n_xengs
+            self.tx_ig[stream_idx]['xeng_raw'].value = xeng_raw[t, i]
+            self.tx[stream_idx].send_heap(self.tx_ig[stream_idx].get_heap())
+        for i in range(self.n_streams):
+            self.tx[i].send_heap(self.tx_ig[i].get_end())
+        for t in range(n_frames):
+            with async_timeout.timeout(3):
+                frame = await self.rx.get()
+            assert_equal(indices[t], frame.idx)
+            if t == 1:
+                assert_is_none(frame.items[2])
+            expected = xeng_raw[t].reshape(self.n_chans, self.n_bls, 2)
+            np.testing.assert_equal(expected, frame.data)
+        with assert_raises(spead2.Stopped):
+            with async_timeout.timeout(3):
+                await self.rx.get()
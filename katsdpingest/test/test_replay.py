@@ -0,0 +1,258 @@
+"""Tests for replay module"""
+
+import collections
+import io
+import os
+import socket
+import struct
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import spead2
+import spead2.send
+import asynctest
+import async_timeout
+import katsdptelstate.endpoint
+from katsdptelstate.endpoint import Endpoint
+from nose.tools import assert_equal, assert_raises
+
+from katsdpingest import cbf_generator, replay
+from katsdpingest.utils import Range
+
+
+def _make_heaps(cbf_attr, data, timestamps):
+    """Encode CBF heaps as SPEAD packets.
+
+    Returns
+    -------
+    list of list of bytes
+        Packets for each heap, with a descriptor heap first
+    """
+    heap_channels = cbf_attr['n_chans_per_substream']
+    ig = spead2.send.ItemGroup(flavour=cbf_generator.FLAVOUR)
+    ig.add_item(0x1600, 'timestamp', 'Timestamp', (), format=[('u', 48)])
+    ig.add_item(0x4103, 'frequency', 'First channel', (), format=[('u', 48)])
+    ig.add_item(0x1800, 'xeng_raw', 'Visibilities', data.shape[2:], data.dtype)
+    heaps = [ig.get_heap(descriptors='all', data='none')]
+    for timestamp, dump in zip(timestamps, data):
+        for i, xeng in enumerate(dump):
+            ig['timestamp'].value = timestamp
+            ig['frequency'].value = i * heap_channels
+            ig['xeng_raw'].value = xeng
+            heaps.append(ig.get_heap(descriptors='none', data='all'))
+    packets = []
+    for heap in heaps:
+        stream = spead2.send.BytesStream(spead2.ThreadPool(), spead2.send.StreamConfig())
+        stream.send_heap(heap)
+        packets.append([bytes(packet) for packet in replay.split_packets(stream.getvalue())])
+    return packets
+
+
+def _make_pcap(packets):
+    """Wrap UDP payloads in a pcap file.
+
+    Parameters
+    ----------
+    packets : list of (float, Endpoint, bytes)
+        Arrival time, destination and UDP payload of each packet
+    """
+    out = io.BytesIO()
+    out.write(struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, 1))
+    for timestamp, endpoint, payload in packets:
+        udp = struct.pack('>HHHH', 7000, endpoint.port, 8 + len(payload), 0) + payload
+        ip = struct.pack('>BBHHHBBH4s4s', 0x45, 0, 20 + len(udp), 0, 0x4000, 1, 17, 0,
+                         socket.inet_aton('10.0.0.1'), socket.inet_aton(endpoint.host))
+        frame = b'\x01' * 6 + b'\x02' * 6 + b'\x08\x00' + ip + udp
+        sec = int(timestamp)
+        out.write(struct.pack('<IIII', sec, int((timestamp - sec) * 1e6),
+                              len(frame), len(frame)))
+        out.write(frame)
+    return out.getvalue()
+
+
+class TestSplitPackets:
+    def test_split(self):
+        stream = spead2.send.BytesStream(
+            spead2.ThreadPool(), spead2.send.StreamConfig(max_packet_size=1024))
+        ig = spead2.send.ItemGroup(flavour=cbf_generator.FLAVOUR)
+        ig.add_item(0x1800, 'xeng_raw', 'Visibilities', (1000,), np.uint8,
+                    value=np.arange(1000) % 256)
+        stream.send_heap(ig.get_heap())
+        data = stream.getvalue()
+        packets = list(replay.split_packets(data))
+        assert_equal(2, len(packets))
+        assert_equal(data, b''.join(bytes(packet) for packet in packets))
+        for packet in packets:
+            assert_equal(b'\x53\x04', bytes(packet[:2]))
+
+    def test_bad(self):
+        with assert_raises(ValueError):
+            list(replay.split_packets(b'\x00' * 16))
+
+
+class TestReadCapture(unittest.TestCase):
+    def setUp(self):
+        self.packets = [
+            (1234567890.5, Endpoint('239.0.0.1', 7148), b'\x53\x04' + b'x' * 13),
+            (1234567890.75, Endpoint('239.0.0.2', 7149), b'\x53\x04' + b'y' * 8)
+        ]
+
+    def _check(self, data):
+        actual = [(timestamp, endpoint, bytes(payload))
+                  for timestamp, endpoint, payload in replay.read_capture(data)]
+        assert_equal(len(self.packets), len(actual))
+        for expected, packet in zip(self.packets, actual):
+            assert_equal(expected[1:], packet[1:])
+            np.testing.assert_allclose(expected[0], packet[0], atol=1e-6)
+
+    def test_native(self):
+        out = io.BytesIO()
+        with replay.CaptureWriter(out) as writer:
+            for timestamp, endpoint, payload in self.packets:
+                writer.write(payload, endpoint, timestamp)
+        self._check(out.getvalue())
+
+    def test_pcap(self):
+        self._check(_make_pcap(self.packets))
+
+    def test_unknown(self):
+        with assert_raises(ValueError):
+            replay.read_capture(b'not a capture file')
+
+
+class TestReplayReceiver(asynctest.TestCase):
+    zero_copy = False
+
+    def setUp(self):
+        self.n_endpoints = 2
+        self.endpoints = katsdptelstate.endpoint.endpoint_list_parser(7148)(
+            '239.0.0.1+{}'.format(self.n_endpoints - 1))
+        self.cbf_attr = cbf_generator.make_cbf_attr(2, 1024, 4, 0.5)
+        self.n_frames = 5
+        shape = cbf_generator.heap_shape(self.cbf_attr)
+        self.data = np.random.randint(
+            -1000, 1000, size=(self.n_frames, 4) + shape).astype('>i4')
+        interval = self.cbf_attr['ticks_between_spectra'] * self.cbf_attr['n_accs']
+        self.timestamps = [1234 * interval + i * interval for i in range(self.n_frames)]
+        heaps = _make_heaps(self.cbf_attr, self.data, self.timestamps)
+        # Each endpoint gets a copy of the descriptors and half the X-engines
+        records = []
+        t = 1000.0
+        for endpoint in self.endpoints:
+            for packet in heaps[0]:
+                records.append((t, endpoint, packet))
+        for i, heap in enumerate(heaps[1:]):
+            t += 0.001
+            endpoint = self.endpoints[i % 4 * self.n_endpoints // 4]
+            for packet in heap:
+                records.append((t, endpoint, packet))
+        fd, self.filename = tempfile.mkstemp(suffix='.pcap')
+        self.addCleanup(os.remove, self.filename)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_make_pcap(records))
+
+    def _make_receiver(self, filename=None, zero_copy=None, **kwargs):
+        if filename is None:
+            filename = self.filename
+        if zero_copy is None:
+            zero_copy = self.zero_copy
+        # The replay threads for the streams are not synchronised, so one
+        # can get ahead of the other. Use a window that covers the whole
+        # capture so that no heaps are discarded as too old.
+        rx = replay.ReplayReceiver(
+            self.endpoints, None, False, self.n_endpoints, 9200, 32 * 1024**2,
+            Range(0, 1024), 1024, collections.defaultdict(mock.MagicMock), self.cbf_attr,
+            active_frames=self.n_frames, zero_copy=zero_copy, captures=[filename], **kwargs)
+        self.addCleanup(rx.stop)
+        return rx
+
+    async def _check_frames(self, rx):
+        for i in range(self.n_frames):
+            with async_timeout.timeout(10):
+                frame = await rx.get()
+            assert_equal(i, frame.idx)
+            assert_equal(self.timestamps[i], frame.timestamp)
+            for j in range(4):
+                np.testing.assert_equal(self.data[i, j], frame.items[j])
+        with assert_raises(spead2.Stopped):
+            with async_timeout.timeout(10):
+                await rx.get()
+
+    async def test_replay(self):
+        await self._check_frames(self._make_receiver(max_backlog=1))
+
+    async def test_record(self):
+        """Heaps recorded with :class:`.HeapRecorder` can be replayed"""
+        fd, filename = tempfile.mkstemp(suffix='.cap')
+        os.close(fd)
+        self.addCleanup(os.remove, filename)
+        self.addCleanup(os.remove, replay.index_filename(filename))
+        rx = self._make_receiver()
+        rx.recorder = replay.HeapRecorder(rx, filename)
+        await self._check_frames(rx)
+        rx.recorder.close()
+        assert_equal(2 + 4 * self.n_frames, rx.recorder.heaps)
+        assert_equal(0, rx.recorder.dropped)
+
+        index = replay.read_index(filename)
+        assert_equal(2 + 4 * self.n_frames, len(index))
+        # Order between streams is not deterministic
+        data_index = np.sort(index[index['timestamp'] >= 0], order=['timestamp', 'channel'])
+        np.testing.assert_equal(np.repeat(self.timestamps, 4), data_index['timestamp'])
+        np.testing.assert_equal(np.tile(np.arange(4) * 256, self.n_frames),
+                                data_index['channel'])
+        for zero_copy in [False, True]:
+            await self._check_frames(self._make_receiver(filename, zero_copy=zero_copy))
+
+    async def test_record_max_bytes(self):
+        fd, filename = tempfile.mkstemp(suffix='.cap')
+        os.close(fd)
+        self.addCleanup(os.remove, filename)
+        self.addCleanup(os.remove, replay.index_filename(filename))
+        rx = self._make_receiver()
+        recorder = replay.HeapRecorder(rx, filename, max_bytes=100000)
+        rx.recorder = recorder
+        await self._check_frames(rx)
+        recorder.close()
+        assert 0 < recorder.heaps < 2 + 4 * self.n_frames
+        assert os.path.getsize(filename) <= 100000
+        assert_equal(recorder.heaps, len(replay.read_index(filename)))
+
+    async def test_speedup(self):
+        """Replay is paced according to the packet timestamps"""
+        start = self.loop.time()
+        rx = self._make_receiver(speedup=0.5)
+        with assert_raises(spead2.Stopped):
+            while True:
+                with async_timeout.timeout(10):
+                    await rx.get()
+        # Capture spans 20ms
+        assert self.loop.time() - start >= 0.035
+
+    async def test_stop(self):
+        rx = self._make_receiver(speedup=1e-6)
+        rx.stop()
+        with assert_raises(spead2.Stopped):
+            with async_timeout.timeout(10):
+                await rx.get()
+        rx._replay_thread.join(timeout=10)
+        assert not rx._replay_thread.is_alive()
+
+    def test_bad_speedup(self):
+        with assert_raises(ValueError):
+            self._make_receiver(speedup=-1.0)
+
+
+class TestReplayReceiverZeroCopy(TestReplayReceiver):
+    zero_copy = True
+
+    async def test_record(self):
+        rx = self._make_receiver()
+        with assert_raises(ValueError):
+            replay.HeapRecorder(rx, os.devnull)
+        await self._check_frames(rx)
+
+    async def test_record_max_bytes(self):
+        pass
@@ -0,0 +1,291 @@
+"""Tests for the sender module."""
+
+import unittest
+from typing import Dict   # noqa: F401
+from unittest import mock
+
+import numpy as np
+import aiokatcp
+import spead2
+import spead2.recv
+import spead2.send.asyncio
+import asynctest
+from katsdptelstate.endpoint import Endpoint
+from nose.tools import assert_equal, assert_raises
+
+from katsdpingest.sender import (
+    Data, VisSender, VisSenderSet, RatePacer, SdEncoder, parse_sd_mode)
+from katsdpingest.utils import Range
+
+
+class TestRatePacer(unittest.TestCase):
+    """Tests for :class:`katsdpingest.sender.RatePacer`."""
+    def setUp(self):
+        self.sensors = {
+            'output-test-rate': aiokatcp.Sensor(float, 'output-test-rate', ''),
+            'output-test-queue-depth': aiokatcp.Sensor(int, 'output-test-queue-depth', '')
+        }
+        self.pacer = RatePacer(2.0, 1000, max_ratio=3.0, sensors=self.sensors, name='test')
+        self.now = 100.0
+        patcher = mock.patch('time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _check(self, ratio, depth):
+        self.assertAlmostEqual(1000 / 2.0 * RatePacer.HEADROOM * ratio,
+                               self.sensors['output-test-rate'].value)
+        assert_equal(depth, self.sensors['output-test-queue-depth'].value)
+
+    def test_nominal(self):
+        """Dumps sent on schedule use the nominal rate"""
+        for i in range(3):
+            self.assertAlmostEqual(1000 / 2.0 * RatePacer.HEADROOM, self.pacer.begin())
+            self._check(1.0, 1)
+            self.pacer.end(1000)
+            assert_equal(0, self.sensors['output-test-queue-depth'].value)
+            self.now += 2.0
+
+    def test_measured_size(self):
+        """The rate follows the number of bytes actually sent"""
+        self.pacer.begin()
+        self.pacer.end(2000)
+        self.now += 2.0
+        self.assertAlmostEqual(2000 / 2.0 * RatePacer.HEADROOM, self.pacer.begin())
+
+    def test_backlog(self):
+        """The rate rises when dumps overlap or arrive early, up to max_ratio"""
+        self.pacer.begin()
+        self.now += 0.1
+        self.pacer.begin()
+        self._check(3.0, 2)
+        self.pacer.end(1000)
+        self.pacer.end(1000)
+        self.now += 1.0
+        self.pacer.begin()
+        self._check(2.0, 1)
+        self.pacer.end(1000)
+        # Late dump does not reduce the rate below nominal
+        self.now += 10.0
+        self.pacer.begin()
+        self._check(1.0, 1)
+
+    def test_unlimited(self):
+        pacer = RatePacer(0.0, 1000)
+        assert_equal(-1.0, pacer.begin())
+
+    def test_bad_max_ratio(self):
+        with assert_raises(ValueError):
+            RatePacer(1.0, max_ratio=0.5)
+
+
+def test_parse_sd_mode():
+    assert_equal(('float32', False), parse_sd_mode('float32'))
+    assert_equal(('int16', True), parse_sd_mode('delta,int16'))
+    assert_equal(('float32', True), parse_sd_mode('delta'))
+    assert_equal(('float16', False), parse_sd_mode('float16'))
+    for mode in ['int8', 'int16,float16', 'float16,delta', '']:
+        with assert_raises(ValueError):
+            parse_sd_mode(mode)
+
+
+class TestSdEncoder(unittest.TestCase):
+    """Tests for :class:`katsdpingest.sender.SdEncoder`."""
+    def setUp(self):
+        self.flavour = spead2.Flavour(4, 64, 48)
+        self.channels = 10
+        self.source = spead2.send.ItemGroup(flavour=self.flavour)
+        self.source.add_item(0x3501, 'sd_blmxdata', '', (self.channels, 3, 2), np.float32)
+        self.source.add_item(0x3502, 'sd_timestamp', '', (), None, format=[('u', 64)])
+        self.rs = np.random.RandomState(1)
+
+    def _make_value(self):
+        return self.rs.standard_normal((self.channels, 3, 2)).astype(np.float32)
+
+    def _send(self, encoder, values):
+        """Encode a heap for each value of ``sd_blmxdata`` and decode them again.
+
+        Returns the updated items for each heap.
+        """
+        stream = spead2.send.BytesStream(spead2.ThreadPool(), spead2.send.StreamConfig())
+        for i, value in enumerate(values):
+            self.source['sd_blmxdata'].value = value
+            self.source['sd_timestamp'].value = i
+            stream.send_heap(encoder.get_heap(self.source, descriptors=(i == 0)))
+        rx = spead2.recv.Stream(spead2.ThreadPool())
+        rx.add_buffer_reader(stream.getvalue())
+        ig = spead2.ItemGroup()
+        return [{name: item.value for name, item in ig.update(heap).items()} for heap in rx]
+
+    def _decode_int16(self, values):
+        data = values['sd_blmxdata'].astype(np.float32)
+        data[values['sd_blmxdata'] == -32768] = np.nan
+        return data * values['sd_blmxdata_scale']
+
+    def test_float16(self):
+        value = self._make_value()
+        values = self._send(SdEncoder(self.flavour, 'float16'), [value])[0]
+        assert_equal(np.float16, values['sd_blmxdata'].dtype)
+        np.testing.assert_allclose(value, values['sd_blmxdata'], rtol=1e-3)
+        assert_equal(0, values['sd_timestamp'])
+
+    def test_int16(self):
+        value = self._make_value()
+        value[3, 1, 0] = np.nan
+        values = self._send(SdEncoder(self.flavour, 'int16'), [value])[0]
+        peak = np.nanmax(np.abs(value))
+        np.testing.assert_allclose(value, self._decode_int16(values),
+                                   atol=peak / 32767, equal_nan=True)
+
+    def test_delta(self):
+        """Only blocks that changed are sent"""
+        value = self._make_value()
+        value[0, 0, 0] = np.nan
+        changed = value.copy()
+        changed[5, 0, 1] += 1
+        heaps = self._send(SdEncoder(self.flavour, delta=True, block_channels=4),
+                           [value, value, changed])
+        blocks = [list(values['sd_blmxdata_blocks']) for values in heaps]
+        # An unchanged heap still sends one block, since empty items are dropped
+        assert_equal([[0, 1, 2], [0], [1]], blocks)
+        data = np.zeros_like(value)
+        for expected, values in zip([value, value, changed], heaps):
+            for i, block in enumerate(values['sd_blmxdata_blocks']):
+                data[block * 4 : (block + 1) * 4] = values['sd_blmxdata'][i * 4 : (i + 1) * 4]
+            np.testing.assert_equal(expected, data)
+
+    def test_delta_int16_rescale(self):
+        """A change to the int16 scale factor causes all blocks to be resent"""
+        value = self._make_value()
+        scaled = value.copy()
+        scaled[5, 0, 1] = 2 * np.max(np.abs(value))
+        heaps = self._send(SdEncoder(self.flavour, 'int16', delta=True, block_channels=4),
+                           [value, value, scaled])
+        blocks = [list(values['sd_blmxdata_blocks']) for values in heaps]
+        assert_equal([[0, 1, 2], [0], [0, 1, 2]], blocks)
+
+    def test_copy(self):
+        """Heaps do not refer to the source arrays"""
+        encoder = SdEncoder(self.flavour)
+        value = self._make_value()
+        expected = value.copy()
+        self.source['sd_blmxdata'].value = value
+        self.source['sd_timestamp'].value = 0
+        heap = encoder.get_heap(self.source, descriptors=True)
+        value[:] = 0
+        stream = spead2.send.BytesStream(spead2.ThreadPool(), spead2.send.StreamConfig())
+        stream.send_heap(heap)
+        rx = spead2.recv.Stream(spead2.ThreadPool())
+        rx.add_buffer_reader(stream.getvalue())
+        ig = spead2.ItemGroup()
+        for heap in rx:
+            ig.update(heap)
+        np.testing.assert_equal(expected, ig['sd_blmxdata'].value)
+
+    def test_reset(self):
+        encoder = SdEncoder(self.flavour, delta=True, block_channels=4)
+        value = self._make_value()
+        self._send(encoder, [value])
+        encoder.reset()
+        heaps = self._send(encoder, [value])
+        assert_equal([0, 1, 2], list(heaps[0]['sd_blmxdata_blocks']))
+
+    def test_bad_args(self):
+        with assert_raises(ValueError):
+            SdEncoder(self.flavour, 'int8')
+        with assert_raises(ValueError):
+            SdEncoder(self.flavour, 'float16', delta=True)
+        with assert_raises(ValueError):
+            SdEncoder(self.flavour, block_channels=0)
+
+
+class TestVisSenderSet(asynctest.TestCase):
+    batched = False
+
+    def setUp(self):
+        self.queues = {}     # type: Dict[Endpoint, spead2.InprocQueue]
+        self.n_streams = 0
+
+        def make_stream(thread_pool, endpoints, config, *args, **kwargs):
+            queues = []
+            for endpoint in endpoints:
+                queue = spead2.InprocQueue()
+                self.queues[Endpoint(*endpoint)] = queue
+                queues.append(queue)
+            self.n_streams += 1
+            return spead2.send.asyncio.InprocStream(thread_pool, queues, config)
+
+        patcher = mock.patch('spead2.send.asyncio.UdpStream', side_effect=make_stream)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.endpoints = [Endpoint('239.1.2.3', 7148), Endpoint('239.1.2.4', 7148)]
+        self.channels = 8
+        self.baselines = 3
+        self.tx = VisSenderSet(
+            spead2.ThreadPool(), self.endpoints, None, spead2.Flavour(4, 64, 48), 0.0,
+            Range(0, self.channels), 16, 64, self.baselines, batched=self.batched)
+
+    def _make_data(self, seed):
+        rs = np.random.RandomState(seed)
+        shape = (self.channels, self.baselines)
+        return Data(
+            vis=(rs.standard_normal(shape) + 1j * rs.standard_normal(shape)).astype(np.complex64),
+            flags=rs.randint(0, 256, size=shape).astype(np.uint8),
+            weights=rs.randint(0, 256, size=shape).astype(np.uint8),
+            weights_channel=rs.standard_normal(self.channels).astype(np.float32))
+
+    def _receive(self, endpoint):
+        stream = spead2.recv.Stream(spead2.ThreadPool())
+        stream.add_inproc_reader(self.queues[endpoint])
+        ig = spead2.ItemGroup()
+        cnts = []
+        values = []
+        for heap in stream:
+            cnts.append(heap.cnt)
+            updated = ig.update(heap)
+            if 'timestamp' in updated:
+                values.append({name: item.value for name, item in updated.items()})
+        return cnts, values
+
+    async def test_send(self):
+        """Heaps are reused for the same buffers, with updated scalars"""
+        buffers = [self._make_data(0), self._make_data(1)]
+        estimate = self.tx.pacer.dump_bytes
+        sent = []
+        for idx in range(5):
+            data = buffers[idx % 2]
+            # Simulate the staging buffer being refilled
+            data.vis[:] *= 2
+            await self.tx.send(data, idx, 0.5 * idx)
+            sent.append((idx, 0.5 * idx, Data(data.vis.copy(), data.flags.copy(),
+                                              data.weights.copy(), data.weights_channel.copy())))
+        await self.tx.stop()
+        assert_equal(1 if self.batched else 2, self.n_streams)
+        for i, endpoint in enumerate(self.endpoints):
+            cnts, received = self._receive(endpoint)
+            # Heap counters interleave with those of the other substreams
+            assert_equal([16 + i * 4 + 64 * j for j in range(len(sent))], cnts)
+            assert_equal(len(sent), len(received))
+            sub = slice(i * 4, (i + 1) * 4)
+            for (idx, ts_rel, data), values in zip(sent, received):
+                assert_equal(idx, values['dump_index'])
+                assert_equal(ts_rel, values['timestamp'])
+                assert_equal(16 + i * 4, values['frequency'])
+                np.testing.assert_equal(data.vis[sub], values['correlator_data'])
+                np.testing.assert_equal(data.flags[sub], values['flags'])
+                np.testing.assert_equal(data.weights[sub], values['weights'])
+                np.testing.assert_equal(data.weights_channel[sub], values['weights_channel'])
+        for sender in self.tx._senders:
+            assert_equal(2, len(sender._heaps))
+        # The pacer replaced the estimate with the actual size of a dump
+        assert 0 < self.tx.pacer.dump_bytes != estimate
+        assert_equal(0, self.tx.pacer.depth)
+
+    async def test_max_heaps(self):
+        for idx in range(VisSender.MAX_HEAPS + 2):
+            await self.tx.send(self._make_data(idx), idx, 0.0)
+        for sender in self.tx._senders:
+            assert_equal(VisSender.MAX_HEAPS, len(sender._heaps))
+
+
+class TestVisSenderSetBatched(TestVisSenderSet):
+    batched = True
@@ -0,0 +1,282 @@
+"""Tests for the sigproc_host module."""
+
+import unittest
+
+import numpy as np
+from katdal.flags import CAM
+from nose.tools import assert_equal, assert_raises
+
+from katsdpingest import sigproc_host
+from katsdpingest.utils import Range
+from .test_sigproc import TestIngestOperation as _TestIngestOperationDevice, random_flags
+
+
+class TestHostCommandQueue(unittest.TestCase):
+    def setUp(self):
+        self.queue = sigproc_host.HostContext().create_command_queue()
+
+    def test_order(self):
+        """Work is executed in order"""
+        out = []
+        for i in range(10):
+            self.queue.enqueue(out.append, i)
+        self.queue.finish()
+        assert_equal(list(range(10)), out)
+
+    def test_error(self):
+        """An error is sticky and skips subsequent work"""
+        out = []
+        self.queue.enqueue(out.append, 1)
+        self.queue.enqueue(int, 'not a number')
+        self.queue.enqueue(out.append, 2)
+        marker = self.queue.enqueue_marker()
+        with assert_raises(ValueError):
+            marker.wait()
+        assert_equal([1], out)
+
+    def test_buffer(self):
+        buf = sigproc_host.HostBuffer((3, 4), np.float32)
+        data = np.arange(12, dtype=np.float32).reshape(3, 4)
+        buf.set(self.queue, data)
+        np.testing.assert_equal(data, buf.get(self.queue))
+        buf.zero(self.queue)
+        np.testing.assert_equal(0, buf.get(self.queue))
+
+
+class TestIngestOperationHost(unittest.TestCase):
+    """Tests for :class:`katsdpingest.sigproc_host.IngestOperationHost`.
+
+    The reference implementation is the one used to test the device code.
+    """
+
+    def setUp(self):
+        self.reference = _TestIngestOperationDevice()
+        # Keep bit inversion within uint8 in the reference implementation
+        self.reference.unflagged_bit = np.uint8(self.reference.unflagged_bit)
+        self.context = sigproc_host.HostContext()
+        self.queue = self.context.create_command_queue()
+
+    def _test_random(self, excise, continuum):
+        """Test with random data against the reference CPU implementation"""
+        channels = 128
+        channel_range = Range(16, 96)
+        count_flags_channel_range = Range(8, 104)
+        kept_channels = len(channel_range)
+        cbf_baselines = 220
+        baselines = 192
+        masks = 3
+        cont_factor = 4
+        sd_cont_factor = 8
+        n_accs = 64
+        dumps = 4
+        sd_dumps = 3
+        percentile_ranges = [(0, 10), (32, 40), (0, 0), (180, 192)]
+        n_sigma = -1.0
+
+        rs = np.random.RandomState(seed=1)
+        vis_in = rs.randint(-1000, 1001, (dumps, channels, cbf_baselines, 2)).astype(np.int32)
+        permutation = rs.permutation(cbf_baselines).astype(np.int16)
+        permutation[permutation >= baselines] = -1
+        timeseries_weights = rs.randint(0, 2, kept_channels).astype(np.float32)
+        timeseries_weights /= np.sum(timeseries_weights)
+        channel_mask = random_flags(rs, (dumps, masks, channels), 2, p=0.05)
+        channel_mask_idx = rs.randint(0, masks, baselines).astype(np.uint32)
+        baseline_flags = random_flags(rs, (dumps, baselines), 2, p=0.05)
+
+        # The reference flagger does not take input flags into account
+        template = sigproc_host.IngestTemplateHost(
+            self.context, excise, continuum,
+            background_use_flags=False, flag_value=self.reference.flag_value)
+        fn = template.instantiate(
+            self.queue, channels, channel_range, count_flags_channel_range,
+            cbf_baselines, baselines, masks,
+            cont_factor, sd_cont_factor, percentile_ranges,
+            threshold_args={'n_sigma': n_sigma})
+        fn.ensure_all_bound()
+        fn.n_accs = n_accs
+        fn.buffer('permutation').set(self.queue, permutation)
+        fn.buffer('timeseries_weights').set(self.queue, timeseries_weights)
+        fn.buffer('channel_mask_idx').set(self.queue, channel_mask_idx)
+
+        data_keys = ['spec_vis', 'spec_weights', 'spec_weights_channel', 'spec_flags']
+        if continuum:
+            data_keys.extend(['cont_vis', 'cont_weights', 'cont_weights_channel', 'cont_flags'])
+        sd_keys = ['sd_spec_vis', 'sd_spec_weights', 'sd_spec_flags',
+                   'sd_cont_vis', 'sd_cont_weights', 'sd_cont_flags',
+                   'timeseries', 'timeseriesabs', 'sd_flag_counts', 'sd_flag_any_counts']
+        for i in range(len(percentile_ranges)):
+            sd_keys.append('percentile{0}'.format(i))
+            sd_keys.append('percentile{0}_flags'.format(i))
+
+        actual = {}
+        fn.start_sum()
+        fn.start_sd_sum()
+        for i in range(dumps):
+            fn.buffer('vis_in').set(self.queue, vis_in[i])
+            fn.buffer('channel_mask').set(self.queue, channel_mask[i])
+            fn.buffer('baseline_flags').set(self.queue, baseline_flags[i])
+            fn()
+            if i + 1 == dumps:
+                fn.end_sum()
+                for name in data_keys:
+                    actual[name] = fn.buffer(name).get(self.queue)
+            if i + 1 == sd_dumps:
+                fn.end_sd_sum()
+                for name in sd_keys:
+                    actual[name] = fn.buffer(name).get(self.queue)
+
+        expected = self.reference.run_host_basic(
+            vis_in, channel_mask, channel_mask_idx, baseline_flags,
+            n_accs, permutation, cont_factor if continuum else 1,
+            channel_range, None, n_sigma, excise)
+        sd_expected = self.reference.run_host_basic(
+            vis_in[:sd_dumps], channel_mask[:sd_dumps], channel_mask_idx,
+            baseline_flags[:sd_dumps], n_accs, permutation, sd_cont_factor,
+            channel_range, count_flags_channel_range, n_sigma, excise)
+        for (name, value) in sd_expected.items():
+            expected['sd_' + name] = value
+        sd_spec_vis = expected['sd_spec_vis']
+        expected['timeseries'] = np.sum(sd_spec_vis * timeseries_weights[:, np.newaxis], axis=0)
+        expected['timeseriesabs'] = \
+            np.sum(np.abs(sd_spec_vis) * timeseries_weights[:, np.newaxis], axis=0)
+        for i, (start, end) in enumerate(percentile_ranges):
+            n = end - start
+            if n:
+                ordered = np.sort(np.abs(sd_spec_vis[:, start:end]), axis=1)
+                ranks = [0, n - 1, (n - 1) // 4, (n - 1) * 3 // 4, (n - 1) // 2]
+                percentile = ordered[:, ranks].T
+                flags = np.bitwise_or.reduce(expected['sd_spec_flags'][:, start:end], axis=1)
+            else:
+                percentile = np.full((5, kept_channels), np.nan, np.float32)
+                flags = np.zeros(kept_channels, np.uint8)
+            expected['percentile{0}'.format(i)] = percentile
+            expected['percentile{0}_flags'.format(i)] = flags
+
+        for name in data_keys + sd_keys:
+            err_msg = '{0} is not equal'.format(name)
+            if expected[name].dtype in (np.dtype(np.float32), np.dtype(np.complex64)):
+                np.testing.assert_allclose(expected[name], actual[name],
+                                           rtol=1e-5, atol=1e-5, err_msg=err_msg)
+            elif name.endswith('_weights'):
+                np.testing.assert_allclose(expected[name], actual[name], atol=1, err_msg=err_msg)
+            else:
+                np.testing.assert_equal(expected[name], actual[name], err_msg=err_msg)
+
+    def test_random_excise(self):
+        """Test with random data against a CPU implementation (with excision)"""
+        self._test_random(True, True)
+
+    def test_random_no_excise(self):
+        """Test with random data against a CPU implementation (without excision)"""
+        self._test_random(False, True)
+
+    def test_random_no_continuum(self):
+        """Test with random data against a CPU implementation (without continuum averaging)"""
+        self._test_random(True, False)
+
+    def test_zero_antenna(self):
+        """If all data for an antenna is zero, it must not cause NaNs in the output."""
+        channels = 4
+        dumps = 2
+        template = sigproc_host.IngestTemplateHost(self.context, True, True)
+        fn = template.instantiate(
+            self.queue, channels, Range(0, channels), Range(0, channels),
+            4, 4, 1, 2, 2, [(0, 1), (1, 2), (2, 4)],
+            threshold_args={'n_sigma': 3.0})
+        fn.n_accs = 1
+        fn.buffer('permutation').set(self.queue, np.array([0, 1, 2, 3], dtype=np.int16))
+        fn.buffer('timeseries_weights').set(
+            self.queue, np.full(channels, 1 / channels, np.float32))
+
+        fn.start_sum()
+        fn.start_sd_sum()
+        for i in range(dumps):
+            fn.buffer('vis_in').zero(self.queue)
+            fn.buffer('channel_mask').zero(self.queue)
+            fn.buffer('channel_mask_idx').zero(self.queue)
+            fn.buffer('baseline_flags').zero(self.queue)
+            fn()
+        fn.end_sum()
+        fn.end_sd_sum()
+
+        np.testing.assert_equal(0 + 0j, fn.buffer('spec_vis').get(self.queue))
+        np.testing.assert_equal(CAM, fn.buffer('spec_flags').get(self.queue))
+        np.testing.assert_equal(0 + 0j, fn.buffer('cont_vis').get(self.queue))
+        np.testing.assert_equal(CAM, fn.buffer('cont_flags').get(self.queue))
+
+    def test_unknown_buffer(self):
+        template = sigproc_host.IngestTemplateHost(self.context, True, False)
+        fn = template.instantiate(
+            self.queue, 4, Range(0, 4), Range(0, 4), 4, 4, 1, 1, 2, [(0, 4)],
+            threshold_args={'n_sigma': 3.0})
+        fn.buffer('percentile0')
+        with assert_raises(KeyError):
+            fn.buffer('percentile1')
+        with assert_raises(KeyError):
+            fn.buffer('cont_vis')
+
+
+class TestShardedIngestOperationHost(unittest.TestCase):
+    """Tests for :class:`katsdpingest.sigproc_host.ShardedIngestOperationHost`."""
+
+    def _instantiate(self, processes):
+        context = sigproc_host.HostContext(processes)
+        queue = context.create_command_queue()
+        template = sigproc_host.IngestTemplateHost(context, True, True)
+        # Very high threshold so that noise estimation per shard does not
+        # affect the results.
+        fn = template.instantiate(
+            queue, 96, Range(8, 88), Range(0, 96), 24, 20, 2, 4, 8, [(0, 5), (0, 0), (5, 20)],
+            threshold_args={'n_sigma': 1e6})
+        return queue, fn
+
+    def test_compare(self):
+        """Results match those of the unsharded implementation"""
+        rs = np.random.RandomState(seed=1)
+        permutation = rs.permutation(24).astype(np.int16)
+        permutation[permutation >= 20] = -1
+        timeseries_weights = np.full(80, 1 / 80, np.float32)
+        channel_mask_idx = rs.randint(0, 2, 20).astype(np.uint32)
+        dumps = 3
+        vis_in = rs.randint(-1000, 1001, (dumps, 96, 24, 2)).astype(np.int32)
+        vis_in[:, 20:30, 3] = 0      # Trigger some CAM flags
+        channel_mask = random_flags(rs, (dumps, 2, 96), 2, p=0.05)
+        baseline_flags = random_flags(rs, (dumps, 20), 2, p=0.05)
+
+        results = []
+        for processes in [1, 3]:
+            queue, fn = self._instantiate(processes)
+            fn.n_accs = 16
+            fn.buffer('permutation').set(queue, permutation)
+            fn.buffer('timeseries_weights').set(queue, timeseries_weights)
+            fn.buffer('channel_mask_idx').set(queue, channel_mask_idx)
+            fn.start_sum()
+            fn.start_sd_sum()
+            for i in range(dumps):
+                fn.buffer('vis_in').set(queue, vis_in[i])
+                fn.buffer('channel_mask').set(queue, channel_mask[i])
+                fn.buffer('baseline_flags').set(queue, baseline_flags[i])
+                fn()
+            fn.end_sum()
+            fn.end_sd_sum()
+            names = ['spec_vis', 'spec_flags', 'spec_weights', 'spec_weights_channel',
+                     'cont_vis', 'cont_flags', 'cont_weights', 'cont_weights_channel',
+                     'sd_cont_vis', 'sd_cont_flags', 'timeseries', 'timeseriesabs',
+                     'sd_flag_counts', 'sd_flag_any_counts',
+                     'percentile0', 'percentile0_flags', 'percentile1', 'percentile2']
+            results.append({name: fn.buffer(name).get(queue) for name in names})
+            if processes > 1:
+                assert_equal([Range(0, 32), Range(32, 56), Range(56, 96)], fn.shards)
+                fn.close()
+        for name, expected in results[0].items():
+            np.testing.assert_allclose(expected, results[1][name], rtol=1e-5, atol=1e-5,
+                                       err_msg='{} is not equal'.format(name))
+
+    def test_bind(self):
+        """Slots cannot be rebound"""
+        queue, fn = self._instantiate(2)
+        try:
+            with assert_raises(ValueError):
+                fn.bind(vis_in=sigproc_host.HostBuffer(fn.buffer('vis_in').shape, np.int32))
+        finally:
+            fn.close()
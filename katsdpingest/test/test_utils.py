@@ -1,5 +1,10 @@
 """Tests for the util module."""
-from katsdpingest.utils import Range
+import unittest
+
+import aiokatcp
+from aiokatcp import Sensor
+
+from katsdpingest.utils import Range, LatencyTracker, parse_cpu_list
 from nose.tools import (assert_equal, assert_raises,
                         assert_true, assert_false, assert_in, assert_not_in)
 
@@ -95,3 +100,61 @@ class TestRange:
         assert_raises(ValueError, Range(10, 20).split, 6, 3)
         assert_raises(ValueError, Range(10, 20).split, 5, -2)
         assert_raises(ValueError, Range(10, 20).split, 5, 5)
+
+
+def test_parse_cpu_list():
+    assert_equal([3], parse_cpu_list('3'))
+    assert_equal([0, 1, 2, 3, 8], parse_cpu_list('0-3,8'))
+    assert_equal([0, 1, 2], parse_cpu_list('2,0-1\n'))
+    with assert_raises(ValueError):
+        parse_cpu_list('3-1')
+    with assert_raises(ValueError):
+        parse_cpu_list('a')
+    with assert_raises(ValueError):
+        parse_cpu_list('')
+
+
+class TestLatencyTracker(unittest.TestCase):
+    """Tests for :class:`katsdpingest.utils.LatencyTracker`."""
+    def setUp(self):
+        self.sensors = {
+            name: aiokatcp.Sensor(float, name, '', 's')
+            for name in ['latency-test-p50', 'latency-test-p99', 'latency-test-max']
+        }
+        self.tracker = LatencyTracker(self.sensors, 'test', window=4, interval=3600.0)
+
+    def test_first_sample(self):
+        """The first sample is published immediately."""
+        self.tracker.add(2.0)
+        assert_equal(2.0, self.sensors['latency-test-p50'].value)
+        assert_equal(2.0, self.sensors['latency-test-p99'].value)
+        assert_equal(2.0, self.sensors['latency-test-max'].value)
+
+    def test_rate_limit(self):
+        """Sensors are not updated until the interval has passed."""
+        self.tracker.add(1.0)
+        self.tracker.add(5.0)
+        assert_equal(1.0, self.sensors['latency-test-max'].value)
+        self.tracker.publish()
+        assert_equal(5.0, self.sensors['latency-test-max'].value)
+        assert_equal(3.0, self.sensors['latency-test-p50'].value)
+
+    def test_window(self):
+        """Only the most recent samples are considered."""
+        for latency in [10.0, 1.0, 2.0, 3.0, 4.0]:
+            self.tracker.add(latency)
+        self.tracker.publish()
+        assert_equal(4.0, self.sensors['latency-test-max'].value)
+        assert_equal(2.5, self.sensors['latency-test-p50'].value)
+
+    def test_time(self):
+        with self.tracker.time():
+            pass
+        assert_true(0.0 <= self.sensors['latency-test-max'].value < 1.0)
+
+    def test_time_exception(self):
+        """Nothing is recorded if the body raises."""
+        with assert_raises(RuntimeError):
+            with self.tracker.time():
+                raise RuntimeError
+        assert_equal(Sensor.Status.UNKNOWN, self.sensors['latency-test-max'].status)
@@ -1,8 +1,12 @@
 """Miscellaneous ingest utilities"""
 
 import logging
-from typing import TypeVar, Tuple
+import os
+import time
+import contextlib
+from typing import TypeVar, Tuple, Mapping, Iterator, List, Optional
 
+import numpy as np
 import katsdptelstate.aio
 import aiokatcp
 
@@ -176,6 +180,60 @@ class Range:
                      self.start + (chunk_id + 1) * chunk_size)
 
 
+def parse_cpu_list(value: str) -> List[int]:
+    """Parse a list of CPU cores in the format used by Linux (e.g. ``0-3,8``).
+
+    Raises
+    ------
+    ValueError
+        if `value` is not a valid core list
+    """
+    cores = []     # type: List[int]
+    for part in value.split(','):
+        first, sep, last = part.strip().partition('-')
+        start = int(first)
+        stop = int(last) if sep else start
+        if start < 0 or stop < start:
+            raise ValueError('Invalid core range {!r}'.format(part))
+        cores.extend(range(start, stop + 1))
+    return sorted(set(cores))
+
+
+def interface_cpus(interface: Optional[str]) -> Optional[List[int]]:
+    """Determine the CPU cores on the NUMA node local to a network interface.
+
+    Only cores that the process is allowed to run on are returned.
+
+    Parameters
+    ----------
+    interface
+        Name of the network interface (e.g. ``eth0``)
+
+    Returns
+    -------
+    cores
+        Sorted list of cores, or ``None`` if the NUMA node of the interface
+        cannot be determined (for example, on a single-socket machine, or
+        if `interface` is ``None``).
+    """
+    if interface is None:
+        return None
+    try:
+        with open('/sys/class/net/{}/device/numa_node'.format(interface)) as f:
+            node = int(f.read())
+        if node < 0:
+            return None
+        with open('/sys/devices/system/node/node{}/cpulist'.format(node)) as f:
+            cores = parse_cpu_list(f.read())
+    except (OSError, ValueError) as exc:
+        _logger.debug('Could not determine NUMA node of %s: %s', interface, exc)
+        return None
+    if hasattr(os, 'sched_getaffinity'):
+        allowed = os.sched_getaffinity(0)
+        cores = [core for core in cores if core in allowed]
+    return cores or None
+
+
 _T = TypeVar('_T')
 
 
@@ -200,4 +258,65 @@ class Sensor(aiokatcp.Sensor[_T]):
         self.set_value(self.value + delta, timestamp=timestamp)
 
 
-__all__ = ['cbf_telstate_view', 'Range', 'Sensor']
+class LatencyTracker:
+    """Track recent latencies of a pipeline stage and publish statistics.
+
+    The statistics are computed over a rolling window of the most recent
+    samples, and published to sensors called
+    :samp:`latency-{stage}-p50`, :samp:`latency-{stage}-p99` and
+    :samp:`latency-{stage}-max`. To keep the overhead low, the sensors
+    are updated at most once per `interval` (apart from the first sample).
+
+    Parameters
+    ----------
+    sensors
+        Sensors, which must include those named above
+    stage
+        Name of the pipeline stage
+    window
+        Number of recent samples to consider
+    interval
+        Minimum time between sensor updates, in seconds
+    """
+    def __init__(self, sensors: Mapping[str, aiokatcp.Sensor], stage: str,
+                 window: int = 128, interval: float = 1.0) -> None:
+        prefix = 'latency-' + stage
+        self._p50 = sensors[prefix + '-p50']
+        self._p99 = sensors[prefix + '-p99']
+        self._max = sensors[prefix + '-max']
+        self._samples = np.zeros(window)
+        self._size = 0      # Number of valid samples
+        self._pos = 0       # Position at which to write the next sample
+        self._interval = interval
+        self._last_publish = -np.inf
+
+    def add(self, latency: float) -> None:
+        """Record the latency of one invocation of the stage, in seconds."""
+        window = len(self._samples)
+        self._samples[self._pos] = latency
+        self._pos = (self._pos + 1) % window
+        self._size = min(self._size + 1, window)
+        if time.monotonic() - self._last_publish >= self._interval:
+            self.publish()
+
+    @contextlib.contextmanager
+    def time(self) -> Iterator[None]:
+        """Context manager that records the time spent in its body."""
+        start = time.monotonic()
+        yield
+        self.add(time.monotonic() - start)
+
+    def publish(self) -> None:
+        """Update the sensors immediately."""
+        if not self._size:
+            return
+        self._last_publish = time.monotonic()
+        samples = self._samples[:self._size]
+        p50, p99 = np.percentile(samples, [50, 99])
+        now = time.time()
+        self._p50.set_value(float(p50), timestamp=now)
+        self._p99.set_value(float(p99), timestamp=now)
+        self._max.set_value(float(np.max(samples)), timestamp=now)
+
+
+__all__ = ['cbf_telstate_view', 'Range', 'Sensor', 'LatencyTracker']
@@ -16,8 +16,9 @@ import katsdptelstate.aio.redis
 import katsdpmodels.fetch.aiohttp
 
 from katsdpingest.ingest_session import ChannelRanges, SystemAttrs
-from katsdpingest.utils import Range, cbf_telstate_view
+from katsdpingest.utils import Range, cbf_telstate_view, parse_cpu_list
 from katsdpingest.ingest_server import IngestDeviceServer
+from katsdpingest import receiver, sigproc_host
 
 
 logger = logging.getLogger("katsdpingest.ingest")
@@ -56,6 +57,14 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument(
         '--cbf-ibv', action='store_true',
         help='use ibverbs acceleration for CBF SPEAD data [default=no].')
+    parser.add_argument(
+        '--cbf-replay', type=comma_list(str), default=[], metavar='FILES',
+        help=('replay CBF SPEAD data from comma-separated pcap or native capture files '
+              'instead of receiving from the network [default=no]'))
+    parser.add_argument(
+        '--cbf-replay-speedup', type=float, default=1.0,
+        help=('ratio of replay rate to the original rate, or 0 to replay as fast as '
+              'possible [default=%(default)s]'))
     parser.add_argument(
         '--cbf-name',
         help='name of the baseline correlation products stream')
@@ -77,6 +86,10 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument(
         '--l0-continuum-name', default='sdp_l0_continuum', metavar='NAME',
         help='telstate name of the continuum output stream')
+    parser.add_argument(
+        '--output-batch', action='store_true',
+        help='send all L0 substreams of each output through one stream, submitting the '
+             'heaps of a dump together [default=no]')
     parser.add_argument(
         '--output-int-time', default=2.0, type=float,
         help='seconds between output dumps (will be quantised). [default=%(default)s]')
@@ -103,17 +116,63 @@ def parse_args() -> argparse.Namespace:
         '--guard-channels', default=64, type=int,
         help='extra channels to use for RFI detection. [default=%(default)s]')
     parser.add_argument(
-        '--input-streams', default=1, type=int,
-        help='maximum separate streams for receive. [default=%(default)s]')
+        '--input-streams', default=0, type=int,
+        help='maximum separate streams for receive, or 0 to choose the number of streams, '
+             'threads and CPU affinity automatically. [default=%(default)s]')
     parser.add_argument(
         '--input-max-packet-size', default=4608, type=int,
         help='maximum packet size to receive. [default=[%(default)s]')
     parser.add_argument(
         '--input-buffer', default=64 * 1024**2, type=int,
         help='network buffer size ofr input. [default=%(default)s]')
+    parser.add_argument(
+        '--input-zero-copy', action='store_true',
+        help='assemble input frames directly in contiguous memory (requires the '
+             'CBF item IDs to match the ICD) [default=no]')
+    parser.add_argument(
+        '--input-threads', action='store_true',
+        help='assemble input frames in a dedicated thread per input stream rather than '
+             'on the event loop [default=no]')
+    parser.add_argument(
+        '--input-max-active-frames', type=int, metavar='N',
+        help='adapt the number of input dumps used to reorder heaps to their observed '
+             'lateness, up to N [default=fixed]')
+    parser.add_argument(
+        '--input-queue-frames', type=int, default=1, metavar='N',
+        help='number of complete input dumps that may wait for processing '
+             '[default=%(default)s]')
+    parser.add_argument(
+        '--input-overflow', choices=list(receiver.OVERFLOW_POLICIES), default='block',
+        help='what to do with a complete input dump when the queue is full '
+             '[default=%(default)s]')
+    parser.add_argument(
+        '--input-affinity', type=parse_cpu_list, metavar='CORES',
+        help='CPU cores (e.g. 0-3,8) for the input receive threads, shared out between '
+             'the input streams [default=auto]')
+    parser.add_argument(
+        '--output-affinity', type=parse_cpu_list, metavar='CORES',
+        help='CPU cores for the L0 output send threads [default=unpinned]')
+    parser.add_argument(
+        '--sd-affinity', type=parse_cpu_list, metavar='CORES',
+        help='CPU cores for the signal display send threads [default=unpinned]')
+    parser.add_argument(
+        '--numa-local', action='store_true',
+        help='restrict network threads without an explicit affinity to the NUMA node of '
+             'their interface, so that their buffers are allocated there [default=no]')
     parser.add_argument(
         '--sd-spead-rate', type=float, default=1000000000,
         help='rate (bits per second) to transmit signal display output. [default=%(default)s]')
+    parser.add_argument(
+        '--sd-descriptor-interval', type=int, default=1, metavar='N',
+        help='signal display dumps between repeated descriptors, or 0 to send them only at '
+             'the start and to new servers [default=%(default)s]')
+    parser.add_argument(
+        '--cpu', action='store_true',
+        help='use NumPy on the CPU for signal processing instead of a GPU [default=no]')
+    parser.add_argument(
+        '--cpu-processes', type=int, default=1, metavar='N',
+        help=('number of worker processes across which to split channels '
+              'with --cpu [default=%(default)s]'))
     parser.add_argument(
         '--no-excise', dest='excise', action='store_false',
         help='disable excision of flagged data [default=no]')
@@ -145,10 +204,29 @@ def parse_args() -> argparse.Namespace:
         parser.error('argument --telstate is required')
     if args.cbf_ibv and args.cbf_interface is None:
         parser.error('--cbf-ibv requires --cbf-interface')
+    if args.input_threads and args.input_zero_copy:
+        parser.error('--input-threads cannot be combined with --input-zero-copy')
+    if args.input_max_active_frames is not None:
+        if args.input_max_active_frames < 1:
+            parser.error('--input-max-active-frames must be positive')
+        if args.input_zero_copy:
+            parser.error('--input-max-active-frames cannot be combined with --input-zero-copy')
+    if args.input_streams < 0:
+        parser.error('--input-streams cannot be negative')
+    if args.input_queue_frames < 1:
+        parser.error('--input-queue-frames must be positive')
+    if args.sd_descriptor_interval < 0:
+        parser.error('--sd-descriptor-interval cannot be negative')
+    if args.cbf_replay_speedup < 0:
+        parser.error('--cbf-replay-speedup cannot be negative')
     if args.cbf_name is None:
         parser.error('--cbf-name is required')
     if not 1 <= args.server_id <= args.servers:
         parser.error('--server-id is out of range')
+    if args.cpu_processes < 1:
+        parser.error('--cpu-processes must be positive')
+    if args.cpu_processes > 1 and not args.cpu:
+        parser.error('--cpu-processes requires --cpu')
     if args.l0_spectral_spead is None and args.l0_continuum_spead is None:
         parser.error('at least one of --l0-spectral-spead and --l0-continuum-spead must be given')
     return args
@@ -194,7 +272,10 @@ async def main() -> None:
             args.servers, args.server_id - 1,
             cbf_channels, continuum_factor, args.sd_continuum_factor,
             len(args.cbf_spead), args.guard_channels, args.output_channels, args.sd_output_channels)
-        context = accel.create_some_context(interactive=False)
+        if args.cpu:
+            context = sigproc_host.HostContext(args.cpu_processes)
+        else:
+            context = accel.create_some_context(interactive=False)
         server = IngestDeviceServer(args, telstate_cbf, channel_ranges, system_attrs, context,
                                     args.host, args.port)
 
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+"""Measure end-to-end ingest throughput over a matrix of configurations.
+
+Frames are synthesised in memory and the output streams are drained
+in-process, so no network or telescope state is needed. Each
+configuration runs in its own process.
+"""
+
+import argparse
+import json
+import logging
+
+from katsdpingest import benchmark
+
+
+def comma_list(arg: str):
+    return [int(x) for x in arg.split(',')]
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--antennas', type=comma_list, default=[4, 16],
+        help='comma-separated numbers of antennas [default=4,16]')
+    parser.add_argument(
+        '--channels', type=comma_list, default=[4096],
+        help='comma-separated numbers of channels [default=4096]')
+    parser.add_argument(
+        '--continuum-factor', type=comma_list, default=[16],
+        help='comma-separated continuum factors [default=16]')
+    parser.add_argument(
+        '--sd-int-time', type=comma_list, default=[1],
+        help='comma-separated signal display integration times, in input dumps [default=1]')
+    parser.add_argument(
+        '--output-int-time', type=int, default=1,
+        help='L0 integration time, in input dumps [default=%(default)s]')
+    parser.add_argument(
+        '--dumps', type=int, default=20,
+        help='number of input dumps per configuration [default=%(default)s]')
+    parser.add_argument(
+        '--xengs', type=int, default=16,
+        help='number of X engines [default=%(default)s]')
+    parser.add_argument(
+        '--cpu', action='store_true',
+        help='use NumPy on the CPU for signal processing instead of a GPU [default=no]')
+    parser.add_argument(
+        '--cpu-processes', type=int, default=1, metavar='N',
+        help='number of processes for --cpu signal processing [default=%(default)s]')
+    parser.add_argument(
+        '--json', type=str, metavar='FILE',
+        help='write detailed results to FILE as JSON')
+    parser.add_argument(
+        '-l', '--log-level', type=str, default='WARNING', metavar='LEVEL',
+        help='log level to use [default=%(default)s]')
+    args = parser.parse_args()
+    if args.cpu_processes < 1:
+        parser.error('--cpu-processes must be positive')
+    if args.cpu_processes > 1 and not args.cpu:
+        parser.error('--cpu-processes requires --cpu')
+    return args
+
+
+def main() -> None:
+    args = parse_args()
+    logging.basicConfig(level=args.log_level.upper())
+    results = benchmark.run_matrix(
+        args.antennas, args.channels, args.continuum_factor, args.sd_int_time,
+        output_int_time=args.output_int_time, dumps=args.dumps, n_xengs=args.xengs,
+        cpu=args.cpu, cpu_processes=args.cpu_processes)
+    print(benchmark.format_results(results))
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+"""Emit synthetic CBF baseline-correlation-products traffic for load-testing ingest.
+
+The CBF stream attributes are not written anywhere: the ingest under test
+needs to be given matching values (see
+:func:`katsdpingest.cbf_generator.make_cbf_attr`).
+"""
+
+import argparse
+import asyncio
+import logging
+import signal
+
+import spead2
+from katsdptelstate import endpoint
+
+from katsdpingest import cbf_generator
+
+
+logger = logging.getLogger("katsdpingest.cbf_generator")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        'cbf_spead', type=endpoint.endpoint_list_parser(7148),
+        help='destination endpoints for the X-engine output, in the form <ip>[+<count>][:port]')
+    parser.add_argument(
+        '--interface', type=str,
+        help='IP address of interface on which to send [default=auto]')
+    parser.add_argument(
+        '--ttl', type=int, default=1,
+        help='multicast TTL [default=%(default)s]')
+    parser.add_argument(
+        '--antennas', type=int, default=4,
+        help='number of antennas [default=%(default)s]')
+    parser.add_argument(
+        '--channels', type=int, default=4096,
+        help='number of channels [default=%(default)s]')
+    parser.add_argument(
+        '--xengs', type=int,
+        help='number of X engines (heaps per dump) [default=4 per endpoint]')
+    parser.add_argument(
+        '--int-time', type=float, default=0.5,
+        help='integration time in seconds [default=%(default)s]')
+    parser.add_argument(
+        '--speedup', type=float, default=1.0,
+        help='ratio of data rate to real time, or 0 to send as fast as possible '
+             '[default=%(default)s]')
+    parser.add_argument(
+        '--dumps', type=int,
+        help='number of dumps to send [default=infinite]')
+    parser.add_argument(
+        '--max-packet-size', type=int, default=cbf_generator.DEFAULT_MAX_PACKET_SIZE,
+        help='maximum packet size, including headers [default=%(default)s]')
+    parser.add_argument(
+        '--descriptor-interval', type=int, default=1,
+        help='dumps between repeated descriptors, or 0 to send them only once '
+             '[default=%(default)s]')
+    parser.add_argument(
+        '-l', '--log-level', type=str, default='INFO', metavar='LEVEL',
+        help='log level to use [default=%(default)s]')
+    args = parser.parse_args()
+    if args.xengs is None:
+        args.xengs = 4 * len(args.cbf_spead)
+    if args.xengs % len(args.cbf_spead) != 0:
+        parser.error('--xengs must be a multiple of the number of endpoints')
+    if args.channels % args.xengs != 0:
+        parser.error('--channels must be a multiple of --xengs')
+    if args.speedup < 0:
+        parser.error('--speedup cannot be negative')
+    return args
+
+
+async def main() -> None:
+    args = parse_args()
+    logging.basicConfig(level=args.log_level.upper())
+
+    cbf_attr = cbf_generator.make_cbf_attr(args.antennas, args.channels, args.xengs,
+                                           args.int_time)
+    config = cbf_generator.make_stream_config(cbf_attr, args.speedup, args.max_packet_size)
+    stream = cbf_generator.make_udp_stream(
+        spead2.ThreadPool(), args.cbf_spead, config, args.interface, args.ttl)
+    generator = cbf_generator.CBFGenerator(
+        stream, cbf_attr, descriptor_interval=args.descriptor_interval)
+    logger.info('Sending %d heaps of %d bytes every %.3f s (%.3f Gb/s)',
+                generator.n_xengs, cbf_generator.dump_size(cbf_attr) // generator.n_xengs,
+                cbf_attr['int_time'] / args.speedup if args.speedup else 0.0,
+                config.rate * 8e-9)
+
+    loop = asyncio.get_event_loop()
+    task = loop.create_task(generator.run(args.dumps, args.speedup))
+    for sig in [signal.SIGINT, signal.SIGTERM]:
+        loop.add_signal_handler(sig, task.cancel)
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    await generator.stop()
+    if generator.late_dumps:
+        logger.warning('%d dumps could not be sent on time', generator.late_dumps)
+    logger.info('Done')
+
+
+if __name__ == '__main__':
+    asyncio.get_event_loop().run_until_complete(main())
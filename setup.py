@@ -15,14 +15,16 @@ setup(
     include_package_data=True,
     scripts=[
         "scripts/ingest.py",
-        "scripts/ingest_autotune.py"
+        "scripts/ingest_autotune.py",
+        "scripts/ingest_cbf_generator.py",
+        "scripts/ingest_benchmark.py"
     ],
     setup_requires=['katversion'],
     install_requires=[
         'aiokatcp>=0.7.0',   # Need 0.7 for auto_strategy
         'aiomonitor',
         'numpy>=1.13.0',     # For np.unique with axis (might really need a higher version)
-        'spead2>=3.0.1',
+        'spead2>=4.1',       # For chunk stream groups
         'katsdpsigproc',
         'katsdpservices[argparse,aiomonitor]',
         'katsdptelstate[aio]',